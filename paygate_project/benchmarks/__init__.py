@@ -0,0 +1,46 @@
+"""
+Performance benchmarks for paygate.
+
+Each module is a standalone script, run from the project root:
+
+    python -m benchmarks.<module> --help
+
+They are not collected by pytest.
+"""
+import os
+import statistics
+
+
+def setup_django(settings_module='paygate_project.test_settings'):
+    """Configure Django for a benchmark run (in-memory SQLite by default)."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+    # Lets the Django test client talk to the app (ALLOWED_HOSTS 'testserver')
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+
+def summarize(samples):
+    """
+    Latency summary in milliseconds.
+    Args:
+        samples: Iterable of durations in seconds
+    Returns:
+        dict: count, mean, p50, p95, p99 and max
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': round(statistics.fmean(ordered) * 1000, 3),
+        'p50': round(pct(50), 3),
+        'p95': round(pct(95), 3),
+        'p99': round(pct(99), 3),
+        'max': round(ordered[-1] * 1000, 3),
+    }
@@ -0,0 +1,133 @@
+"""
+Realtime webhook latency while the retry queue is saturated.
+
+Fills the broker with a backlog of slow retry tasks followed by realtime
+probe tasks, starts real worker processes and measures how long after the
+first task starts each probe starts running. Two layouts are compared:
+
+    single     one worker on one FIFO queue (the old default-queue setup)
+    dedicated  one worker per queue, as in docker-compose.yml
+
+By default a throwaway filesystem broker is used so the benchmark needs no
+services; pass --broker redis://localhost:6379/1 to measure against Redis.
+
+    python -m benchmarks.bench_celery_queues [--retries 200] [--probes 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from paygate_project.celery import app  # noqa: E402
+
+# Celery reads the Django settings lazily, so override them rather than app.conf
+_broker = os.environ.get('BENCH_BROKER_URL', 'filesystem://')
+_workdir = os.environ.get('BENCH_WORKDIR', '')
+settings.CELERY_BROKER_URL = _broker
+if _broker == 'filesystem://':
+    settings.CELERY_BROKER_TRANSPORT_OPTIONS = {
+        'data_folder_in': os.path.join(_workdir, 'broker'),
+        'data_folder_out': os.path.join(_workdir, 'broker'),
+        'polling_interval': 0.01,
+    }
+settings.CELERY_TASK_ALWAYS_EAGER = False
+settings.CELERY_TASK_IGNORE_RESULT = True
+
+
+def _record(kind):
+    # Wall clock, so timings from separate worker processes are comparable
+    with open(os.path.join(_workdir, 'events.log'), 'a') as fh:
+        fh.write(f'{kind} {time.time()}\n')
+
+
+@app.task(name='benchmarks.realtime_probe')
+def realtime_probe():
+    _record('probe')
+
+
+@app.task(name='benchmarks.slow_retry')
+def slow_retry(duration):
+    # Stands in for a retried delivery waiting on a slow merchant endpoint
+    _record('retry')
+    time.sleep(duration)
+
+
+def run(layout, retries, probes, retry_duration, concurrency, broker):
+    workdir = tempfile.mkdtemp(prefix='bench-celery-')
+    os.makedirs(os.path.join(workdir, 'broker'))
+    env = dict(os.environ, BENCH_WORKDIR=workdir, BENCH_BROKER_URL=broker)
+
+    if layout == 'single':
+        retry_queue = realtime_queue = 'celery'
+        worker_queues = ['celery']
+    else:
+        retry_queue, realtime_queue = 'webhook_retries', 'webhooks.lane.0'
+        worker_queues = ['webhooks.lane.0', 'webhook_retries']
+
+    # Publish from a child process so it picks up this run's broker settings
+    publisher = (
+        'from benchmarks.bench_celery_queues import slow_retry, realtime_probe\n'
+        f'[slow_retry.apply_async(({retry_duration},), queue={retry_queue!r}) for _ in range({retries})]\n'
+        f'[realtime_probe.apply_async(queue={realtime_queue!r}) for _ in range({probes})]\n'
+    )
+    subprocess.run([sys.executable, '-c', publisher], env=env, check=True)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'benchmarks.bench_celery_queues', 'worker',
+             '-Q', queue, '-n', f'{queue}@bench', '--pool', 'threads', '--concurrency', str(concurrency),
+             '--prefetch-multiplier', '1', '--without-gossip', '--without-mingle', '-l', 'warning'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for queue in worker_queues
+    ]
+    events_path = os.path.join(workdir, 'events.log')
+    events = []
+    try:
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            if os.path.exists(events_path):
+                with open(events_path) as fh:
+                    events = [line.split() for line in fh]
+                if sum(1 for kind, _ in events if kind == 'probe') >= probes:
+                    break
+            time.sleep(0.05)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+    first = min(float(ts) for _, ts in events)
+    return summarize(float(ts) - first for kind, ts in events if kind == 'probe')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--retries', type=int, default=200, help='Slow tasks flooding the retry queue')
+    parser.add_argument('--probes', type=int, default=20, help='Realtime probe tasks')
+    parser.add_argument('--retry-duration', type=float, default=0.05, help='Seconds each retry task runs')
+    parser.add_argument('--concurrency', type=int, default=4, help='Threads per worker')
+    parser.add_argument('--broker', default='filesystem://', help='Broker URL (default: temporary filesystem broker)')
+    args = parser.parse_args()
+
+    results = {}
+    for layout in ('idle', 'single', 'dedicated'):
+        results[layout] = run(
+            'dedicated' if layout == 'idle' else layout,
+            0 if layout == 'idle' else args.retries,
+            args.probes, args.retry_duration, args.concurrency, args.broker,
+        )
+    print(json.dumps({'benchmark': 'celery_queues', 'realtime_latency_ms': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+p99 latency under many concurrent clients, with and without the database
+connection pool.
+
+Each mode runs in its own interpreter against the PostgreSQL database from
+the DB_* environment variables (the production settings, not SQLite):
+
+    direct  DB_POOL_ENABLED=False, a new connection per request
+    pool    DB_POOL_ENABLED=True, connections borrowed from the psycopg pool
+
+The app is served in process and --clients closed-loop clients call a light
+endpoint (a merchant's completed payments: JWT auth plus two queries) for
+--duration seconds. Reports latency percentiles, errors and the pool's own
+statistics per mode as JSON:
+
+    python -m benchmarks.bench_db_pool --clients 200 --duration 30 --pool-max-size 20
+
+Use a scratch database: the tables are migrated and a benchmark merchant is
+created in it. With --clients above PostgreSQL's max_connections the direct
+mode is expected to fail requests.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from benchmarks import summarize
+
+MODES = ('direct', 'pool')
+ENDPOINT = '/paygate/api/v1/payment-complete/'
+
+
+def serve(args):
+    """Serve the app on a free local port. Returns its base URL and a merchant access token."""
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.management import call_command
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+    from paygate.serializers import CustomTokenObtainPairSerializer
+    from tests.factories import MerchantFactory
+
+    settings.ALLOWED_HOSTS = ['*']
+    call_command('migrate', verbosity=0)
+    merchant = MerchantFactory()
+    access = str(CustomTokenObtainPairSerializer.get_token(merchant.user).access_token)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadedWSGIServer):
+        request_queue_size = args.clients
+
+    server = Server(('127.0.0.1', 0), QuietHandler)
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}', access
+
+
+def client_loop(url, token, deadline, samples, errors, lock):
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {token}'
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=30)
+            error = None if response.status_code == 200 and response.json().get('success') else str(response.status_code)
+        except requests.RequestException as exc:
+            error = type(exc).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.append(elapsed)
+            if error:
+                errors[error] += 1
+
+
+def run_mode(args):
+    """Load one mode in this process. DB_POOL_ENABLED is set by the parent before Django starts."""
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'paygate_project.settings'
+    import django
+    django.setup()
+    from django.db import connection
+
+    base_url, token = serve(args)
+    # Warm up: opens the pool and loads the URLconf before timing
+    requests.get(base_url + ENDPOINT, headers={'Authorization': f'Bearer {token}'}, timeout=30)
+
+    samples, errors, lock = [], Counter(), threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=client_loop, args=(base_url + ENDPOINT, token, deadline, samples, errors, lock))
+        for _ in range(args.clients)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    pool = getattr(connection, 'pool', None)
+    return {
+        'mode': args.mode,
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'latency_ms': summarize(samples),
+        'errors': dict(errors),
+        'pool': pool.get_stats() if pool is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent closed-loop clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load per mode')
+    parser.add_argument('--pool-max-size', type=int, default=20, help='DB_POOL_MAX_SIZE for the pool mode')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    if not os.getenv('DB_NAME'):
+        parser.error('set DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT to a scratch PostgreSQL database')
+
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+
+    results = {}
+    for mode in args.modes:
+        env = dict(os.environ, DB_POOL_ENABLED=str(mode == 'pool'), DB_POOL_MAX_SIZE=str(args.pool_max_size))
+        command = [
+            sys.executable, '-m', 'benchmarks.bench_db_pool', '--mode', mode,
+            '--clients', str(args.clients), '--duration', str(args.duration),
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            sys.exit(f'{mode} run failed:\n{completed.stderr}')
+        results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    report = {
+        'benchmark': 'db_pool',
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'pool_max_size': args.pool_max_size,
+        'results': results,
+    }
+    if set(MODES) <= set(results):
+        direct, pool = results['direct']['latency_ms'], results['pool']['latency_ms']
+        if direct.get('p99') and pool.get('p99'):
+            report['p99_speedup'] = round(direct['p99'] / pool['p99'], 2)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Concurrent capture throughput for a single hot merchant, with the merchant's
+balance in one row and spread over counter slots.
+
+Each mode runs in its own interpreter against the PostgreSQL database from
+the DB_* environment variables (SQLite locks the whole database on write, so
+it cannot show row-lock contention):
+
+    single  MERCHANT_BALANCE_SLOTS=1, every capture updates the same row
+    slots   MERCHANT_BALANCE_SLOTS=--slots, captures update a random slot
+
+--threads workers capture authorized payments of one merchant for
+--duration seconds. Each capture is one transaction: the status change, its
+ledger entries and the balance increment, then --work-ms standing in for the
+rest of a capture request's transaction, during which the balance row stays
+locked. Reports captures per second, latency percentiles and whether the
+summed balance matches the captures, per mode, as JSON:
+
+    python -m benchmarks.bench_hot_merchant --threads 32 --duration 20 --slots 16
+
+Use a scratch database: the tables are migrated and a benchmark merchant with
+its payments is created in it.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks import summarize
+
+MODES = ('single', 'slots')
+AMOUNT = Decimal('100.00')
+
+
+def capture_loop(payments, deadline, work_seconds, samples, lock):
+    from django.db import connection, transaction
+
+    try:
+        while time.monotonic() < deadline:
+            with lock:
+                if not payments:
+                    return
+                payment = payments.pop()
+            start = time.perf_counter()
+            with transaction.atomic():
+                payment.status = 'captured'
+                payment.save()
+                time.sleep(work_seconds)
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples.append(elapsed)
+    finally:
+        connection.close()
+
+
+def run_mode(args):
+    """Run one mode in this process. MERCHANT_BALANCE_SLOTS is set by the parent before Django starts."""
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'paygate_project.settings'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    from paygate.ledger import Ledger
+    from paygate.models import Order, Payment
+    from tests.factories import MerchantFactory
+
+    call_command('migrate', verbosity=0)
+    merchant = MerchantFactory()
+    orders = Order.objects.bulk_create(
+        [Order(merchant=merchant, amount=AMOUNT) for _ in range(args.payments)], batch_size=2000,
+    )
+    # Saved as new instances, so capturing them posts to the ledger as a status change
+    payments = Payment.objects.bulk_create(
+        [Payment(order=order, amount=AMOUNT, status='authorized') for order in orders], batch_size=2000,
+    )
+
+    samples, lock = [], threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=capture_loop, args=(payments, deadline, args.work_ms / 1000, samples, lock))
+        for _ in range(args.threads)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    expected = len(samples) * (AMOUNT - AMOUNT * Decimal('2.00') / 100)
+    return {
+        'mode': args.mode,
+        'slots': settings.MERCHANT_BALANCE_SLOTS,
+        'captures': len(samples),
+        'throughput_per_s': round(len(samples) / elapsed, 1),
+        'latency_ms': summarize(samples),
+        'balance_matches': Ledger.balance(merchant) == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32, help='Concurrent capturing threads')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load per mode')
+    parser.add_argument('--slots', type=int, default=16, help='MERCHANT_BALANCE_SLOTS for the slots mode')
+    parser.add_argument('--work-ms', type=float, default=2, help='Time spent in each capture transaction after the balance update')
+    parser.add_argument('--payments', type=int, default=50000, help='Authorized payments created per mode; the run stops early if all are captured')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    if not os.getenv('DB_NAME'):
+        parser.error('set DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT to a scratch PostgreSQL database')
+
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+
+    results = {}
+    for mode in args.modes:
+        env = dict(
+            os.environ,
+            MERCHANT_BALANCE_SLOTS=str(args.slots if mode == 'slots' else 1),
+            # One connection per thread, opened once, so connection waits do not hide lock waits
+            DB_POOL_ENABLED='False',
+        )
+        command = [
+            sys.executable, '-m', 'benchmarks.bench_hot_merchant', '--mode', mode,
+            '--threads', str(args.threads), '--duration', str(args.duration), '--work-ms', str(args.work_ms),
+            '--payments', str(args.payments),
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            sys.exit(f'{mode} run failed:\n{completed.stderr}')
+        results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    report = {
+        'benchmark': 'hot_merchant',
+        'threads': args.threads,
+        'duration_s': args.duration,
+        'work_ms': args.work_ms,
+        'results': results,
+    }
+    if 'single' in results and 'slots' in results:
+        report['throughput_speedup'] = round(
+            results['slots']['throughput_per_s'] / max(results['single']['throughput_per_s'], 0.1), 2
+        )
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Micro-benchmarks of the service-layer and serialization hot paths, checked
+against a stored baseline.
+
+Cases:
+
+    process_payment            PaymentProcessor.process_payment (authorize + capture)
+    capture                    PaymentProcessor.capture_authorized_payment
+    refund                     PaymentProcessor.process_refund
+    payment_save               Payment.save on a captured payment (commission math)
+    serializer_<n>             PaymentSerializer(many=True).data for 1, 100 and 10k rows
+    response_success/error     JSONResponseSender envelopes
+    admin_stats_<n>            AdminStatsView at 100, 1k and 10k payments
+    merchant_stats_<n>         MerchantStatsView at 100, 1k and 10k payments
+
+Each case's p50 is compared with benchmarks/baselines/hot_paths.json. A case
+more than --threshold slower (and by more than --min-delta-ms) is a
+regression, and the run exits with status 1. Baselines are machine specific:
+record them on the machine that checks them.
+
+    python -m benchmarks.bench_hot_paths [--only serializer] [--threshold 0.25]
+    python -m benchmarks.bench_hot_paths --update-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from decimal import Decimal
+from unittest.mock import patch
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from paygate.jsonResponse.response import JSONResponseSender  # noqa: E402
+from paygate.models import Order, Payment  # noqa: E402
+from paygate.serializers import PaymentSerializer  # noqa: E402
+from paygate.services import PaymentProcessor  # noqa: E402
+from paygate.views import AdminStatsView, MerchantStatsView  # noqa: E402
+from tests.factories import AdminUserFactory, MerchantFactory, OrderFactory, PaymentFactory  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'hot_paths.json')
+CARD = {'card_number': '4111111111111111', 'expiry': '12/30', 'cvv': '123'}
+SERIALIZER_SIZES = (1, 100, 10000)
+STATS_SIZES = (100, 1000, 10000)
+
+CASES = []
+
+
+def case(name, iterations):
+    """
+    Register a case. The decorated function gets the iteration count, does
+    its untimed setup and returns the callable timed once per iteration.
+    """
+    def register(setup):
+        CASES.append((name, iterations, setup))
+        return setup
+    return register
+
+
+def bulk_payments(merchant, count, status='captured'):
+    """Insert count captured orders and payments without per-row saves."""
+    orders = Order.objects.bulk_create(
+        Order(order_id=str(uuid.uuid4()), merchant=merchant, amount=Decimal('100.00'), status='paid')
+        for _ in range(count)
+    )
+    Payment.objects.bulk_create(
+        Payment(
+            payment_id=str(uuid.uuid4()), order=order, amount=order.amount, status=status,
+            commission_amount=Decimal('2.00'), merchant_payout=Decimal('98.00'),
+        )
+        for order in orders
+    )
+
+
+@case('process_payment', 500)
+def process_payment(iterations):
+    merchant = MerchantFactory()
+    orders = iter([OrderFactory(merchant=merchant) for _ in range(iterations)])
+    return lambda: PaymentProcessor.process_payment(next(orders), CARD)
+
+
+@case('capture', 500)
+def capture(iterations):
+    merchant = MerchantFactory()
+    payments = iter([
+        Payment.objects.select_related('order__merchant').get(pk=PaymentFactory(order=OrderFactory(merchant=merchant), status='authorized').pk)
+        for _ in range(iterations)
+    ])
+    return lambda: PaymentProcessor.capture_authorized_payment(next(payments))
+
+
+@case('refund', 500)
+def refund(iterations):
+    merchant = MerchantFactory()
+    payments = iter([
+        Payment.objects.select_related('order__merchant').get(pk=PaymentFactory(order=OrderFactory(merchant=merchant), status='captured').pk)
+        for _ in range(iterations)
+    ])
+    return lambda: PaymentProcessor.process_refund(next(payments))
+
+
+@case('payment_save', 2000)
+def payment_save(iterations):
+    payment = PaymentFactory(status='captured')
+    return payment.save
+
+
+for size in SERIALIZER_SIZES:
+    @case(f'serializer_{size}', max(5, 2000 // size))
+    def serializer(iterations, size=size):
+        merchant = MerchantFactory()
+        bulk_payments(merchant, size)
+        payments = list(Payment.objects.filter(order__merchant=merchant).select_related('order'))
+        return lambda: PaymentSerializer(payments, many=True).data
+
+
+@case('response_success', 2000)
+def response_success(iterations):
+    merchant = MerchantFactory()
+    bulk_payments(merchant, 100)
+    data = PaymentSerializer(Payment.objects.filter(order__merchant=merchant).select_related('order'), many=True).data
+    return lambda: JSONResponseSender.send_success(data=data, message='Completed payments retrieved successfully')
+
+
+@case('response_error', 5000)
+def response_error(iterations):
+    return lambda: JSONResponseSender.send_error(3001, 'Payment failed', 'Card declined')
+
+
+def stats_view(view_class, size, admin=False):
+    """Give a merchant size payments and return a call of the stats view."""
+    merchant = MerchantFactory()
+    bulk_payments(merchant, size)
+    user = AdminUserFactory() if admin else merchant.user
+    view = view_class.as_view()
+    factory = APIRequestFactory()
+
+    def call():
+        request = factory.get('/stats/')
+        force_authenticate(request, user=user)
+        return view(request)
+    return call
+
+
+for size in STATS_SIZES:
+    @case(f'admin_stats_{size}', 50)
+    def admin_stats(iterations, size=size):
+        return stats_view(AdminStatsView, size, admin=True)
+
+    @case(f'merchant_stats_{size}', 50)
+    def merchant_stats(iterations, size=size):
+        return stats_view(MerchantStatsView, size)
+
+
+def measure(iterations, setup, rounds):
+    """
+    Time a case in a transaction rolled back afterwards, so cases see only
+    their own rows. Keeps the round with the lowest p50, which is the one
+    least disturbed by other work on the machine.
+    """
+    with transaction.atomic():
+        func = setup(iterations * rounds + 1)
+        func()  # Warm-up
+        best = None
+        for _ in range(rounds):
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                func()
+                samples.append(time.perf_counter() - start)
+            summary = summarize(samples)
+            if best is None or summary['p50'] < best['p50']:
+                best = summary
+        transaction.set_rollback(True)
+    return best
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Annotate results with their baseline p50 and flag regressions."""
+    regressions = []
+    for name, latency in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        delta = latency['p50'] - base['p50']
+        latency['baseline_p50'] = base['p50']
+        latency['change_pct'] = round(delta / base['p50'] * 100, 1) if base['p50'] else None
+        if latency['p50'] > base['p50'] * (1 + threshold) and delta > min_delta_ms:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='Regex selecting the cases to run')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed p50 slowdown over baseline (0.25 = 25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.02, help='Ignore slowdowns smaller than this')
+    parser.add_argument('--rounds', type=int, default=3, help='Timed rounds per case; the fastest is kept')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    results = {}
+    # The test settings log synchronously to stderr; keep that out of the timings
+    logging.disable(logging.INFO)
+    # Random outcomes pinned to success
+    with patch('paygate.services.random.random', return_value=0.1), \
+            patch('paygate.tasks.random.random', return_value=0.1):
+        for name, iterations, setup in CASES:
+            if args.only and not re.search(args.only, name):
+                continue
+            results[name] = measure(iterations, setup, args.rounds)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        regressions = []
+    else:
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+
+    print(json.dumps({
+        'benchmark': 'hot_paths',
+        'threshold': args.threshold,
+        'latency_ms': results,
+        'regressions': regressions,
+    }, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Per-request authentication overhead: JWTAuthentication vs CachedJWTAuthentication.
+
+Authenticates the same bearer token repeatedly, as a merchant integration
+does within one access token lifetime, and reports the cost of token
+verification alone and of the full authenticate() call (which also loads
+the user).
+
+    python -m benchmarks.bench_jwt_auth [--iterations 20000]
+"""
+import argparse
+import json
+import time
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from rest_framework_simplejwt.authentication import JWTAuthentication  # noqa: E402
+
+from paygate.authentication import CachedJWTAuthentication, verified_tokens  # noqa: E402
+from paygate.serializers import CustomTokenObtainPairSerializer  # noqa: E402
+from tests.factories import MerchantFactory  # noqa: E402
+
+
+def time_calls(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000, help='Authentications timed per case')
+    args = parser.parse_args()
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    merchant = MerchantFactory()
+    access = str(CustomTokenObtainPairSerializer.get_token(merchant.user).access_token)
+    request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}'))
+    raw_token = access.encode()
+
+    results = {}
+    for name, auth in (('uncached', JWTAuthentication()), ('cached', CachedJWTAuthentication())):
+        verified_tokens.clear()
+        results[name] = {
+            'verify_token': time_calls(lambda: auth.get_validated_token(raw_token), args.iterations),
+            'authenticate': time_calls(lambda: auth.authenticate(request), args.iterations),
+        }
+    print(json.dumps({'benchmark': 'jwt_auth', 'latency_ms': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
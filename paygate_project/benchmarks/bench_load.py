@@ -0,0 +1,262 @@
+"""
+End-to-end load test of the merchant payment flow.
+
+Sessions arrive as a Poisson process at --rate per second. This is an open
+model: a slow server does not slow the arrivals down, and time spent waiting
+for a free client thread shows up as schedule lag. Each session is one of:
+
+    signup    register -> token
+    checkout  order -> payment [-> refund] [-> stats], as a merchant
+              registered during warm-up
+
+--signup-ratio picks between them. In a checkout, --refund-ratio of captured
+payments are refunded and --stats-ratio of sessions read the merchant
+stats. Request bodies come from the factories in tests/factories.py.
+
+Reports throughput, latency percentiles per endpoint and error counts by
+ErrorCodes name as JSON, for comparing runs over time:
+
+    python -m benchmarks.bench_load --base-url http://localhost:8000 --rate 20 --duration 60 --output load.json
+
+Without --base-url the app is served in process from a throwaway SQLite DB
+with the test settings. Client and server then share one interpreter, so use
+that for smoke runs and trends, not capacity numbers.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from paygate.utils.error_codes_constants import ErrorCodes  # noqa: E402
+from tests.factories import MerchantFactory, OrderFactory, UserFactory  # noqa: E402
+
+PASSWORD = 'loadtest-pass-123'
+CARD = {'card_number': '4111111111111111', 'expiry': '12/30', 'cvv': '123'}
+ENDPOINTS = {
+    'register': ('POST', '/paygate/api/v1/auth/register/'),
+    'token': ('POST', '/paygate/api/v1/auth/token/'),
+    'order': ('POST', '/paygate/api/v1/orders/'),
+    'payment': ('POST', '/paygate/api/v1/payments/'),
+    'refund': ('POST', '/paygate/api/v1/refunds/'),
+    'stats': ('GET', '/paygate/api/v1/merchants/stats/'),
+}
+ERROR_NAMES = {value: name for name, value in vars(ErrorCodes).items() if name.isupper() and isinstance(value, int)}
+
+
+class SessionFailed(Exception):
+    """A step of a session failed, so the rest of it is skipped."""
+
+
+class Recorder:
+    """Latencies and error counts per endpoint, shared by all client threads."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.schedule_lag = []
+        self.sessions = Counter()
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, elapsed, error):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if error:
+                self.errors[endpoint][error] += 1
+
+    def session(self, kind, lag, ok):
+        with self._lock:
+            self.schedule_lag.append(lag)
+            self.sessions[f'{kind}_{"ok" if ok else "failed"}'] += 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            samples = self.latencies.get(endpoint, [])
+            if not samples:
+                continue
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'latency_ms': summarize(samples),
+                'errors': dict(self.errors[endpoint].most_common()),
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2),
+            'sessions': dict(self.sessions),
+            'schedule_lag_ms': summarize(self.schedule_lag),
+            'endpoints': endpoints,
+        }
+
+
+class Client:
+    """Thread-local HTTP sessions recording every call."""
+
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def call(self, endpoint, token=None, body=None):
+        """
+        Call an endpoint and return its `data`.
+        Raises:
+            SessionFailed: on transport errors, non-2xx statuses and error payloads
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        method, path = ENDPOINTS[endpoint]
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+
+        start = time.perf_counter()
+        error, data = None, None
+        try:
+            response = session.request(method, self.base_url + path, json=body, headers=headers, timeout=self.timeout)
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = {}
+            if response.status_code >= 400 and not payload.get('exception'):
+                error = f'HTTP {response.status_code}'
+            elif payload.get('success') is False:
+                code = payload['exception'].get('code')
+                error = ERROR_NAMES.get(code, f'code {code}')
+            else:
+                data = payload.get('data')
+        except requests.RequestException as exc:
+            error = type(exc).__name__
+        self.recorder.request(endpoint, time.perf_counter() - start, error)
+        if error:
+            raise SessionFailed(error)
+        return data
+
+
+def signup(client, run_id):
+    """Register a merchant and log in. Returns (email, access token)."""
+    merchant = MerchantFactory.build(user=UserFactory.build(email=f'load-{run_id}-{uuid.uuid4().hex[:12]}@example.com'))
+    client.call('register', body={
+        'user': {'email': merchant.user.email, 'name': merchant.user.name, 'password': PASSWORD},
+        'webhook_url': merchant.webhook_url,
+    })
+    data = client.call('token', body={'email': merchant.user.email, 'password': PASSWORD})
+    return merchant.user.email, data['access']
+
+
+def checkout(client, token, args, rng):
+    """Create an order, pay it, then maybe refund it and read stats."""
+    order = client.call('order', token, {'amount': str(OrderFactory.build().amount), 'currency': 'INR'})
+    payment = client.call('payment', token, {'order_id': order['order_id'], 'card_details': CARD})
+    if payment['status'] == 'captured' and rng.random() < args.refund_ratio:
+        client.call('refund', token, {'payment_id': payment['payment_id']})
+    if rng.random() < args.stats_ratio:
+        client.call('stats', token)
+
+
+def run_session(client, recorder, merchants, args, run_id, scheduled, seed):
+    lag = max(0.0, time.perf_counter() - scheduled)
+    rng = random.Random(seed)
+    kind = 'signup' if rng.random() < args.signup_ratio else 'checkout'
+    try:
+        if kind == 'signup':
+            signup(client, run_id)
+        else:
+            checkout(client, rng.choice(merchants)[1], args, rng)
+        recorder.session(kind, lag, True)
+    except (SessionFailed, KeyError, TypeError):
+        recorder.session(kind, lag, False)
+
+
+def serve_in_process():
+    """Serve the app on a free local port from a fresh SQLite DB. Returns its base URL."""
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.management import call_command
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+
+    settings.DATABASES['default'].update({
+        'NAME': os.path.join(tempfile.mkdtemp(prefix='load-test-'), 'db.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+    })
+    settings.ALLOWED_HOSTS = ['*']
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='Server to load, e.g. http://localhost:8000 (default: in process)')
+    parser.add_argument('--rate', type=float, default=10, help='Session arrivals per second')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of arrivals')
+    parser.add_argument('--concurrency', type=int, default=32, help='Client threads')
+    parser.add_argument('--merchants', type=int, default=10, help='Merchants registered during warm-up')
+    parser.add_argument('--signup-ratio', type=float, default=0.05)
+    parser.add_argument('--refund-ratio', type=float, default=0.2)
+    parser.add_argument('--stats-ratio', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=10, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='Also write the JSON results to this file')
+    args = parser.parse_args()
+
+    base_url = args.base_url or serve_in_process()
+    run_id = uuid.uuid4().hex[:8]
+    rng = random.Random(args.seed)
+
+    warmup = Client(base_url, Recorder(), args.timeout)
+    merchants = [signup(warmup, run_id) for _ in range(args.merchants)]
+
+    recorder = Recorder()
+    client = Client(base_url, recorder, args.timeout)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        scheduled = started
+        while True:
+            scheduled += rng.expovariate(args.rate)
+            if scheduled - started >= args.duration:
+                break
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            pool.submit(run_session, client, recorder, merchants, args, run_id, scheduled, rng.random())
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'benchmark': 'load_test',
+        'base_url': base_url if args.base_url else 'in-process',
+        'config': {
+            key: getattr(args, key)
+            for key in ('rate', 'duration', 'concurrency', 'merchants', 'signup_ratio', 'refund_ratio', 'stats_ratio', 'seed')
+        },
+        'results': recorder.report(elapsed),
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Login throughput: single-mint login vs the previous double-mint login.
+
+Drives POST /paygate/api/v1/auth/token/ for a set of merchant users through
+the current CustomTokenObtainPairSerializer and through a copy of the
+previous implementation (pair minted by TokenObtainPairSerializer.validate,
+minted again by get_token, then a separate Merchant query). Passwords use the
+test settings' MD5 hasher so the token work is not hidden behind hashing.
+
+    python -m benchmarks.bench_login [--users 50] [--iterations 1000]
+"""
+import argparse
+import json
+import time
+from unittest.mock import patch
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer  # noqa: E402
+
+from paygate.models import Merchant  # noqa: E402
+from paygate.serializers import CustomTokenObtainPairSerializer  # noqa: E402
+from paygate.views import CustomTokenObtainPairView  # noqa: E402
+from tests.factories import MerchantFactory  # noqa: E402
+
+PASSWORD = 'benchpass123'
+URL = '/paygate/api/v1/auth/token/'
+
+
+class DoubleMintLoginSerializer(TokenObtainPairSerializer):
+    """The login serializer as it was before tokens were minted once."""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.get_token(self.user)
+        data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+        data['email'] = self.user.email
+        data['name'] = self.user.name
+        try:
+            merchant = Merchant.objects.get(user=self.user)
+            data['api_key'] = merchant.api_key
+            data['role'] = 'merchant'
+        except Merchant.DoesNotExist:
+            data['api_key'] = None
+            data['role'] = 'admin' if self.user.is_staff else 'user'
+        return data
+
+
+def run(serializer_class, emails, iterations):
+    client = Client()
+    samples = []
+    with patch.object(CustomTokenObtainPairView, 'serializer_class', serializer_class):
+        # CaptureQueriesContext loses queries to the request_started reset, so count at the cursor
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *rest: queries.append(sql) or execute(sql, *rest)):
+            client.post(URL, {'email': emails[0], 'password': PASSWORD}, content_type='application/json')
+        started = time.perf_counter()
+        for i in range(iterations):
+            start = time.perf_counter()
+            response = client.post(
+                URL, {'email': emails[i % len(emails)], 'password': PASSWORD}, content_type='application/json'
+            )
+            samples.append(time.perf_counter() - start)
+            assert json.loads(response.content)['success'], response.content
+        elapsed = time.perf_counter() - started
+    return {
+        'logins_per_second': round(iterations / elapsed, 1),
+        'queries_per_login': len(queries),
+        'latency_ms': summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='Merchant accounts logged into round-robin')
+    parser.add_argument('--iterations', type=int, default=1000, help='Logins timed per implementation')
+    args = parser.parse_args()
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    emails = []
+    for _ in range(args.users):
+        merchant = MerchantFactory()
+        merchant.user.set_password(PASSWORD)
+        merchant.user.save()
+        emails.append(merchant.user.email)
+
+    results = {
+        'double_mint': run(DoubleMintLoginSerializer, emails, args.iterations),
+        'single_mint': run(CustomTokenObtainPairSerializer, emails, args.iterations),
+    }
+    print(json.dumps({'benchmark': 'login', 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
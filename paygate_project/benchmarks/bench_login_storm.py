@@ -0,0 +1,133 @@
+"""
+Payment latency during a login storm.
+
+Login threads hammer POST /paygate/api/v1/auth/token/ with real PBKDF2 (or
+Argon2) hashes while one client times POST /paygate/api/v1/payments/, all in
+one process as in a gthread gunicorn worker. Three runs are compared:
+
+    idle       payments only
+    unbounded  storm with the hashing pool as wide as the storm
+    bounded    storm with PASSWORD_HASH_CONCURRENCY / PASSWORD_HASH_QUEUE_TIMEOUT
+
+Uses a throwaway file-backed SQLite DB so the threads share data.
+
+    python -m benchmarks.bench_login_storm [--storm-threads 8] [--payments 200] [--hasher argon2]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default'].update({
+    'NAME': os.path.join(tempfile.mkdtemp(prefix='bench-storm-'), 'db.sqlite3'),
+    'OPTIONS': {'timeout': 30},
+})
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from paygate.models import User  # noqa: E402
+from paygate.serializers import CustomTokenObtainPairSerializer  # noqa: E402
+from paygate.utils.hashing import PasswordHashPool  # noqa: E402
+from tests.factories import MerchantFactory, OrderFactory  # noqa: E402
+
+PASSWORD = 'benchpass123'
+HASHERS = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+}
+
+
+def storm(emails, stop, counts):
+    client = Client()
+    i = 0
+    while not stop.is_set():
+        response = client.post(
+            '/paygate/api/v1/auth/token/',
+            {'email': emails[i % len(emails)], 'password': PASSWORD},
+            content_type='application/json',
+        )
+        counts['shed' if response.status_code == 503 else 'ok'] += 1
+        i += 1
+    connection.close()
+
+
+def run(pool, storm_threads, emails, merchant, payments):
+    client = APIClient()
+    access = CustomTokenObtainPairSerializer.get_token(merchant.user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+    orders = [OrderFactory(merchant=merchant).order_id for _ in range(payments)]
+
+    stop = threading.Event()
+    counts = {'ok': 0, 'shed': 0}
+    samples = []
+    with patch('paygate.models.password_hashing', pool):
+        threads = [threading.Thread(target=storm, args=(emails, stop, counts)) for _ in range(storm_threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5 if threads else 0)
+        started = time.perf_counter()
+        for order_id in orders:
+            start = time.perf_counter()
+            client.post('/paygate/api/v1/payments/', {
+                'order_id': order_id,
+                'card_details': {'card_number': '4111111111111111', 'expiry': '12/30', 'cvv': '123'},
+            }, format='json')
+            samples.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return {
+        'payment_latency_ms': summarize(samples),
+        'logins_per_second': round(counts['ok'] / elapsed, 1),
+        'logins_shed': counts['shed'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storm-threads', type=int, default=8, help='Concurrent login clients')
+    parser.add_argument('--payments', type=int, default=200, help='Payments timed per run')
+    parser.add_argument('--hasher', choices=sorted(HASHERS), default='pbkdf2')
+    args = parser.parse_args()
+
+    settings.PASSWORD_HASHERS = [HASHERS[args.hasher]]
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    merchant = MerchantFactory()
+    users = [MerchantFactory().user for _ in range(args.storm_threads * 2)]
+    users[0].set_password(PASSWORD)
+    User.objects.filter(pk__in=[u.pk for u in users]).update(password=users[0].password)
+    emails = [u.email for u in users]
+
+    bounded = PasswordHashPool(settings.PASSWORD_HASH_CONCURRENCY, settings.PASSWORD_HASH_QUEUE_TIMEOUT)
+    unbounded = PasswordHashPool(max(1, args.storm_threads), 3600)
+    results = {
+        'idle': run(bounded, 0, emails, merchant, args.payments),
+        'unbounded': run(unbounded, args.storm_threads, emails, merchant, args.payments),
+        'bounded': run(bounded, args.storm_threads, emails, merchant, args.payments),
+    }
+    print(json.dumps({
+        'benchmark': 'login_storm',
+        'hasher': args.hasher,
+        'cpus': os.cpu_count(),
+        'password_hash_concurrency': settings.PASSWORD_HASH_CONCURRENCY,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Capture latency and queries with per-merchant pricing.
+
+Creates --merchants merchants, each with a pricing plan and volume tiers and
+a capture last month that puts it in a tier, then captures --captures
+authorized payments spread over them, priced two ways:
+
+    db      the plan, its tiers and last month's volume queried per capture
+    cached  PricingCache, loaded once per process with the volumes recorded
+            by PricingCache.record_volumes (the shipped path)
+
+Reports capture latency, queries per capture, the one-off cache load and the
+nightly volume recording.
+Runs on in-memory SQLite by default; set DJANGO_SETTINGS_MODULE to measure
+against Postgres and Redis.
+
+    python -m benchmarks.bench_pricing [--merchants 1000] [--captures 2000]
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Sum  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from paygate.models import LedgerEntry, Order, Payment, PricingPlan, PricingTier  # noqa: E402
+from paygate.pricing import PricingCache  # noqa: E402
+from tests.factories import MerchantFactory  # noqa: E402
+
+AMOUNT = Decimal('100.00')
+
+
+def db_terms(merchant_id):
+    """Pricing read from the database on every capture, for comparison."""
+    plan = (
+        PricingPlan.objects.filter(merchant_id=merchant_id).prefetch_related('tiers').first()
+        or PricingPlan.objects.filter(merchant__isnull=True).prefetch_related('tiers').first()
+    )
+    month = timezone.localdate().replace(day=1)
+    start, end = PricingCache._previous_month(month)
+    volume = LedgerEntry.objects.filter(
+        entry_type='capture', account__kind='merchant', account__merchant_id=merchant_id,
+        created_at__gte=start, created_at__lt=end,
+    ).aggregate(total=Sum('amount'))['total'] or 0
+    for tier in plan.tiers.order_by('-min_volume'):
+        if volume >= tier.min_volume:
+            return tier.percentage, tier.fixed_fee
+    return plan.percentage, plan.fixed_fee
+
+
+def create_merchants(count):
+    """Merchants with a tiered plan each and a capture last month of a random size."""
+    month = timezone.localdate().replace(day=1)
+    last_month = timezone.make_aware(datetime.combine(month - timedelta(days=10), datetime.min.time()))
+    merchants = [MerchantFactory() for _ in range(count)]
+    for merchant in merchants:
+        plan = PricingPlan.objects.create(merchant=merchant, percentage=Decimal('2.00'), fixed_fee=Decimal('0.30'))
+        PricingTier.objects.create(plan=plan, min_volume=Decimal('5000.00'), percentage=Decimal('1.75'))
+        PricingTier.objects.create(plan=plan, min_volume=Decimal('50000.00'), percentage=Decimal('1.50'))
+        amount = Decimal(random.randrange(1000, 100000))
+        payment = Payment.objects.create(order=Order.objects.create(merchant=merchant, amount=amount), amount=amount, status='captured')
+        LedgerEntry.objects.filter(payment=payment).update(created_at=last_month)
+    return merchants
+
+
+def authorized_payments(merchants, count):
+    orders = Order.objects.bulk_create([Order(merchant=random.choice(merchants), amount=AMOUNT) for _ in range(count)])
+    return Payment.objects.bulk_create([Payment(order=order, amount=AMOUNT, status='authorized') for order in orders])
+
+
+def time_captures(payments):
+    """Capture each payment, as the payment view does, and count the queries of each save."""
+    samples, total_queries = [], 0
+    for payment in payments:
+        payment = Payment.objects.select_related('order').get(pk=payment.pk)
+        payment.status = 'captured'
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            payment.save()
+            samples.append(time.perf_counter() - start)
+        total_queries += len(queries.captured_queries)
+        connection.queries_log.clear()
+    return {'latency_ms': summarize(samples), 'queries_per_capture': round(total_queries / len(payments), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--merchants', type=int, default=1000, help='Merchants with a tiered pricing plan')
+    parser.add_argument('--captures', type=int, default=2000, help='Payments captured per mode')
+    args = parser.parse_args()
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    merchants = create_merchants(args.merchants)
+    start = time.perf_counter()
+    PricingCache.record_volumes()
+    record_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    with patch.object(PricingCache, 'terms', side_effect=db_terms):
+        db = time_captures(authorized_payments(merchants, args.captures))
+
+    PricingCache.reset()
+    start = time.perf_counter()
+    PricingCache.terms(None)
+    load_ms = round((time.perf_counter() - start) * 1000, 3)
+    cached = time_captures(authorized_payments(merchants, args.captures))
+
+    print(json.dumps({
+        'benchmark': 'pricing',
+        'merchants': args.merchants,
+        'captures': args.captures,
+        'cache_load_ms': load_ms,
+        'record_volumes_ms': record_ms,
+        'results': {'db': db, 'cached': cached},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Startup cost of the web and worker processes.
+
+Each target boots in a fresh interpreter under `python -X importtime`:
+
+    web       Django setup, WSGI handler and URLconf, as a gunicorn worker
+              loads them (without preload)
+    worker    The Celery app and its task modules, as a Celery worker loads them
+    settings  The settings module alone, as every manage.py command loads it
+
+For each: wall time, total import time, peak RSS, the slowest imports
+(cumulative and self) and which heavy packages were loaded. The web target
+should not load Celery or kombu; they are imported on the first publish, or
+in the gunicorn master when preloading.
+
+--gunicorn also starts gunicorn with and without GUNICORN_PRELOAD, sends
+requests to warm every worker, and reports time to the first response and
+each worker's RSS, PSS and private (unshared) memory from
+/proc/<pid>/smaps_rollup. With preload the workers' private memory should
+drop, since the app pages are shared copy-on-write.
+
+    python -m benchmarks.bench_startup [--runs 5] [--top 15] [--gunicorn --workers 4]
+
+Uses the production settings by default (no database connection is made).
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_PACKAGES = ('celery', 'kombu', 'psycopg', 'psycopg_pool', 'requests', 'prometheus_client', 'rest_framework')
+
+TARGETS = {
+    'web': """
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+""",
+    'worker': """
+import django
+django.setup()
+from paygate_project import celery_app
+celery_app.loader.import_default_modules()
+""",
+    'settings': """
+from django.conf import settings
+settings.INSTALLED_APPS
+""",
+}
+
+# Printed by the child after the target so the parent can read what it loaded
+REPORT = """
+import json, resource, sys
+print(json.dumps({
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'packages': sorted({name.split('.')[0] for name in sys.modules}),
+}))
+"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """(module, self_us, cumulative_us, depth) per line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def boot(target, settings_module):
+    """Boot a target once. Returns wall time, import rows and the child's report."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, PYTHONDONTWRITEBYTECODE='')
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TARGETS[target] + REPORT],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode:
+        sys.exit(f'{target} failed to boot:\n{completed.stderr[-2000:]}')
+    return wall, parse_importtime(completed.stderr), json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def profile(target, settings_module, runs, top):
+    """Median of `runs` boots, with the import profile of the fastest one."""
+    boots = [boot(target, settings_module) for _ in range(runs + 1)][1:]  # First run warms the bytecode cache
+    walls = [wall for wall, _, _ in boots]
+    _, rows, report = min(boots, key=lambda b: b[0])
+    top_level = [row for row in rows if row[3] == 0]
+
+    packages = defaultdict(int)
+    for module, self_us, _, _ in rows:
+        packages[module.split('.')[0]] += self_us
+
+    return {
+        'wall_ms': round(statistics.median(walls) * 1000, 1),
+        'import_ms': round(sum(cumulative for _, _, cumulative, _ in top_level) / 1000, 1),
+        'maxrss_mb': round(report['maxrss_kb'] / 1024, 1),
+        'modules': len(rows),
+        'heavy_packages': [name for name in HEAVY_PACKAGES if name in report['packages']],
+        'slowest_cumulative_ms': {
+            module: round(cumulative / 1000, 1)
+            for module, _, cumulative, _ in sorted(top_level, key=lambda r: r[2], reverse=True)[:top]
+        },
+        'slowest_packages_self_ms': {
+            name: round(us / 1000, 1)
+            for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+    }
+
+
+def smaps_rollup(pid):
+    """RSS, PSS and private memory of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'private_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 1),
+    }
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def get(url):
+    """Request `url`; an error status still means a worker served it."""
+    try:
+        urllib.request.urlopen(url, timeout=5).read()
+    except urllib.error.HTTPError:
+        pass
+
+
+def run_gunicorn(preload, workers, settings_module, requests_per_worker):
+    """Start gunicorn, warm its workers and measure them. Returns the measurements."""
+    port_probe = __import__('socket').socket()
+    port_probe.bind(('127.0.0.1', 0))
+    port = port_probe.getsockname()[1]
+    port_probe.close()
+
+    env = dict(
+        os.environ, DJANGO_SETTINGS_MODULE=settings_module, GUNICORN_PRELOAD=str(preload),
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix='bench-startup-'),
+    )
+    # An unauthenticated API request: served by the app without touching the broker
+    url = f'http://127.0.0.1:{port}/paygate/api/v1/payment-complete/'
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'paygate_project.wsgi:application',
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        first_response = None
+        while first_response is None:
+            if server.poll() is not None:
+                sys.exit(f'gunicorn exited with status {server.returncode}')
+            try:
+                get(url)
+                first_response = time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        for _ in range(workers * requests_per_worker):
+            get(url)
+
+        pids = worker_pids(server.pid)
+        per_worker = [smaps_rollup(pid) for pid in pids]
+        return {
+            'first_response_ms': round(first_response * 1000, 1),
+            'master': smaps_rollup(server.pid),
+            'workers': len(pids),
+            'worker_mean': {
+                key: round(statistics.fmean(worker[key] for worker in per_worker), 1)
+                for key in ('rss_mb', 'pss_mb', 'private_mb')
+            },
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Boots per target; the median wall time is reported')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports listed per target')
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=['web', 'worker', 'settings'])
+    parser.add_argument('--settings', default='paygate_project.settings', help='DJANGO_SETTINGS_MODULE to boot with')
+    parser.add_argument('--gunicorn', action='store_true', help='Also compare gunicorn with and without preload')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers for --gunicorn')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'startup',
+        'python': sys.version.split()[0],
+        'targets': {target: profile(target, args.settings, args.runs, args.top) for target in args.targets},
+    }
+    if args.gunicorn:
+        report['gunicorn'] = {
+            'preload' if preload else 'no_preload': run_gunicorn(preload, args.workers, args.settings, 20)
+            for preload in (False, True)
+        }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Refresh token latency as the blacklist grows.
+
+Grows the token_blacklist tables step by step and, at each size, times
+refreshing a valid token through simplejwt's stock serializer (one
+BlacklistedToken query per refresh) and through CachedTokenRefreshSerializer
+(Bloom filter, then cache, then DB). The one-off filter rebuild a fresh
+process pays at each size is reported separately.
+
+Runs on in-memory SQLite by default; set DJANGO_SETTINGS_MODULE to measure
+against Postgres and Redis.
+
+    python -m benchmarks.bench_token_blacklist [--sizes 1000 100000 1000000] [--iterations 2000]
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from benchmarks import setup_django, summarize
+
+setup_django()
+
+from django.core.management import call_command  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer  # noqa: E402
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken  # noqa: E402
+
+from paygate.serializers import CachedTokenRefreshSerializer  # noqa: E402
+from paygate.utils.token_blacklist import CachedBlacklistRefreshToken, TokenBlacklist  # noqa: E402
+from tests.factories import UserFactory  # noqa: E402
+
+
+def grow_blacklist(user, count, batch_size=10000):
+    """Insert count blacklisted tokens that have not expired yet."""
+    now = timezone.now()
+    expires = now + timedelta(days=7)
+    for offset in range(0, count, batch_size):
+        outstanding = OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=user, jti=uuid.uuid4().hex, token='-', created_at=now, expires_at=expires)
+            for _ in range(min(batch_size, count - offset))
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in outstanding])
+
+
+def time_refresh(serializer_class, refresh, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        serializer = serializer_class(data={'refresh': refresh})
+        serializer.is_valid(raise_exception=True)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Blacklist sizes to measure at, ascending')
+    parser.add_argument('--iterations', type=int, default=2000, help='Refreshes timed per size and serializer')
+    args = parser.parse_args()
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    user = UserFactory()
+    refresh = str(CachedBlacklistRefreshToken.for_user(user))
+
+    results = []
+    current = 0
+    for size in args.sizes:
+        grow_blacklist(user, size - current)
+        current = size
+
+        TokenBlacklist.reset()
+        start = time.perf_counter()
+        TokenBlacklist.warm()
+        rebuild_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        results.append({
+            'blacklisted_tokens': size,
+            'bloom_rebuild_ms': rebuild_ms,
+            'db_lookup': time_refresh(TokenRefreshSerializer, refresh, args.iterations),
+            'cached_lookup': time_refresh(CachedTokenRefreshSerializer, refresh, args.iterations),
+        })
+
+    print(json.dumps({'benchmark': 'token_blacklist', 'refresh_latency_ms': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
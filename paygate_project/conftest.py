@@ -4,6 +4,7 @@ Pytest configuration for paygate project.
 import os
 import sys
 import django
+import pytest
 from django.conf import settings
 from django.test.utils import get_runner
 
@@ -17,4 +18,13 @@ def pytest_configure():
 
 def pytest_unconfigure():
     """Clean up after tests."""
-    pass
\ No newline at end of file
+    pass
+
+
+@pytest.fixture(scope='session', autouse=True)
+def token_blacklist_filter(django_db_setup, django_db_blocker):
+    """Build the refresh token blacklist filter once, as gunicorn workers do at startup."""
+    from paygate.utils.token_blacklist import TokenBlacklist
+
+    with django_db_blocker.unblock():
+        TokenBlacklist.warm()
@@ -0,0 +1,86 @@
+# Loaded by gunicorn from the working directory.
+import gc
+import os
+import shutil
+
+bind = '0.0.0.0:8000'
+
+# Threaded workers, so a worker's requests share its password hashing pool
+# (PASSWORD_HASH_CONCURRENCY hashes at a time, the rest shed with
+# PasswordHashingBusy) and keep serving payments while logins hash. Keep
+# GUNICORN_THREADS at or below DB_POOL_MAX_SIZE.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Load Django, the URLconf (views, serializers, services) and the Celery
+# publisher once in the master and fork workers from it. Workers then boot
+# without importing anything and share those pages copy-on-write.
+# GUNICORN_PRELOAD=False loads the app in each worker instead, which is
+# needed for --reload.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+
+if preload_app:
+    # Collections in the master would free and reshuffle objects between
+    # imports, leaving holes in pages the workers then copy. Re-enabled in
+    # each worker after the fork.
+    gc.disable()
+
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be merged into this one
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before workers fork
+    if not preload_app:
+        return
+    from django.db import connections
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns  # Imported lazily on the first request otherwise
+    import paygate.tasks  # noqa: F401  Celery and kombu, loaded on first publish otherwise
+
+    # Creating the connection objects imports the backend (psycopg) without
+    # connecting; anything that did connect is closed, since sockets and
+    # pools must not be shared with the workers
+    connections.all()
+    connections.close_all()
+    # Everything loaded so far is never collected, so GC passes in the
+    # workers do not write to (and so copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+
+
+def post_worker_init(worker):
+    # Build the refresh token blacklist filter and load the pricing plans
+    # before the worker accepts requests, so no request waits for them
+    from django.db import connections
+    from paygate.pricing import PricingCache
+    from paygate.utils.token_blacklist import TokenBlacklist
+
+    try:
+        TokenBlacklist.warm()
+    except Exception:
+        # Requests rebuild it in the background and answer from the cache and DB meanwhile
+        worker.log.exception('Could not build the refresh token blacklist filter')
+    try:
+        PricingCache.terms(None)
+    except Exception:
+        # The first capture loads them instead
+        worker.log.exception('Could not load the pricing plans')
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
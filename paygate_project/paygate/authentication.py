@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+REVOKED_ACCESS_KEY_PREFIX = 'jwt:revoked-access:'
+
+
+class VerifiedTokenCache:
+    """
+    Bounded, process-local LRU of access tokens whose signature and claims
+    have already been verified, keyed by a digest of the raw token.
+
+    Entries are dropped at the token's exp, and at the latest
+    JWT_ACCESS_CACHE_TTL seconds after verification so a token revoked in
+    another process stops being accepted here within that window.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(raw_token):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        return hashlib.sha256(raw_token).digest()
+
+    def get(self, raw_token):
+        key = self.digest(raw_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return token
+
+    def set(self, raw_token, token, ttl):
+        expires_at = min(token['exp'], time.time() + ttl)
+        key = self.digest(raw_token)
+        with self._lock:
+            self._entries[key] = (token, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, raw_token):
+        with self._lock:
+            self._entries.pop(self.digest(raw_token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+verified_tokens = VerifiedTokenCache(settings.JWT_ACCESS_CACHE_SIZE)
+
+
+def revoke_access_token(token):
+    """
+    Reject an access token for the rest of its lifetime (e.g. on logout).
+    Args:
+        token: A validated AccessToken
+    """
+    ttl = max(1, int(token['exp'] - time.time()))
+    cache.set(f'{REVOKED_ACCESS_KEY_PREFIX}{token[api_settings.JTI_CLAIM]}', True, ttl)
+    verified_tokens.evict(token.token)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that skips re-parsing and re-verifying access tokens it
+    has already verified. Revocation is checked whenever a token is verified.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = verified_tokens.get(raw_token)
+        if token is not None:
+            return token
+
+        token = super().get_validated_token(raw_token)
+        if cache.get(f'{REVOKED_ACCESS_KEY_PREFIX}{token[api_settings.JTI_CLAIM]}'):
+            raise InvalidToken({
+                'detail': 'Token has been revoked',
+                'messages': [{'token_class': type(token).__name__, 'message': 'Token has been revoked'}],
+            })
+        verified_tokens.set(raw_token, token, settings.JWT_ACCESS_CACHE_TTL)
+        return token
@@ -0,0 +1,143 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+RECENT_WRITE_KEY = 'db_router:recent_write:{}'
+
+# Replay delay on a streaming replica. 0 when it has replayed everything it
+# received, so an idle primary does not read as lag; NULL on a primary.
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+# Database the current request's reads go to; None means the primary
+_read_alias = contextvars.ContextVar('db_read_alias', default=None)
+# Set by track_writes() for the duration of a request
+_writes = contextvars.ContextVar('db_writes', default=None)
+
+_lag_lock = threading.Lock()
+_lag = {'checked_at': None, 'seconds': 0.0}
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica only inside replica_reads(), which the
+    read-heavy views enter through ReplicaReadMixin. Everything else,
+    including every write, uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        writes = _writes.get()
+        if writes is not None:
+            writes.happened = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+
+class WriteTracker:
+    happened = False
+
+
+@contextmanager
+def track_writes():
+    """Record whether the block wrote to the database."""
+    tracker = WriteTracker()
+    token = _writes.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _writes.reset(token)
+
+
+@contextmanager
+def replica_reads(alias):
+    """Route the block's reads to `alias` (None keeps them on the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def route_reads(alias):
+    """Send reads to `alias` until the enclosing replica_reads() block exits."""
+    _read_alias.set(alias)
+
+
+def mark_recent_write(user_id):
+    """Keep the user's reads on the primary until the replica has caught up with their write."""
+    cache.set(RECENT_WRITE_KEY.format(user_id), True, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def wrote_recently(user_id):
+    return cache.get(RECENT_WRITE_KEY.format(user_id)) is not None
+
+
+def measure_replica_lag(alias):
+    """Seconds the replica is behind the primary; infinite when it cannot be reached."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRES_LAG_SQL)
+            seconds, = cursor.fetchone()
+    except Exception:
+        logger.warning('Could not read the lag of database %s', alias, exc_info=True)
+        return math.inf
+    return float(seconds or 0)
+
+
+def replica_lag(alias):
+    """measure_replica_lag, checked at most once per DATABASE_REPLICA_LAG_CHECK_INTERVAL per process."""
+    now = time.monotonic()
+    with _lag_lock:
+        checked_at = _lag['checked_at']
+        if checked_at is not None and now - checked_at < settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+            return _lag['seconds']
+        _lag['checked_at'] = now
+    seconds = measure_replica_lag(alias)
+    with _lag_lock:
+        _lag['seconds'] = seconds
+    return seconds
+
+
+def reset_replica_lag():
+    """Forget the last lag measurement."""
+    with _lag_lock:
+        _lag.update(checked_at=None, seconds=0.0)
+
+
+def read_database(user):
+    """
+    Alias a user's reads should use, or None for the primary. The primary is
+    used when no replica is configured, when the user wrote within
+    DATABASE_REPLICA_STICKY_SECONDS, or when the replica is more than
+    DATABASE_REPLICA_MAX_LAG seconds behind.
+    """
+    alias = settings.DATABASE_READ_REPLICA
+    if not alias:
+        return None
+    if user is not None and user.is_authenticated and wrote_recently(user.pk):
+        return None
+    if replica_lag(alias) > settings.DATABASE_REPLICA_MAX_LAG:
+        return None
+    return alias
@@ -0,0 +1,222 @@
+import random
+import uuid
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import LedgerAccount, LedgerEntry, MerchantBalance
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# Entry types that make up a merchant's revenue; payouts only move it out
+REVENUE_ENTRY_TYPES = ('capture', 'commission', 'refund')
+
+
+class Ledger:
+    """
+    Double-entry ledger of money moving between merchants and the platform.
+    A posting writes two or more entries whose amounts sum to zero (credits
+    positive, debits negative) and, in the same transaction, adds them to
+    one of the merchant's MerchantBalance slots, so reading a balance sums
+    a handful of rows rather than the merchant's entries.
+    """
+
+    @staticmethod
+    def accounts(merchant_id):
+        """
+        The merchant's account and the platform accounts, in one query.
+        Accounts are created on first use.
+        Args:
+            merchant_id: Primary key of the Merchant
+        Returns:
+            dict: LedgerAccount by kind ('merchant', 'commission', 'clearing')
+        """
+        accounts = {
+            account.kind: account
+            for account in LedgerAccount.objects.filter(
+                Q(kind='merchant', merchant_id=merchant_id) | Q(merchant__isnull=True)
+            )
+        }
+        for kind in ('merchant', 'commission', 'clearing'):
+            if kind not in accounts:
+                accounts[kind] = Ledger._create_account(kind, merchant_id if kind == 'merchant' else None)
+        return accounts
+
+    @staticmethod
+    def _create_account(kind, merchant_id):
+        """Create an account; a merchant's comes with all its balance slots, so postings only update them."""
+        try:
+            with transaction.atomic():
+                account = LedgerAccount.objects.create(kind=kind, merchant_id=merchant_id)
+        except IntegrityError:
+            # Created by a concurrent posting
+            return LedgerAccount.objects.get(kind=kind, merchant_id=merchant_id)
+        if kind == 'merchant':
+            MerchantBalance.objects.bulk_create(
+                [MerchantBalance(merchant_id=merchant_id, slot=slot) for slot in range(settings.MERCHANT_BALANCE_SLOTS)],
+                ignore_conflicts=True,
+            )
+        return account
+
+    @staticmethod
+    def post(legs, payment=None):
+        """
+        Write a posting and apply it to the merchant's balance.
+        Every posting moves one merchant's funds, so it has a merchant leg.
+        Args:
+            legs: (entry_type, LedgerAccount, amount) per entry; amounts must sum to zero
+            payment: Payment the posting belongs to, None for payouts
+        Returns:
+            list: The created LedgerEntry rows
+        """
+        legs = [
+            (entry_type, account, Decimal(amount).quantize(CENT, ROUND_HALF_UP))
+            for entry_type, account, amount in legs if amount
+        ]
+        if sum(amount for _, _, amount in legs) != 0:
+            raise ValueError('Ledger postings must balance')
+        if not legs:
+            return []
+
+        merchant_ids = {account.merchant_id for _, account, _ in legs if account.kind == 'merchant'}
+        if len(merchant_ids) != 1:
+            raise ValueError('Ledger postings must move exactly one merchant\'s funds')
+        posting_id = uuid.uuid4()
+        # No savepoint of its own: a failed posting rolls back the caller's
+        # transaction too (Payment.save, Payment.refund), as it must
+        with transaction.atomic(savepoint=False):
+            entries = LedgerEntry.objects.bulk_create([
+                LedgerEntry(posting_id=posting_id, account=account, payment=payment, entry_type=entry_type, amount=amount)
+                for entry_type, account, amount in legs
+            ])
+            Ledger._add_to_balance(
+                merchant_ids.pop(),
+                available=sum((amount for _, account, amount in legs if account.kind == 'merchant'), ZERO),
+                commission=sum((amount for _, account, amount in legs if account.kind == 'commission'), ZERO),
+            )
+        return entries
+
+    @staticmethod
+    def _add_to_balance(merchant_id, available, commission):
+        """
+        Increment a random balance slot of the merchant. The increment is
+        applied by the database, so concurrent postings never overwrite each
+        other, and the row lock it takes is held by this posting's slot only.
+        Slots are created with the merchant's account; the insert below only
+        runs for accounts that predate them or a raised MERCHANT_BALANCE_SLOTS.
+        """
+        slot = random.randrange(settings.MERCHANT_BALANCE_SLOTS)
+        increment = {'available': F('available') + available, 'commission': F('commission') + commission}
+        if MerchantBalance.objects.filter(merchant_id=merchant_id, slot=slot).update(**increment):
+            return
+        try:
+            with transaction.atomic():
+                MerchantBalance.objects.create(merchant_id=merchant_id, slot=slot, available=available, commission=commission)
+        except IntegrityError:
+            # Created by a concurrent posting
+            MerchantBalance.objects.filter(merchant_id=merchant_id, slot=slot).update(**increment)
+
+    @staticmethod
+    def record_status_change(payment, previous_status):
+        """
+        Post what a payment's status change moved: the capture and commission
+        when it is captured. Called by Payment.save() inside the transaction
+        that saves the status. Refunds are posted by Payment.refund().
+        """
+        if payment.status == 'captured':
+            Ledger.record_capture(payment)
+
+    @staticmethod
+    def record_capture(payment):
+        """Credit the merchant with the captured amount and move the commission to the platform."""
+        accounts = Ledger.accounts(payment.order.merchant_id)
+        commission = payment.commission_amount or ZERO
+        return Ledger.post([
+            ('capture', accounts['clearing'], -payment.amount),
+            ('capture', accounts['merchant'], payment.amount),
+            ('commission', accounts['merchant'], -commission),
+            ('commission', accounts['commission'], commission),
+        ], payment=payment)
+
+    @staticmethod
+    def record_refund(payment, amount):
+        """Debit the merchant for a refund to the customer. The commission is not returned."""
+        accounts = Ledger.accounts(payment.order.merchant_id)
+        return Ledger.post([
+            ('refund', accounts['merchant'], -amount),
+            ('refund', accounts['clearing'], amount),
+        ], payment=payment)
+
+    @staticmethod
+    def record_payout(merchant, amount):
+        """Debit the merchant for funds paid out to their bank account."""
+        return Ledger.record_payouts({merchant.pk: amount})
+
+    @staticmethod
+    def record_payouts(amounts, created_at=None):
+        """
+        Post the payouts of many merchants at once: one query for the
+        accounts, one INSERT for every entry, then one balance increment per
+        merchant.
+        Args:
+            amounts: Positive payout amount by Merchant primary key
+            created_at: Time the entries are dated at (default now)
+        Returns:
+            list: The created LedgerEntry rows
+        """
+        if not amounts:
+            return []
+        created_at = created_at or timezone.now()
+        amounts = {merchant_id: Decimal(amount).quantize(CENT, ROUND_HALF_UP) for merchant_id, amount in amounts.items()}
+        accounts = {
+            (account.kind, account.merchant_id): account
+            for account in LedgerAccount.objects.filter(
+                Q(kind='merchant', merchant_id__in=amounts) | Q(kind='clearing', merchant__isnull=True)
+            )
+        }
+        clearing = accounts.get(('clearing', None)) or Ledger._create_account('clearing', None)
+        entries = []
+        for merchant_id, amount in amounts.items():
+            merchant = accounts.get(('merchant', merchant_id)) or Ledger._create_account('merchant', merchant_id)
+            posting_id = uuid.uuid4()
+            entries += [
+                LedgerEntry(posting_id=posting_id, account=merchant, entry_type='payout', amount=-amount, created_at=created_at),
+                LedgerEntry(posting_id=posting_id, account=clearing, entry_type='payout', amount=amount, created_at=created_at),
+            ]
+        with transaction.atomic():
+            entries = LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+            for merchant_id, amount in amounts.items():
+                Ledger._add_to_balance(merchant_id, available=-amount, commission=ZERO)
+        return entries
+
+    @staticmethod
+    def balance(merchant):
+        """What the platform owes the merchant (their revenue less payouts), summed over the balance slots."""
+        total = MerchantBalance.objects.filter(merchant=merchant).aggregate(total=Sum('available'))['total']
+        return (total or ZERO).quantize(CENT)
+
+    @staticmethod
+    def platform_balances():
+        """
+        Balances of the platform accounts, summed over every merchant's slots.
+        Returns:
+            dict: 'commission' earned and 'clearing' (minus the funds held for merchants and commission)
+        """
+        totals = MerchantBalance.objects.aggregate(available=Sum('available'), commission=Sum('commission'))
+        available = (totals['available'] or ZERO).quantize(CENT)
+        commission = (totals['commission'] or ZERO).quantize(CENT)
+        return {'commission': commission, 'clearing': -(available + commission)}
+
+    @staticmethod
+    def merchant_entries(merchant):
+        """Entries of the merchant's account, for period sums of revenue."""
+        return LedgerEntry.objects.filter(account__kind='merchant', account__merchant=merchant)
+
+    @staticmethod
+    def commission_entries():
+        """Entries of the platform's commission account."""
+        return LedgerEntry.objects.filter(account__kind='commission', account__merchant__isnull=True)
@@ -0,0 +1,145 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Correlation IDs attached to every record logged while they are bound
+request_id = contextvars.ContextVar('log_request_id', default=None)
+payment_id = contextvars.ContextVar('log_payment_id', default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+_CORRELATION_IDS = {'request_id': request_id, 'payment_id': payment_id}
+
+
+@contextmanager
+def bind(**ids):
+    """Attach correlation IDs (request_id, payment_id) to the records logged inside the block."""
+    tokens = [
+        (_CORRELATION_IDS[name], _CORRELATION_IDS[name].set(str(value)))
+        for name, value in ids.items() if value is not None
+    ]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Copies the bound correlation IDs onto each record, unless the record sets its own."""
+
+    def filter(self, record):
+        for name, var in _CORRELATION_IDS.items():
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a share of the records below WARNING from high-frequency
+    loggers. Rates map logger names to the share kept (0.1 keeps one in
+    ten), and apply to the logger's children too. Within a request the
+    decision follows the request ID, so a sampled request keeps all of its
+    records and others drop all of theirs.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1:
+            return True
+        correlation = getattr(record, 'request_id', None) or request_id.get()
+        if correlation:
+            return zlib.crc32(correlation.encode()) % 10000 < rate * 10000
+        return random.random() < rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, correlation IDs and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in _CORRELATION_IDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in _CORRELATION_IDS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingHandler(QueueHandler):
+    """
+    Formats a record in the logging thread and hands it to a bounded queue;
+    a QueueListener thread writes it to the stream. A request thread never
+    waits on stdout. When the queue is full the record is dropped and
+    counted in `dropped` rather than blocking.
+
+    Configured with '()' rather than 'class' in LOGGING, so Python 3.12's
+    dictConfig does not apply its own QueueHandler handling.
+    """
+
+    def __init__(self, stream=None, capacity=10000):
+        self.capacity = capacity
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        super().__init__(queue.Queue(capacity))
+        self._start_listener()
+        atexit.register(self.flush_and_stop)
+        # Listener threads do not survive fork (gunicorn --preload, Celery prefork)
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _restart_in_child(self):
+        self.queue = queue.Queue(self.capacity)
+        self._start_listener()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush_and_stop(self):
+        """Write out the queued records and stop the listener thread."""
+        if self.listener._thread is None:
+            return
+        try:
+            self.listener.stop()
+        except queue.Full:
+            pass
+        self.target.flush()
@@ -0,0 +1,39 @@
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paygate.archive import WebhookLogArchiver
+
+
+class Command(BaseCommand):
+    help = 'Search archived webhook logs, e.g. --from 2025-01-01 --to 2025-01-07 --payment-id <id>'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', required=True, help='First day to search (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last day to search (YYYY-MM-DD), defaults to --from')
+        parser.add_argument('--payment-id', help='Public payment id')
+        parser.add_argument('--status', choices=['sent', 'failed'], help='Delivery status')
+        parser.add_argument('--event', help='Event name, e.g. payment.captured')
+        parser.add_argument('--archive-dir', help='Override WEBHOOK_LOG_ARCHIVE_DIR')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start'])
+            end = date.fromisoformat(options['end']) if options['end'] else start
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if end < start:
+            raise CommandError('--to must not be before --from')
+
+        matches = 0
+        for record in WebhookLogArchiver.search(
+            start, end,
+            payment_id=options['payment_id'],
+            status=options['status'],
+            event=options['event'],
+            archive_dir=options['archive_dir'],
+        ):
+            self.stdout.write(json.dumps(record))
+            matches += 1
+        self.stderr.write(f'{matches} archived log(s) found')
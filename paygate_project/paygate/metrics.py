@@ -0,0 +1,234 @@
+import functools
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Set in every gunicorn and Celery container. Each process then writes its
+# samples to files in this directory and exposition merges them, so a scrape
+# of any one worker covers all of them. Must be set before prometheus_client
+# is imported and wiped when the server starts (see gunicorn.conf.py).
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Payment operations run in the low milliseconds; webhooks and batch tasks take longer
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+REQUEST_LATENCY = Histogram(
+    'paygate_http_request_duration_seconds',
+    'HTTP request latency by route pattern',
+    ['method', 'route', 'status'],
+    buckets=FAST_BUCKETS,
+)
+PAYMENTS = Counter(
+    'paygate_payments_total',
+    'PaymentProcessor operations by resulting payment status',
+    ['operation', 'status'],
+)
+PAYMENT_OPERATION_DURATION = Histogram(
+    'paygate_payment_operation_duration_seconds',
+    'PaymentProcessor authorization, capture, void and refund durations',
+    ['operation'],
+    buckets=FAST_BUCKETS,
+)
+WEBHOOK_DELIVERY_DURATION = Histogram(
+    'paygate_webhook_delivery_duration_seconds',
+    'Webhook delivery attempt latency by outcome',
+    ['outcome'],
+    buckets=SLOW_BUCKETS,
+)
+CELERY_TASK_DURATION = Histogram(
+    'paygate_celery_task_duration_seconds',
+    'Celery task runtime by final state',
+    ['task', 'state'],
+    buckets=SLOW_BUCKETS,
+)
+
+# Connection pool state, summed over live processes in multiprocess mode.
+# Saturation shows as requests_waiting > 0 and a rising wait time.
+DB_POOL_CONNECTIONS = Gauge(
+    'paygate_db_pool_connections',
+    'Connections held by the pool',
+    ['alias'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_AVAILABLE = Gauge(
+    'paygate_db_pool_available_connections',
+    'Idle connections ready in the pool',
+    ['alias'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_WAITING = Gauge(
+    'paygate_db_pool_waiting_requests',
+    'Requests waiting for a pooled connection',
+    ['alias'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_QUEUED = Counter(
+    'paygate_db_pool_queued_requests',
+    'Requests that had to wait for a pooled connection',
+    ['alias'],
+)
+DB_POOL_WAIT = Counter(
+    'paygate_db_pool_wait_seconds',
+    'Time spent waiting for pooled connections',
+    ['alias'],
+)
+DB_POOL_TIMEOUTS = Counter(
+    'paygate_db_pool_timeouts',
+    'Requests that timed out waiting for a pooled connection',
+    ['alias'],
+)
+
+
+def observe_db_pools():
+    """Copy the psycopg pool stats of this process's open connections into the metrics."""
+    for connection in connections.all(initialized_only=True):
+        # Reading .pool creates the pool, so only look at connections in use
+        if connection.connection is None:
+            continue
+        pool = getattr(connection, 'pool', None)
+        if pool is None:
+            continue
+        # pop_stats resets the counters, so each call reports what happened since the last
+        stats = pool.pop_stats()
+        alias = connection.alias
+        DB_POOL_CONNECTIONS.labels(alias).set(stats.get('pool_size', 0))
+        DB_POOL_AVAILABLE.labels(alias).set(stats.get('pool_available', 0))
+        DB_POOL_WAITING.labels(alias).set(stats.get('requests_waiting', 0))
+        DB_POOL_QUEUED.labels(alias).inc(stats.get('requests_queued', 0))
+        DB_POOL_WAIT.labels(alias).inc(stats.get('requests_wait_ms', 0) / 1000)
+        DB_POOL_TIMEOUTS.labels(alias).inc(stats.get('requests_errors', 0))
+
+
+def track_payment_operation(operation, status):
+    """
+    Decorator timing a PaymentProcessor operation and counting its outcome.
+    Args:
+        operation: Label for the operation (authorize, capture, void, refund)
+        status: Callable mapping the operation's return value to a status label
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                PAYMENTS.labels(operation, 'error').inc()
+                raise
+            finally:
+                PAYMENT_OPERATION_DURATION.labels(operation).observe(time.perf_counter() - start)
+            PAYMENTS.labels(operation, status(result)).inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def queue_depths():
+    """
+    Messages waiting in each configured Celery queue, read from the broker.
+    A queue that does not exist yet (Redis drops empty lists) counts as 0.
+    """
+    from paygate_project import celery_app
+
+    depths = {}
+    with celery_app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for name in celery_app.amqp.queues:
+            try:
+                depths[name] = channel.queue_declare(queue=name, passive=True).message_count
+            except connection.channel_errors:
+                depths[name] = 0
+                channel = connection.channel()
+    return depths
+
+
+class CeleryQueueDepthCollector:
+    """Reads queue depths from the broker at scrape time; nothing is stored between scrapes."""
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        try:
+            depths = queue_depths()
+        except Exception:
+            logger.warning('Could not read Celery queue depths from the broker', exc_info=True)
+            return [family]
+        for name, depth in depths.items():
+            family.add_metric([name], depth)
+        return [family]
+
+    @staticmethod
+    def _family():
+        return GaugeMetricFamily('paygate_celery_queue_depth', 'Messages waiting in each Celery queue', labels=['queue'])
+
+
+queue_registry = CollectorRegistry(auto_describe=True)
+queue_registry.register(CeleryQueueDepthCollector())
+
+
+def process_registry():
+    """Registry for this process's metrics, merged across processes in multiprocess mode."""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    """Text exposition of the application metrics and the current queue depths."""
+    return generate_latest(process_registry()) + generate_latest(queue_registry)
+
+
+def clear_multiprocess_dir():
+    """Drop sample files left by processes of a previous run."""
+    if MULTIPROC_DIR:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+_task_starts = {}
+_task_starts_lock = threading.Lock()
+
+
+def task_started(task_id=None, **kwargs):
+    """task_prerun handler, connected in paygate_project/celery.py."""
+    with _task_starts_lock:
+        _task_starts[task_id] = time.perf_counter()
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    """task_postrun handler, connected in paygate_project/celery.py."""
+    with _task_starts_lock:
+        start = _task_starts.pop(task_id, None)
+    if start is not None:
+        CELERY_TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - start)
+    observe_db_pools()
+
+
+def start_worker_metrics_server(**kwargs):
+    """
+    Serve the worker's task and webhook metrics on CELERY_METRICS_PORT.
+    Prefork children write to the multiprocess directory and this server,
+    in the parent, merges them.
+    """
+    if not settings.CELERY_METRICS_PORT:
+        return
+    clear_multiprocess_dir()
+    start_http_server(settings.CELERY_METRICS_PORT, registry=process_registry())
@@ -0,0 +1,185 @@
+import logging
+import random
+import re
+import time
+import traceback
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import log
+from .db_router import mark_recent_write, track_writes
+from .metrics import REQUEST_LATENCY, observe_db_pools
+
+logger = logging.getLogger('paygate.request')
+
+# Stacks kept per sampled request; enough to cover an N+1 loop without unbounded memory
+MAX_TRACED_QUERIES = 200
+
+# Incoming request IDs are kept only if they look like one (e.g. a UUID)
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class QueryStats:
+    """execute_wrapper counting queries and DB time, optionally keeping each query's stack."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.trace and len(self.queries) < MAX_TRACED_QUERIES:
+                self.queries.append((sql, elapsed, _app_stack()))
+
+
+def _app_stack():
+    """Call stack limited to project frames, innermost last."""
+    base = str(settings.BASE_DIR)
+    return [
+        f'{frame.filename}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+    ]
+
+
+class CorrelationIdMiddleware:
+    """
+    Binds a request ID to every log record written while handling the
+    request. Reuses the caller's X-Request-ID (e.g. from a load balancer)
+    when it has one, and returns it in the response's X-Request-ID header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        with log.bind(request_id=request_id):
+            response = self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts the queries and DB time of every request across all database
+    connections and reports them in a Server-Timing header and a structured
+    log record.
+
+    A REQUEST_TRACE_SAMPLE_RATE share of requests also record where each
+    query was issued from; when such a request crosses
+    REQUEST_QUERY_COUNT_THRESHOLD queries or REQUEST_DURATION_THRESHOLD_MS,
+    its slowest and most repeated queries are logged with their stacks.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats(trace=random.random() < settings.REQUEST_TRACE_SAMPLE_RATE)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.duration * 1000
+
+        timing = f'db;dur={db_ms:.1f};desc="{stats.count} queries", total;dur={total_ms:.1f}'
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 1),
+            'db_queries': stats.count,
+            'db_ms': round(db_ms, 1),
+        }
+        logger.info(
+            '%s %s %s %.1fms db_queries=%d db_ms=%.1f',
+            request.method, request.path, response.status_code, total_ms, stats.count, db_ms,
+            extra=fields,
+        )
+
+        over_threshold = (
+            stats.count > settings.REQUEST_QUERY_COUNT_THRESHOLD
+            or total_ms > settings.REQUEST_DURATION_THRESHOLD_MS
+        )
+        if over_threshold and stats.trace:
+            logger.warning(
+                'Slow request %s %s: %d queries, %.1fms',
+                request.method, request.path, stats.count, total_ms,
+                extra={**fields, 'query_traces': self.query_traces(stats)},
+            )
+        return response
+
+    @staticmethod
+    def query_traces(stats, limit=5):
+        """The slowest queries and the most repeated SQL, each with the stack that issued it."""
+        slowest = sorted(stats.queries, key=lambda q: q[1], reverse=True)[:limit]
+        repeated = Counter(sql for sql, _, _ in stats.queries).most_common(limit)
+        first_stack = {}
+        for sql, _, stack in stats.queries:
+            first_stack.setdefault(sql, stack)
+        return {
+            'slowest': [{'sql': sql, 'ms': round(elapsed * 1000, 2), 'stack': stack} for sql, elapsed, stack in slowest],
+            'repeated': [{'sql': sql, 'count': count, 'stack': first_stack[sql]} for sql, count in repeated if count > 1],
+        }
+
+
+class RequestMetricsMiddleware:
+    """
+    Observes each request's latency in the paygate_http_request_duration_seconds
+    histogram, labelled by URL route pattern rather than path so ids in the
+    URL do not create a series per object, and refreshes the DB pool metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else '<unmatched>'
+        REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+        observe_db_pools()
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins a user's replica reads to the primary for
+    DATABASE_REPLICA_STICKY_SECONDS after any request of theirs that wrote,
+    so a merchant always sees their own payments and orders in stats and
+    lists. Placed after AuthenticationMiddleware; DRF copies the user it
+    authenticates onto the request by the time the response comes back.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_writes() as writes:
+            response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if writes.happened and user is not None and user.is_authenticated:
+            mark_recent_write(user.pk)
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:32
+
+import paygate.models
+from django.db import migrations, models
+
+
+def populate_webhook_secrets(apps, schema_editor):
+    # AddField evaluates the default once, so give existing merchants distinct secrets
+    Merchant = apps.get_model('paygate', 'Merchant')
+    for merchant in Merchant.objects.only('id'):
+        merchant.webhook_secret = paygate.models.generate_webhook_secret()
+        merchant.save(update_fields=['webhook_secret'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0006_alter_payment_commission_amount_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchant',
+            name='webhook_secret',
+            field=models.CharField(default=paygate.models.generate_webhook_secret, max_length=64),
+        ),
+        migrations.RunPython(populate_webhook_secrets, migrations.RunPython.noop),
+    ]
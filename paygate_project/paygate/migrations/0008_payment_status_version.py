@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0007_merchant_webhook_secret'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='status_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
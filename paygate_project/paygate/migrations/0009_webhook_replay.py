@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:43
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0008_payment_status_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookReplayJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(default=uuid.uuid4, max_length=100, unique=True)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('log_status', models.CharField(blank=True, max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed')], default='pending', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('enqueued', models.PositiveIntegerField(default=0)),
+                ('last_log_id', models.BigIntegerField(default=0)),
+                ('max_log_id', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(fields=['created_at', 'status'], name='webhooklog_created_status_idx'),
+        ),
+        migrations.AddField(
+            model_name='webhookreplayjob',
+            name='merchant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='paygate.merchant'),
+        ),
+    ]
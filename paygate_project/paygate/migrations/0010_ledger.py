@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:40
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    """Post the captures, commissions and full refunds of existing payments, dated when the payment was made."""
+    Payment = apps.get_model('paygate', 'Payment')
+    LedgerAccount = apps.get_model('paygate', 'LedgerAccount')
+    LedgerEntry = apps.get_model('paygate', 'LedgerEntry')
+
+    platform = {kind: LedgerAccount.objects.create(kind=kind) for kind in ('commission', 'clearing')}
+    merchants = {}
+    balances = {}
+    batch = []
+
+    def leg(posting_id, payment, entry_type, account, amount):
+        if amount:
+            batch.append(LedgerEntry(
+                posting_id=posting_id, account=account, payment=payment,
+                entry_type=entry_type, amount=amount, created_at=payment.created_at,
+            ))
+            balances[account.pk] = balances.get(account.pk, Decimal('0.00')) + amount
+
+    payments = Payment.objects.filter(status__in=['captured', 'refunded']).select_related('order').order_by('pk')
+    for payment in payments.iterator(chunk_size=2000):
+        merchant_id = payment.order.merchant_id
+        if merchant_id not in merchants:
+            merchants[merchant_id] = LedgerAccount.objects.create(kind='merchant', merchant_id=merchant_id)
+        merchant = merchants[merchant_id]
+        commission = payment.commission_amount or Decimal('0.00')
+        posting_id = uuid.uuid4()
+        leg(posting_id, payment, 'capture', platform['clearing'], -payment.amount)
+        leg(posting_id, payment, 'capture', merchant, payment.amount)
+        leg(posting_id, payment, 'commission', merchant, -commission)
+        leg(posting_id, payment, 'commission', platform['commission'], commission)
+        if payment.status == 'refunded':
+            posting_id = uuid.uuid4()
+            leg(posting_id, payment, 'refund', merchant, -payment.refunded_amount)
+            leg(posting_id, payment, 'refund', platform['clearing'], payment.refunded_amount)
+        if len(batch) >= 2000:
+            LedgerEntry.objects.bulk_create(batch)
+            batch.clear()
+    LedgerEntry.objects.bulk_create(batch)
+
+    for pk, balance in balances.items():
+        LedgerAccount.objects.filter(pk=pk).update(balance=balance)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0009_webhook_replay'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('merchant', 'Merchant'), ('commission', 'Commission'), ('clearing', 'Clearing')], max_length=20)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('merchant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='paygate.merchant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posting_id', models.UUIDField(db_index=True, default=uuid.uuid4)),
+                ('entry_type', models.CharField(choices=[('capture', 'Capture'), ('commission', 'Commission'), ('refund', 'Refund'), ('payout', 'Payout')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='paygate.ledgeraccount')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='paygate.payment')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(fields=('kind', 'merchant'), name='ledgeraccount_kind_merchant_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(condition=models.Q(('merchant__isnull', True)), fields=('kind',), name='ledgeraccount_platform_kind_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', 'created_at'], name='ledgerentry_acct_created_idx'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
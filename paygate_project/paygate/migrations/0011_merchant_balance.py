@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:43
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def fill_merchant_balances(apps, schema_editor):
+    """Start each merchant's balance in slot 0 from their ledger entries."""
+    LedgerEntry = apps.get_model('paygate', 'LedgerEntry')
+    MerchantBalance = apps.get_model('paygate', 'MerchantBalance')
+
+    totals = LedgerEntry.objects.filter(account__kind='merchant').values('account__merchant_id').annotate(
+        available=Sum('amount'),
+        commission=Sum('amount', filter=Q(entry_type='commission')),
+    )
+    MerchantBalance.objects.bulk_create([
+        MerchantBalance(
+            merchant_id=row['account__merchant_id'], slot=0,
+            available=row['available'], commission=-(row['commission'] or Decimal('0.00')),
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0010_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MerchantBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('available', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('commission', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balance_slots', to='paygate.merchant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('merchant', 'slot'), name='merchantbalance_merchant_slot_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_merchant_balances, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='ledgeraccount',
+            name='balance',
+        ),
+        migrations.RemoveField(
+            model_name='ledgeraccount',
+            name='updated_at',
+        ),
+    ]
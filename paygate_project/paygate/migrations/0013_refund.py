@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:50
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def backfill_refunds(apps, schema_editor):
+    """Record a Refund of the refunded amount for every payment refunded before refunds had rows, dated by its ledger entry."""
+    Payment = apps.get_model('paygate', 'Payment')
+    Refund = apps.get_model('paygate', 'Refund')
+    LedgerEntry = apps.get_model('paygate', 'LedgerEntry')
+
+    payments = Payment.objects.filter(status='refunded').only('pk', 'amount', 'refunded_amount').order_by('pk')
+    batch = []
+    for payment in payments.iterator(chunk_size=2000):
+        batch.append(Refund(payment_id=payment.pk, amount=payment.refunded_amount or payment.amount))
+        if len(batch) >= 2000:
+            Refund.objects.bulk_create(batch)
+            batch = []
+    Refund.objects.bulk_create(batch)
+
+    # created_at is set on insert; date each refund like its ledger posting
+    posted_at = LedgerEntry.objects.filter(
+        payment=models.OuterRef('payment'), entry_type='refund',
+    ).order_by('created_at').values('created_at')[:1]
+    Refund.objects.filter(models.Exists(posted_at)).update(created_at=models.Subquery(posted_at))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0012_settlement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refund_id', models.CharField(default=uuid.uuid4, max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='refunds', to='paygate.payment')),
+            ],
+        ),
+        migrations.RunPython(backfill_refunds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:53
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0013_refund'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='commission_fixed_fee',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='commission_percentage',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.CreateModel(
+            name='PricingPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('fixed_fee', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('merchant', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pricing_plan', to='paygate.merchant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PricingTier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_volume', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('fixed_fee', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiers', to='paygate.pricingplan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('plan', 'min_volume'), name='pricingtier_plan_volume_uniq')],
+            },
+        ),
+    ]
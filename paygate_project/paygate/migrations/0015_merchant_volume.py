@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:48
+
+import django.db.models.deletion
+from datetime import datetime, timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_last_month(apps, schema_editor):
+    """Record last month's volumes now rather than at the next nightly run, so tiers apply from the deploy."""
+    LedgerEntry = apps.get_model('paygate', 'LedgerEntry')
+    MerchantVolume = apps.get_model('paygate', 'MerchantVolume')
+
+    last_month = (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+    start = timezone.make_aware(datetime.combine(last_month, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(timezone.localdate().replace(day=1), datetime.min.time()))
+    totals = (
+        LedgerEntry.objects.filter(entry_type='capture', account__kind='merchant', created_at__gte=start, created_at__lt=end)
+        .values('account__merchant').annotate(total=models.Sum('amount'))
+        .values_list('account__merchant', 'total')
+    )
+    MerchantVolume.objects.bulk_create(
+        [MerchantVolume(merchant_id=merchant_id, month=last_month, volume=total) for merchant_id, total in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0014_pricing_plans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MerchantVolume',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('volume', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_volumes', to='paygate.merchant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('merchant', 'month'), name='merchantvolume_merchant_month_uniq')],
+            },
+        ),
+        migrations.RunPython(record_last_month, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_merchant(apps, schema_editor):
+    """Copy each log's merchant from its payment's order, in one UPDATE."""
+    Payment = apps.get_model('paygate', 'Payment')
+    WebhookLog = apps.get_model('paygate', 'WebhookLog')
+
+    WebhookLog.objects.update(merchant_id=models.Subquery(
+        Payment.objects.filter(pk=models.OuterRef('payment_id')).values('order__merchant')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paygate', '0015_merchant_volume'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooklog',
+            name='merchant',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='paygate.merchant'),
+        ),
+        migrations.RunPython(backfill_merchant, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='webhooklog',
+            name='merchant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='paygate.merchant'),
+        ),
+        migrations.RemoveIndex(
+            model_name='webhooklog',
+            name='webhooklog_created_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(fields=['merchant', 'created_at', 'id'], name='webhooklog_merch_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='webhookreplayjob',
+            name='last_log_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
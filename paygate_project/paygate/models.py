@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.contrib.auth.hashers import verify_password
 from django.utils import timezone
 from decimal import Decimal
 import uuid
 import hashlib
+import secrets
+from .utils.hashing import password_hashing
 
 class UserManager(BaseUserManager):
     """Manager for User"""
@@ -22,6 +25,10 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
         return self.create_user(email, password, **extra_fields)
 
+    def get_by_natural_key(self, username):
+        # Login needs the merchant profile for its token claims; fetch it in the same query
+        return self.select_related('merchant').get(**{self.model.USERNAME_FIELD: username})
+
     def get_queryset(self):
         # Exclude deleted users
         return super().get_queryset().filter(deleted=False)
@@ -47,6 +54,24 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
+    def set_password(self, raw_password):
+        """Hash on the bounded hashing pool rather than the request thread"""
+        password_hashing.run(super().set_password, raw_password)
+
+    def check_password(self, raw_password):
+        """
+        Verify on the hashing pool. A hash from an older hasher or work factor
+        (e.g. PBKDF2 after switching to Argon2) is upgraded on successful login;
+        the save stays on the request thread and its DB connection.
+        """
+        is_correct, must_update = password_hashing.run(verify_password, raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=['password'])
+        return is_correct
+
     def delete(self, *args, **kwargs):
         """Soft delete the user by setting `deleted` flag and `deleted_at` timestamp"""
         self.deleted = True
@@ -60,16 +85,86 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+def generate_webhook_secret():
+    return secrets.token_hex(32)
+
 class Merchant(models.Model):
     """Merchant profile for payment gateway functionality"""
     user = models.OneToOneField('User', on_delete=models.CASCADE)
     api_key = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
     webhook_url = models.URLField(blank=True, null=True)
+    webhook_secret = models.CharField(max_length=64, default=generate_webhook_secret)  # Shared secret for signing webhook payloads
     created_at = models.DateTimeField(auto_now_add=True)  # Tracks when merchant profile was created
 
     def __str__(self):
         return self.user.email
 
+def invalidate_pricing():
+    # Processes reload their pricing plans once the change is committed
+    from .pricing import PricingCache
+    transaction.on_commit(PricingCache.invalidate)
+
+class PricingPlan(models.Model):
+    """
+    Commission charged on a merchant's captures: a percentage of the amount
+    plus a fixed fee, or the terms of the highest volume tier the merchant
+    reached. The plan without a merchant applies to every merchant without
+    a plan of its own.
+    """
+    merchant = models.OneToOneField(
+        Merchant, on_delete=models.CASCADE, null=True, blank=True, related_name='pricing_plan',
+    )
+    percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    fixed_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_pricing()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_pricing()
+        return result
+
+    def __str__(self):
+        return f'{self.merchant or "default"}: {self.percentage}% + {self.fixed_fee}'
+
+class PricingTier(models.Model):
+    """Terms of a pricing plan for merchants whose captures last calendar month reached min_volume"""
+    plan = models.ForeignKey(PricingPlan, on_delete=models.CASCADE, related_name='tiers')
+    min_volume = models.DecimalField(max_digits=14, decimal_places=2)
+    percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    fixed_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['plan', 'min_volume'], name='pricingtier_plan_volume_uniq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_pricing()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_pricing()
+        return result
+
+class MerchantVolume(models.Model):
+    """A merchant's captured volume over a calendar month, recorded by a beat task for the pricing tiers"""
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE, related_name='monthly_volumes')
+    month = models.DateField()  # First day of the month
+    volume = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['merchant', 'month'], name='merchantvolume_merchant_month_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.merchant_id}@{self.month:%Y-%m}'
+
 class Order(models.Model):
     order_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
     merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
@@ -81,6 +176,9 @@ class Order(models.Model):
     def __str__(self):
         return self.order_id
 
+class PaymentStatusChanged(ValueError):
+    """The payment's status changed in the database since the instance was loaded"""
+
 class Payment(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -97,36 +195,303 @@ class Payment(models.Model):
     card_hash = models.CharField(max_length=64, blank=True)  # Simulated card token
     created_at = models.DateTimeField(auto_now_add=True)
 
-    commission_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('2.00'))  # e.g., 2%
+    # Set from the merchant's pricing plan at capture unless given, e.g. 2%
+    commission_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    commission_fixed_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     commission_amount = models.DecimalField(max_digits=10, decimal_places=2,null=True,blank=True)
     merchant_payout = models.DecimalField(max_digits=10, decimal_places=2,null=True,blank=True)
 
     refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    status_version = models.PositiveIntegerField(default=0)  # Bumped on every status change, identifies webhook events
+    settlement_batch = models.ForeignKey(
+        'SettlementBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments',
+    )  # Set in bulk when the capture is paid out
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None or 'status' in fields:
+            self._loaded_status = self.status
 
-        if self.status == 'captured':  # Only apply for successful payments
-            self.commission_amount = (self.amount * self.commission_percentage) /  Decimal(100)
+    def save(self, *args, **kwargs):
+        previous_status = getattr(self, '_loaded_status', None)
+        # Only on capture; later saves keep the payout partial refunds reduced
+        if self.status == 'captured' and previous_status != 'captured':
+            if self.commission_percentage is None:
+                # Read from the in-process pricing cache, no query; the order is
+                # loaded for the ledger posting anyway
+                from .pricing import PricingCache
+                self.commission_percentage, self.commission_fixed_fee = PricingCache.terms(self.order.merchant_id)
+            self.commission_amount = min(
+                (self.amount * self.commission_percentage) /  Decimal(100) + self.commission_fixed_fee, self.amount,
+            )
             self.merchant_payout = self.amount - self.commission_amount
-        super().save(*args, **kwargs)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                # Written with the status, as the ledger posts these values
+                kwargs['update_fields'] = {
+                    *update_fields, 'commission_percentage', 'commission_fixed_fee', 'commission_amount', 'merchant_payout',
+                }
+        if self.status != previous_status:
+            self.status_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'status' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'status_version'}
+        if self.status == previous_status:
+            super().save(*args, **kwargs)
+            return
+        # The ledger postings for a status change commit or roll back with it
+        with transaction.atomic(savepoint=False):
+            post = True
+            if not self._state.adding and previous_status is None:
+                # Status not loaded (bulk created or deferred): post only if it changes
+                post = bool(Payment.objects.filter(pk=self.pk).exclude(status=self.status).update(status=self.status))
+            # The save's UPDATE only matches while the row still has the loaded
+            # status, so two workers or a stale instance cannot post the same
+            # change twice
+            self._status_guard = previous_status
+            try:
+                super().save(*args, **kwargs)
+            finally:
+                self._status_guard = None
+            if post:
+                from .ledger import Ledger
+                Ledger.record_status_change(self, previous_status)
+        self._loaded_status = self.status
+
+    def _do_update(self, base_qs, *args, **kwargs):
+        guard = getattr(self, '_status_guard', None)
+        if guard is None:
+            return super()._do_update(base_qs, *args, **kwargs)
+        if not super()._do_update(base_qs.filter(status=guard), *args, **kwargs):
+            raise PaymentStatusChanged(f"Payment is no longer {guard}")
+        return True
+
+    def refund(self, amount=None):
+        """
+        Refund part or all of a captured payment. refunded_amount,
+        merchant_payout, status and status_version are changed by one
+        conditional UPDATE that only matches while the refund still fits, so
+        concurrent refunds cannot over-refund and hold the row lock only for
+        their own short transaction. The payment becomes 'refunded' once
+        nothing is left to refund.
+        Args:
+            amount: Amount to refund (default: everything not yet refunded)
+        Returns:
+            Refund: The recorded refund
+        """
+        from .ledger import CENT, Ledger
 
-    def full_refund(self):
         if self.status != 'captured':
             raise ValueError("Only captured payments can be refunded")
-        self.refunded_amount = self.amount
-        self.merchant_payout -= self.amount
-        self.status = 'refunded'
-        self.save()
+        amount = Decimal(self.amount - self.refunded_amount if amount is None else amount).quantize(CENT)
+        if amount <= 0:
+            raise ValueError("Refund amount must be positive")
+
+        with transaction.atomic():
+            updated = Payment.objects.filter(
+                pk=self.pk, status='captured', refunded_amount__lte=models.F('amount') - amount,
+            ).update(
+                refunded_amount=models.F('refunded_amount') + amount,
+                merchant_payout=models.F('merchant_payout') - amount,
+                # Compared with the row before this update
+                status=models.Case(
+                    models.When(refunded_amount=models.F('amount') - amount, then=models.Value('refunded')),
+                    default=models.Value('captured'),
+                ),
+                status_version=models.F('status_version') + 1,
+            )
+            if not updated:
+                raise ValueError("Refund exceeds the amount left to refund")
+            refund = Refund.objects.create(payment=self, amount=amount)
+            Ledger.record_refund(self, amount)
+        self.refresh_from_db(fields=['refunded_amount', 'merchant_payout', 'status', 'status_version'])
+        return refund
+
+    def full_refund(self):
+        # merchant_payout is the payment's net after refunds; the ledger keeps
+        # the capture, commission and each refund as separate entries
+        return self.refund()
 
     def __str__(self):
         return str(self.payment_id)
 
+class Refund(models.Model):
+    """A full or partial refund of a captured payment"""
+    refund_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
+    payment = models.ForeignKey(Payment, on_delete=models.PROTECT, related_name='refunds')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.refund_id)
+
 class WebhookLog(models.Model):
     payment = models.ForeignKey(Payment, on_delete=models.CASCADE)
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)  # The payment's, so replays read one index range
     payload = models.JSONField()
     status = models.CharField(max_length=20)  # sent, failed
     response = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['merchant', 'created_at', 'id'], name='webhooklog_merch_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.merchant_id is None:
+            # Read by the INSERT itself; delivery tasks only carry the payment's key
+            self.merchant_id = models.Subquery(
+                Payment.objects.filter(pk=self.payment_id).values('order__merchant')[:1]
+            )
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Webhook for {self.payment.payment_id}"
+
+class WebhookReplayJob(models.Model):
+    """Merchant-requested redelivery of logged webhook events, processed in batches"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    ]
+    job_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    log_status = models.CharField(max_length=20, blank=True)  # sent, failed or blank for both
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)  # Logs matched so far, one per delivery attempt
+    enqueued = models.PositiveIntegerField(default=0)  # Events redelivered, each once however often it was attempted
+    # Keyset cursor into the merchant's WebhookLogs: (created_at, id) of the last one walked
+    last_log_created_at = models.DateTimeField(null=True, blank=True)
+    last_log_id = models.BigIntegerField(default=0)
+    max_log_id = models.BigIntegerField(default=0)  # Logs written after the job started are never replayed
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.job_id)
+
+class LedgerAccount(models.Model):
+    """Account in the double-entry ledger. Running balances are kept in MerchantBalance."""
+    KIND_CHOICES = [
+        ('merchant', 'Merchant'),  # Owed to a merchant
+        ('commission', 'Commission'),  # Platform revenue
+        ('clearing', 'Clearing'),  # Funds held for the platform by the card network and bank
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    merchant = models.ForeignKey(Merchant, on_delete=models.PROTECT, null=True, blank=True)  # Set for merchant accounts only
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'merchant'], name='ledgeraccount_kind_merchant_uniq'),
+            models.UniqueConstraint(
+                fields=['kind'], condition=models.Q(merchant__isnull=True), name='ledgeraccount_platform_kind_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.merchant_id}' if self.merchant_id else self.kind
+
+
+class LedgerEntry(models.Model):
+    """
+    One leg of a ledger posting. The legs of a posting share its posting_id
+    and sum to zero. Entries are append-only: a correction is a new posting.
+    """
+    ENTRY_TYPES = [
+        ('capture', 'Capture'),
+        ('commission', 'Commission'),
+        ('refund', 'Refund'),
+        ('payout', 'Payout'),
+    ]
+    posting_id = models.UUIDField(default=uuid.uuid4, db_index=True)
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='entries')
+    payment = models.ForeignKey(Payment, on_delete=models.PROTECT, null=True, blank=True)  # Null for payouts
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Credit positive, debit negative
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'created_at'], name='ledgerentry_acct_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Ledger entries cannot be changed')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries cannot be deleted')
+
+    def __str__(self):
+        return f'{self.entry_type} {self.amount} on {self.account}'
+
+
+class MerchantBalance(models.Model):
+    """
+    Running ledger balances of a merchant, spread over MERCHANT_BALANCE_SLOTS
+    rows. Each posting increments one slot picked at random, so concurrent
+    captures for the same merchant rarely wait on each other's row lock.
+    Reads sum the slots. The platform's clearing balance is not stored:
+    postings balance, so it is minus the sum of the other two.
+    """
+    merchant = models.ForeignKey(Merchant, on_delete=models.PROTECT, related_name='balance_slots')
+    slot = models.PositiveSmallIntegerField()
+    available = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Merchant account: revenue less payouts
+    commission = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Platform commission taken from this merchant
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['merchant', 'slot'], name='merchantbalance_merchant_slot_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.merchant_id}[{self.slot}]'
+
+
+class SettlementBatch(models.Model):
+    """Daily settlement run paying every merchant their ledger balance as of `cutoff`"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    ]
+    batch_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
+    cutoff = models.DateTimeField(unique=True)  # Entries before the cutoff are settled; one batch per cutoff
+    window_start = models.DateTimeField(null=True, blank=True)  # Cutoff of the previous batch
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    merchant_count = models.PositiveIntegerField(default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.batch_id)
+
+
+class Payout(models.Model):
+    """A merchant's share of a settlement batch; at most one per merchant and batch"""
+    batch = models.ForeignKey(SettlementBatch, on_delete=models.PROTECT, related_name='payouts')
+    merchant = models.ForeignKey(Merchant, on_delete=models.PROTECT)
+    balance = models.DecimalField(max_digits=14, decimal_places=2)  # Ledger balance at the cutoff, may be negative
+    amount = models.DecimalField(max_digits=14, decimal_places=2)  # Paid out: the balance, or 0 when it is not positive
+    payment_count = models.PositiveIntegerField(default=0)  # Payments marked with the batch
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'merchant'], name='payout_batch_merchant_uniq'),
+        ]
+
     def __str__(self):
-        return f"Webhook for {self.payment.payment_id}"
\ No newline at end of file
+        return f'{self.merchant_id}: {self.amount}'
@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import LedgerEntry, MerchantVolume, PricingPlan, invalidate_pricing
+
+PRICING_VERSION_KEY = 'pricing:version'
+
+
+class PricingCache:
+    """
+    Every merchant's pricing plan held in each process, so pricing a capture
+    runs no query.
+
+    Plan and tier changes bump a version counter in the cache (Redis in
+    production) once they commit. Each process compares it with the version
+    it loaded at most every PRICING_SYNC_INTERVAL seconds and reloads every
+    plan when it moved, so a change applies everywhere within that interval.
+    A merchant's tier follows its captures over the previous calendar month,
+    summed from the ledger by record_volumes() in a beat task just after
+    midnight, so loading the plans never sums a month of ledger entries inside
+    a capture. The cache is also reloaded when the month changes; until that
+    month's volumes are recorded, tiered merchants pay their plan's own terms.
+    """
+    _lock = threading.Lock()
+    # (plans, volumes): (percentage, fixed_fee, tiers) by Merchant primary key,
+    # None for the default plan, and last month's volume by Merchant primary key
+    _state = None
+    _version = 0
+    _month = None
+    _synced_at = 0.0
+
+    @staticmethod
+    def _previous_month(month):
+        """Start and end of the calendar month before the month starting on `month`."""
+        end = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+        start = timezone.make_aware(datetime.combine((month - timedelta(days=1)).replace(day=1), datetime.min.time()))
+        return start, end
+
+    @classmethod
+    def record_volumes(cls, month=None):
+        """
+        Record every merchant's captures over the calendar month before
+        `month` and make every process reload its plans. Safe to run again.
+        Args:
+            month: First day of the month being priced (default this month)
+        Returns:
+            int: Number of merchants with a recorded volume
+        """
+        month = month or timezone.localdate().replace(day=1)
+        start, end = cls._previous_month(month)
+        totals = (
+            LedgerEntry.objects.filter(entry_type='capture', account__kind='merchant', created_at__gte=start, created_at__lt=end)
+            .values('account__merchant').annotate(total=Sum('amount'))
+            .values_list('account__merchant', 'total')
+        )
+        last_month = (month - timedelta(days=1)).replace(day=1)
+        volumes = MerchantVolume.objects.bulk_create(
+            [MerchantVolume(merchant_id=merchant_id, month=last_month, volume=total) for merchant_id, total in totals],
+            update_conflicts=True, unique_fields=['merchant', 'month'], update_fields=['volume'], batch_size=1000,
+        )
+        invalidate_pricing()
+        return len(volumes)
+
+    @classmethod
+    def _load(cls, month):
+        """Read every plan with its tiers, and the recorded volume last month of the merchants on tiered plans."""
+        # Read before the plans: a change committed during the load bumps it again
+        version = cache.get(PRICING_VERSION_KEY, 0)
+        plans = {}
+        for plan in PricingPlan.objects.prefetch_related('tiers').order_by('updated_at'):
+            tiers = sorted(
+                ((tier.min_volume, tier.percentage, tier.fixed_fee) for tier in plan.tiers.all()), reverse=True,
+            )
+            plans[plan.merchant_id] = (plan.percentage, plan.fixed_fee, tiers)
+
+        volumes = {}
+        tiered = [merchant_id for merchant_id, (_, _, tiers) in plans.items() if tiers]
+        if tiered:
+            recorded = MerchantVolume.objects.filter(month=(month - timedelta(days=1)).replace(day=1))
+            if None not in tiered:
+                # Only merchants with a tiered plan of their own
+                recorded = recorded.filter(merchant__in=tiered)
+            volumes = dict(recorded.values_list('merchant', 'volume'))
+        cls._state, cls._version, cls._month = (plans, volumes), version, month
+
+    @classmethod
+    def _sync(cls):
+        """Reload the plans if they changed in any process or the month moved on, and return them."""
+        now = time.monotonic()
+        month = timezone.localdate().replace(day=1)
+        state = cls._state
+        if state is not None and cls._month == month and now - cls._synced_at < settings.PRICING_SYNC_INTERVAL:
+            return state
+        with cls._lock:
+            if cls._state is None or cls._month != month or cache.get(PRICING_VERSION_KEY, 0) != cls._version:
+                cls._load(month)
+            cls._synced_at = now
+            return cls._state
+
+    @classmethod
+    def reset(cls):
+        """Drop the plans held in this process; the next lookup reloads them."""
+        with cls._lock:
+            cls._state, cls._version, cls._month, cls._synced_at = None, 0, None, 0.0
+
+    @classmethod
+    def invalidate(cls):
+        """Make every process reload its plans: this one now, the others at their next sync."""
+        cache.add(PRICING_VERSION_KEY, 0, None)
+        cache.incr(PRICING_VERSION_KEY)
+        cls.reset()
+
+    @classmethod
+    def terms(cls, merchant_id):
+        """
+        Commission terms for a capture by the merchant.
+        Args:
+            merchant_id: Primary key of the Merchant
+        Returns:
+            tuple: (percentage, fixed_fee) of the merchant's plan, the default
+            plan or PRICING_DEFAULT_* settings, in that order
+        """
+        plans, volumes = cls._sync()
+        plan = plans.get(merchant_id) or plans.get(None)
+        if plan is None:
+            return settings.PRICING_DEFAULT_PERCENTAGE, settings.PRICING_DEFAULT_FIXED_FEE
+
+        percentage, fixed_fee, tiers = plan
+        volume = volumes.get(merchant_id, 0)
+        for min_volume, tier_percentage, tier_fee in tiers:
+            if volume >= min_volume:
+                return tier_percentage, tier_fee
+        return percentage, fixed_fee
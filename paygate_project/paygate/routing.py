@@ -0,0 +1,50 @@
+import os
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+WEBHOOK_LANE_PREFIX = 'webhooks.lane.'
+
+
+def webhook_lane(payment_id):
+    """
+    Lane a payment's webhook events are delivered on.
+    Uses crc32 rather than hash(), which is randomised per process, so every
+    web and worker process agrees on the lane.
+    """
+    return zlib.crc32(str(payment_id).encode()) % settings.WEBHOOK_DELIVERY_LANES
+
+
+def webhook_lane_queues(lanes):
+    """Names of the webhook lane queues for a number of lanes."""
+    return [f'{WEBHOOK_LANE_PREFIX}{lane}' for lane in range(lanes)]
+
+
+def check_lane_workers(**kwargs):
+    """
+    Refuse to start a lane worker deployed alongside a different number of
+    lane workers than WEBHOOK_DELIVERY_LANES: the lanes without a worker
+    would collect messages nobody consumes. Lane workers are told how many
+    of them are deployed by WEBHOOK_LANE_WORKERS (see docker-compose.yml).
+    """
+    workers = os.getenv('WEBHOOK_LANE_WORKERS')
+    if workers is not None and int(workers) != settings.WEBHOOK_DELIVERY_LANES:
+        raise ImproperlyConfigured(
+            f'WEBHOOK_DELIVERY_LANES is {settings.WEBHOOK_DELIVERY_LANES} but {workers} lane workers are '
+            f'deployed; run one lane worker per lane'
+        )
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router sending each webhook's first attempt to its payment's lane
+    queue, so a slow or busy payment holds up only its own lane while lanes
+    run in parallel. Delivery is not ordered: explicit queues (e.g. retries)
+    take precedence over this route, and a retried event can land after later
+    events for the same payment. Receivers order events by `sequence`.
+    """
+    if name != 'paygate.tasks.send_webhook_task':
+        return None
+    payload = args[2] if len(args) > 2 else kwargs['payload']
+    return {'queue': f'{WEBHOOK_LANE_PREFIX}{webhook_lane(payload["payment_id"])}'}
@@ -1,26 +1,41 @@
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import User, Merchant , Order, Payment, WebhookLog
+from django.contrib.auth.models import update_last_login
+from rest_framework_simplejwt.serializers import TokenObtainSerializer, TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .models import User, Merchant , Order, Payment, WebhookLog, WebhookReplayJob
+from .utils.helpers import get_user_merchant, get_user_role
+from .utils.token_blacklist import CachedBlacklistRefreshToken
 import uuid
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedBlacklistRefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        merchant = get_user_merchant(user)
+        token['role'] = get_user_role(user)
+        token['merchant_id'] = merchant.pk if merchant else None
+        return token
+
     def validate(self, attrs):
-        print(f"inside the validate")
-        data = super().validate(attrs)
+        # TokenObtainPairSerializer.validate mints a pair of its own; authenticate only
+        data = TokenObtainSerializer.validate(self, attrs)
         refresh = self.get_token(self.user)
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
+        merchant = get_user_merchant(self.user)
         data['refresh'] = str(refresh)
         data['access'] = str(refresh.access_token)
         data['email'] = self.user.email
         data['name'] = self.user.name
-        try:
-            merchant = Merchant.objects.get(user=self.user)
-            data['api_key'] = merchant.api_key
-            data['role'] = 'merchant'
-        except Merchant.DoesNotExist:
-            data['api_key'] = None
-            data['role'] = 'admin' if self.user.is_staff else 'user'
+        data['api_key'] = merchant.api_key if merchant else None
+        data['role'] = refresh['role']
         return data
 
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedBlacklistRefreshToken
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -60,9 +75,15 @@ class PaymentSerializer(serializers.ModelSerializer):
     order = serializers.CharField(source='order.order_id')  # Serialize order as order_id string
     class Meta:
         model = Payment
-        fields = ['payment_id', 'order', 'amount', 'status', 'created_at','commission_percentage','commission_amount','merchant_payout']
+        fields = ['payment_id', 'order', 'amount', 'status', 'created_at','commission_percentage','commission_fixed_fee','commission_amount','merchant_payout']
 
 class WebhookLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = WebhookLog
-        fields = ['payment', 'payload', 'status', 'response', 'created_at']
\ No newline at end of file
+        fields = ['payment', 'payload', 'status', 'response', 'created_at']
+
+class WebhookReplayJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.CharField()
+    class Meta:
+        model = WebhookReplayJob
+        fields = ['job_id', 'start', 'end', 'log_status', 'status', 'total', 'enqueued', 'created_at', 'completed_at']
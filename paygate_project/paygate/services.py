@@ -1,14 +1,31 @@
 import logging
 import random
 import hashlib
-import requests
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.db import transaction
-from .models import Payment, WebhookLog
-from .tasks import send_webhook_task
+from django.db.models import F, Q
+from .models import Payment, PaymentStatusChanged, WebhookLog, WebhookReplayJob
+from .utils.signing import sign_payload
+from .metrics import track_payment_operation
+
+logger = logging.getLogger('paygate.payments')
+webhook_logger = logging.getLogger('paygate.webhooks')
+
+
+def __getattr__(name):
+    # The task modules load Celery and kombu, so they are imported on first
+    # publish rather than with the views (see gunicorn.conf.py for preloading)
+    if name in ('send_webhook_task', 'replay_webhooks_task'):
+        from . import tasks
+        return getattr(tasks, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 class PaymentProcessor:
     @staticmethod
+    @track_payment_operation('authorize', lambda result: result[0].status if result[0] else 'invalid_card')
     def process_payment(order, card_details):
         """
         Mock payment processing with proper authorization and capture flow.
@@ -62,6 +79,7 @@ class PaymentProcessor:
         return payment, True
 
     @staticmethod
+    @track_payment_operation('capture', lambda ok: 'captured' if ok else 'declined')
     def capture_authorized_payment(payment):
         """
         Capture an authorized payment.
@@ -77,16 +95,22 @@ class PaymentProcessor:
         capture_success = random.random() < 0.95
 
         if capture_success:
-            with transaction.atomic():
-                payment.status = 'captured'
-                payment.save()
-                WebhookHandler.send_webhook(payment, payment.order.merchant)
+            try:
+                with transaction.atomic():
+                    payment.status = 'captured'
+                    payment.save()
+                    WebhookHandler.send_webhook(payment, payment.order.merchant)
+            except PaymentStatusChanged:
+                # Captured or voided meanwhile by another request
+                payment.refresh_from_db()
+                return False
             return True
 
         # Capture failed - could set status to 'capture_failed' or keep 'authorized'
         return False
 
     @staticmethod
+    @track_payment_operation('void', lambda ok: 'voided' if ok else 'declined')
     def void_authorized_payment(payment):
         """
         Void an authorized payment (release the hold).
@@ -99,15 +123,21 @@ class PaymentProcessor:
             return False
 
         payment.status = 'voided'
-        payment.save()
+        try:
+            payment.save()
+        except PaymentStatusChanged:
+            payment.refresh_from_db()
+            return False
         return True
 
     @staticmethod
-    def process_refund(payment):
+    @track_payment_operation('refund', lambda ok: 'refunded' if ok else 'declined')
+    def process_refund(payment, amount=None):
         """
-        Process refund for captured payments only.
+        Process a full or partial refund for captured payments only.
         Args:
             payment: Payment instance from models.Payment
+            amount: Amount to refund, default everything not yet refunded
         Returns:
             bool: True if refund succeeds, False otherwise
         """
@@ -118,41 +148,194 @@ class PaymentProcessor:
             refund_success = random.random() < 0.90
 
             if refund_success:
-                with transaction.atomic():
-                    payment.full_refund()
-                    WebhookHandler.send_webhook(payment, payment.order.merchant)
+                # Payment.refund() commits on its own; the webhook is enqueued after the row lock is released
+                payment.refund(amount)
+                WebhookHandler.send_webhook(payment, payment.order.merchant)
                 return True
-        except Exception as e:
-            logging.error(e)
+        except Exception:
+            logger.exception('Refund failed', extra={'payment_id': str(payment.payment_id)})
             return False
 
 
 class WebhookHandler:
+    @staticmethod
+    def build_payload(payment):
+        """
+        Snapshot the webhook payload for the payment's current state.
+        Built once at enqueue time so delivery attempts never re-read the
+        database and always describe the event that triggered them.
+        Args:
+            payment: Payment instance from models.Payment
+        Returns:
+            dict: Webhook payload
+        """
+        order = payment.order
+        return {
+            'event': WebhookHandler.event_name(payment),
+            'payment_id': str(payment.payment_id),
+            'order_id': str(order.order_id),
+            'amount': str(payment.amount),
+            'refunded_amount': str(payment.refunded_amount),
+            'currency': order.currency,
+            'status': payment.status,
+            'sequence': payment.status_version,
+            'created_at': payment.created_at.isoformat()
+        }
+
+    @staticmethod
+    def event_name(payment):
+        """Event type of the payment's current state; a captured payment with refunds is partially refunded."""
+        if payment.status == 'captured' and payment.refunded_amount:
+            return 'payment.partially_refunded'
+        return 'payment.' + payment.status
+
+    @staticmethod
+    def event_key(payment):
+        """Deduplication key of the event for the payment's current status version."""
+        return f'webhook:event:{payment.payment_id}:{WebhookHandler.event_name(payment)}:{payment.status_version}'
+
     @staticmethod
     def send_webhook(payment, merchant):
         """
         Mock webhook sending to merchant's webhook_url.
+        Any number of calls for the same logical event (payment, event type,
+        status version) enqueue a single delivery; later calls are no-ops.
         Args:
             payment: Payment instance from models.Payment
             merchant: Merchant instance from models.Merchant
         Returns:
             bool: True if webhook sent successfully (mocked), False otherwise
         """
-        print("yup:  here i was ")
-        print(f"webhook url : {merchant.webhook_url}")
+        # Claimed and enqueued once the caller's transaction commits, so a
+        # rolled-back status change neither sends its event nor suppresses it
+        payload = WebhookHandler.build_payload(payment)
+        transaction.on_commit(lambda: WebhookHandler._enqueue(payment, merchant, payload))
+        return bool(merchant.webhook_url)
+
+    @staticmethod
+    def _enqueue(payment, merchant, payload):
+        key = WebhookHandler.event_key(payment)
+        # cache.add is atomic, so concurrent callers cannot both claim the event
+        if not cache.add(key, True, settings.WEBHOOK_DEDUP_TTL):
+            return
+
+        fields = {'payment_id': str(payment.payment_id), 'merchant_id': merchant.id, 'event': payload['event']}
         if not merchant.webhook_url:
-            print(f"payment id : {payment.id} \n merchant id : {merchant.id}")
+            webhook_logger.warning('No webhook URL configured for merchant %s', merchant.id, extra=fields)
             # Log failure if no webhook URL
             WebhookLog.objects.create(
                 payment=payment,
-                payload={'event': 'payment.' + payment.status, 'error': 'No webhook URL provided'},
+                merchant=merchant,
+                payload={'event': payload['event'], 'error': 'No webhook URL provided'},
                 status='failed',
                 response='No webhook URL configured for merchant',
                 created_at=timezone.now()
             )
-            return False
+            return
+
+        from .tasks import send_webhook_task
 
         # Trigger the async task (no loop here—the task won't call back)
-        print(f"payment id : {payment.id} \n merchant id : {merchant.id}")
-        send_webhook_task.delay(payment.id, merchant.id)
-        return True  # Return immediately, assuming the task will handle it
\ No newline at end of file
+        try:
+            send_webhook_task.delay(payment.id, merchant.webhook_url, payload, sign_payload(payload, merchant))
+        except Exception:
+            # Not enqueued: release the event so the next call can send it
+            cache.delete(key)
+            raise
+        webhook_logger.info('Webhook enqueued', extra=fields)
+
+
+class WebhookReplayer:
+    @staticmethod
+    def start(merchant, start, end, log_status=''):
+        """
+        Create a replay job for the merchant's logged webhooks and queue its first batch.
+        Args:
+            merchant: Merchant instance from models.Merchant
+            start: Earliest WebhookLog.created_at to replay
+            end: Latest WebhookLog.created_at to replay
+            log_status: Only replay logs with this delivery status ('sent', 'failed', '' for both)
+        Returns:
+            WebhookReplayJob: The created job, pollable for progress
+        """
+        from .tasks import replay_webhooks_task
+
+        # Only the newest log's key, read from the primary key index; matching
+        # logs are counted by the batches, off the request thread
+        job = WebhookReplayJob.objects.create(
+            merchant=merchant,
+            start=start,
+            end=end,
+            log_status=log_status,
+            max_log_id=WebhookLog.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+        )
+        replay_webhooks_task.delay(job.id)
+        return job
+
+    @staticmethod
+    def _logs(merchant, start, end, log_status):
+        logs = WebhookLog.objects.filter(
+            merchant=merchant,
+            created_at__gte=start,
+            created_at__lte=end,
+        )
+        if log_status:
+            logs = logs.filter(status=log_status)
+        return logs
+
+    @staticmethod
+    def event_key(job, payload):
+        """Deduplication key of a logged event within a replay job."""
+        return f'webhook:replay:{job.job_id}:{payload["payment_id"]}:{payload.get("event")}:{payload.get("sequence")}'
+
+    @staticmethod
+    def run_batch(job_pk):
+        """
+        Enqueue the next batch of a replay job, spaced out to WEBHOOK_REPLAY_RATE
+        deliveries per second, then schedule the following batch.
+        Logs are walked in (created_at, id) order from the job's cursor, so
+        each batch is one range read of the (merchant, created_at, id) index.
+        Args:
+            job_pk: Primary key of the WebhookReplayJob
+        """
+        from .tasks import replay_webhooks_task, send_webhook_task
+
+        job = WebhookReplayJob.objects.select_related('merchant').get(pk=job_pk)
+        if job.status == 'completed':
+            return
+
+        batch_size = settings.WEBHOOK_REPLAY_BATCH_SIZE
+        rate = settings.WEBHOOK_REPLAY_RATE
+        merchant = job.merchant
+        logs = WebhookReplayer._logs(merchant, job.start, job.end, job.log_status).filter(id__lte=job.max_log_id)
+        if job.last_log_created_at is not None:
+            logs = logs.filter(
+                Q(created_at__gt=job.last_log_created_at) | Q(created_at=job.last_log_created_at, id__gt=job.last_log_id)
+            )
+        logs = list(logs.order_by('created_at', 'id').values_list('id', 'created_at', 'payment_id', 'payload')[:batch_size])
+
+        published = 0
+        for _, _, payment_pk, payload in logs:
+            # Logs written because the merchant had no webhook URL hold no event
+            if not merchant.webhook_url or 'payment_id' not in payload:
+                continue
+            # Every delivery attempt is logged; replay each event once per job
+            if not cache.add(WebhookReplayer.event_key(job, payload), True, settings.WEBHOOK_DEDUP_TTL):
+                continue
+            send_webhook_task.apply_async(
+                (payment_pk, merchant.webhook_url, payload, sign_payload(payload, merchant)),
+                countdown=published / rate,
+            )
+            published += 1
+
+        done = len(logs) < batch_size
+        WebhookReplayJob.objects.filter(pk=job.pk).update(
+            total=F('total') + len(logs),
+            enqueued=F('enqueued') + published,
+            last_log_id=logs[-1][0] if logs else job.last_log_id,
+            last_log_created_at=logs[-1][1] if logs else job.last_log_created_at,
+            status='completed' if done else 'running',
+            completed_at=timezone.now() if done else None,
+        )
+        if not done:
+            replay_webhooks_task.apply_async((job.pk,), countdown=len(logs) / rate)
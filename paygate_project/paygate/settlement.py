@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, Exists, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ledger import CENT, ZERO, Ledger
+from .models import LedgerEntry, Merchant, MerchantBalance, Payment, Payout, SettlementBatch
+
+
+class SettlementEngine:
+    """
+    Daily merchant payouts. A batch pays each merchant their ledger balance
+    as of the batch cutoff (midnight). Balances come from the merchant's
+    balance slots less the entries posted since the cutoff, so refunds and
+    earlier payouts are accounted for and nothing is summed per payment in
+    Python. Merchants are settled in chunks of SETTLEMENT_CHUNK_SIZE, each
+    a task of its own so workers settle chunks in parallel.
+    """
+
+    @staticmethod
+    def cutoff(now=None):
+        """Start of the current day, the cutoff of the batch run today."""
+        return timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def start(cutoff=None):
+        """
+        Get or create the batch for a cutoff and split its merchants into chunks.
+        Running it again for the same cutoff returns the same batch, and the
+        chunks again unless the batch is complete.
+        Args:
+            cutoff: Settle entries before this time (default: start of today)
+        Returns:
+            tuple: (SettlementBatch, list of (first, last) merchant primary keys per chunk)
+        """
+        cutoff = cutoff or SettlementEngine.cutoff()
+        merchant_ids = list(
+            MerchantBalance.objects.order_by('merchant_id').values_list('merchant_id', flat=True).distinct()
+        )
+        previous = SettlementBatch.objects.filter(cutoff__lt=cutoff).order_by('-cutoff').values_list('cutoff', flat=True).first()
+        try:
+            with transaction.atomic():
+                batch, _ = SettlementBatch.objects.get_or_create(
+                    cutoff=cutoff,
+                    defaults={'window_start': previous, 'merchant_count': len(merchant_ids)},
+                )
+        except IntegrityError:
+            # Started by a concurrent run
+            batch = SettlementBatch.objects.get(cutoff=cutoff)
+        if batch.status == 'completed':
+            return batch, []
+
+        size = settings.SETTLEMENT_CHUNK_SIZE
+        chunks = [
+            (merchant_ids[i], merchant_ids[min(i + size, len(merchant_ids)) - 1])
+            for i in range(0, len(merchant_ids), size)
+        ]
+        if not chunks:
+            SettlementEngine._finish(batch)
+        return batch, chunks
+
+    @staticmethod
+    def balances_at_cutoff(batch, first_merchant_id, last_merchant_id):
+        """
+        Ledger balance at the cutoff of every merchant in the range that has
+        no payout in the batch yet, read in one statement so the slots and
+        the entries come from the same snapshot.
+        Returns:
+            dict: Balance by Merchant primary key
+        """
+        money = DecimalField(max_digits=14, decimal_places=2)
+        current = (
+            MerchantBalance.objects.filter(merchant=OuterRef('pk'))
+            .values('merchant').annotate(total=Sum('available')).values('total')
+        )
+        since_cutoff = (
+            LedgerEntry.objects.filter(
+                account__kind='merchant', account__merchant=OuterRef('pk'), created_at__gte=batch.cutoff,
+            )
+            .values('account__merchant').annotate(total=Sum('amount')).values('total')
+        )
+        rows = (
+            Merchant.objects.filter(pk__gte=first_merchant_id, pk__lte=last_merchant_id)
+            .filter(Exists(MerchantBalance.objects.filter(merchant=OuterRef('pk'))))
+            .exclude(Exists(Payout.objects.filter(batch=batch, merchant=OuterRef('pk'))))
+            .annotate(
+                current=Coalesce(Subquery(current, output_field=money), Value(ZERO), output_field=money),
+                since_cutoff=Coalesce(Subquery(since_cutoff, output_field=money), Value(ZERO), output_field=money),
+            )
+            .values_list('pk', 'current', 'since_cutoff')
+        )
+        return {pk: (current - since_cutoff).quantize(CENT) for pk, current, since_cutoff in rows}
+
+    @staticmethod
+    def settle_chunk(batch_pk, first_merchant_id, last_merchant_id):
+        """
+        Pay out one chunk of merchants in a single transaction: one query for
+        their balances, one INSERT for the payouts, one for the payout ledger
+        entries and one UPDATE marking the settled payments. Merchants already
+        paid in the batch are skipped, so a redelivered chunk pays no one twice.
+        Args:
+            batch_pk: Primary key of the SettlementBatch
+            first_merchant_id: Lowest Merchant primary key of the chunk
+            last_merchant_id: Highest Merchant primary key of the chunk
+        Returns:
+            int: Number of merchants settled
+        """
+        batch = SettlementBatch.objects.get(pk=batch_pk)
+        if batch.status == 'completed':
+            return 0
+
+        try:
+            with transaction.atomic():
+                balances = SettlementEngine.balances_at_cutoff(batch, first_merchant_id, last_merchant_id)
+                if not balances:
+                    return 0
+
+                # Payments whose capture was posted before the cutoff and not yet settled
+                payments = Payment.objects.filter(
+                    settlement_batch__isnull=True,
+                    order__merchant_id__in=list(balances),
+                ).filter(Exists(LedgerEntry.objects.filter(
+                    payment=OuterRef('pk'), entry_type='capture', created_at__lt=batch.cutoff,
+                )))
+                counts = dict(
+                    payments.values('order__merchant_id').annotate(count=Count('id'))
+                    .values_list('order__merchant_id', 'count')
+                )
+
+                # Raises IntegrityError if a concurrent run of the chunk paid a merchant first
+                Payout.objects.bulk_create([
+                    Payout(
+                        batch=batch, merchant_id=merchant_id, balance=balance,
+                        amount=max(balance, ZERO), payment_count=counts.get(merchant_id, 0),
+                    )
+                    for merchant_id, balance in balances.items()
+                ], batch_size=1000)
+                # Dated at the cutoff: the next batch's balance must include them
+                # however late this batch runs
+                Ledger.record_payouts(
+                    {merchant_id: balance for merchant_id, balance in balances.items() if balance > 0},
+                    created_at=batch.cutoff,
+                )
+                payments.update(settlement_batch=batch)
+        except IntegrityError:
+            return 0
+
+        SettlementEngine._finish(batch)
+        return len(balances)
+
+    @staticmethod
+    def _finish(batch):
+        """Complete the batch and record its totals once every merchant has a payout."""
+        totals = batch.payouts.aggregate(merchants=Count('id'), amount=Sum('amount'), payments=Sum('payment_count'))
+        if totals['merchants'] < batch.merchant_count:
+            return
+        SettlementBatch.objects.filter(pk=batch.pk, status='running').update(
+            status='completed',
+            total_amount=totals['amount'] or ZERO,
+            payment_count=totals['payments'] or 0,
+            completed_at=timezone.now(),
+        )
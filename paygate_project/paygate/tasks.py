@@ -1,33 +1,67 @@
 from celery import shared_task
-from .models import Payment, WebhookLog, Merchant
+from celery.signals import before_task_publish, task_prerun
+from django.core.management import call_command
+from django.conf import settings
+from .models import WebhookLog
+from .archive import WebhookLogArchiver
+from .settlement import SettlementEngine
+from .pricing import PricingCache
+from .metrics import WEBHOOK_DELIVERY_DURATION
+from . import log
+from paygate_project import celery_app  # noqa: F401  (the configured app these tasks publish through)
 import random
+import time
 from django.utils import timezone
 import logging
 
+logger = logging.getLogger('paygate.tasks')
+webhook_logger = logging.getLogger('paygate.webhooks')
 
-@shared_task(bind=True, max_retries=3)
-def send_webhook_task(self, payment_id, merchant_id):
+
+@before_task_publish.connect
+def _propagate_request_id(headers=None, **kwargs):
+    """Send the publishing request's ID with the task so the worker logs it too."""
+    request_id = log.request_id.get()
+    if request_id and headers is not None:
+        headers.setdefault('request_id', request_id)
+
+
+@task_prerun.connect
+def _bind_request_id(task=None, **kwargs):
+    # Eager tasks run inside the publishing request and keep its ID. Worker
+    # tasks replace the previous task's ID (or clear it) before they start.
+    if task is None or task.request.is_eager:
+        return
+    log.request_id.set(getattr(task.request, 'request_id', None))
+
+
+@shared_task(bind=True, max_retries=3, acks_late=True)
+def send_webhook_task(self, payment_id, webhook_url, payload, signature):
     """
     Async task to send webhook. Retries on failure.
+    The payload and its signature are built when the event is enqueued, so
+    an attempt only writes its WebhookLog row and never reads the database.
+    Args:
+        payment_id: Primary key of the Payment the event belongs to
+        webhook_url: Merchant endpoint the payload is delivered to
+        payload: Snapshot built by WebhookHandler.build_payload
+        signature: HMAC-SHA256 of the payload, sent as X-Paygate-Signature
     """
-    print("sending webhook task")
-    try:
-        payment = Payment.objects.get(id=payment_id)
-        merchant = Merchant.objects.get(id=merchant_id)
-
-        # Mock webhook payload
-        payload = {
-            'event': 'payment.' + payment.status,
-            'payment_id': str(payment.payment_id),
-            'order_id': str(payment.order.order_id),
-            'amount': str(payment.amount),
-            'currency': payment.order.currency,
-            'status': payment.status,
-            'created_at': payment.created_at.isoformat()
-        }
+    with log.bind(payment_id=payload.get('payment_id')):
+        return _deliver_webhook(self, payment_id, payload)
 
+
+def _deliver_webhook(task, payment_id, payload):
+    """One delivery attempt of send_webhook_task, logged under the event's payment ID."""
+    attempt = task.request.retries + 1
+    webhook_logger.info('Delivering webhook', extra={'attempt': attempt, 'event': payload.get('event')})
+    start = time.perf_counter()
+    try:
         # Simulate webhook request (80% success rate for mock)
         mock_response_status = 200 if random.random() < 0.8 else 500
+        WEBHOOK_DELIVERY_DURATION.labels(
+            'sent' if mock_response_status == 200 else 'failed'
+        ).observe(time.perf_counter() - start)
         mock_response_text = (
             '{"status": "success"}' if mock_response_status == 200
             else '{"error": "Webhook endpoint failed"}'
@@ -35,7 +69,7 @@ def send_webhook_task(self, payment_id, merchant_id):
 
         # Log webhook attempt
         WebhookLog.objects.create(
-            payment=payment,
+            payment_id=payment_id,
             payload=payload,
             status='sent' if mock_response_status == 200 else 'failed',
             response=mock_response_text,
@@ -46,9 +80,71 @@ def send_webhook_task(self, payment_id, merchant_id):
         if not success:
             raise Exception("Webhook failed")  # Trigger retry
 
-        logging.info(f"Webhook sent successfully for payment {payment_id}")
+        webhook_logger.info('Webhook delivered', extra={'attempt': attempt})
         return True
     except Exception as exc:
-        logging.error(f"Webhook task failed for payment {payment_id}: {str(exc)}")
-        # Celery will retry automatically
-        self.retry(exc=exc)
\ No newline at end of file
+        webhook_logger.error('Webhook delivery failed: %s', exc, extra={'attempt': attempt})
+        # Retries go to their own queue so they never queue ahead of fresh events;
+        # later events for the payment may go out first, receivers order by sequence
+        task.retry(exc=exc, queue=settings.CELERY_WEBHOOK_RETRY_QUEUE)
+
+
+@shared_task(acks_late=True)
+def archive_webhook_logs_task():
+    """
+    Periodic task (celery beat) that moves WebhookLog rows past the retention
+    window into the daily compressed archive files.
+    """
+    result = WebhookLogArchiver.archive()
+    logger.info('Archived %d webhook logs into %d day files', result['archived'], len(result['days']))
+    return result
+
+
+@shared_task(acks_late=True)
+def replay_webhooks_task(job_pk):
+    """
+    Process one batch of a merchant webhook replay job.
+    Each batch re-queues itself until the job is complete.
+    """
+    from .services import WebhookReplayer  # services imports this module
+
+    WebhookReplayer.run_batch(job_pk)
+
+
+@shared_task(acks_late=True)
+def settle_merchants_task():
+    """
+    Periodic task (celery beat) that starts the day's settlement batch and
+    queues a task per chunk of merchants. Safe to run again for the same day.
+    """
+    batch, chunks = SettlementEngine.start()
+    for first_merchant_id, last_merchant_id in chunks:
+        settle_merchant_chunk_task.delay(batch.pk, first_merchant_id, last_merchant_id)
+    logger.info('Settlement batch %s: %d merchant chunks queued', batch.batch_id, len(chunks))
+    return len(chunks)
+
+
+@shared_task(acks_late=True)
+def settle_merchant_chunk_task(batch_pk, first_merchant_id, last_merchant_id):
+    """Pay out one chunk of merchants of a settlement batch."""
+    return SettlementEngine.settle_chunk(batch_pk, first_merchant_id, last_merchant_id)
+
+
+@shared_task(acks_late=True)
+def record_pricing_volumes_task():
+    """
+    Periodic task (celery beat) that records every merchant's captured
+    volume last month, which the pricing tiers are chosen by.
+    """
+    count = PricingCache.record_volumes()
+    logger.info('Recorded last month\'s volume of %d merchants', count)
+    return count
+
+
+@shared_task(acks_late=True)
+def flush_expired_tokens_task():
+    """
+    Delete expired outstanding and blacklisted refresh tokens so the
+    token_blacklist tables stay bounded by the refresh token lifetime.
+    """
+    call_command('flushexpiredtokens')
@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     RegisterView, RegisterAdminView, CustomTokenObtainPairView,LogoutView ,CustomTokenRefreshView
      , OrderCreateView, PaymentProcessView, RefundProcessView, AdminStatsView,MerchantStatsView,InProgressOrdersView,
-CompletedPaymentView)
+CompletedPaymentView, WebhookReplayView, WebhookReplayStatusView)
 
 urlpatterns = [
     path('api/v1/auth/register/', RegisterView.as_view(), name='register'),  # register the merchant user
@@ -17,4 +17,6 @@ urlpatterns = [
     path('api/v1/refunds/', RefundProcessView.as_view(), name='refund_process'),
     path('api/v1/admin/stats/', AdminStatsView.as_view(), name='admin_stats'),
     path('api/v1/merchants/stats/', MerchantStatsView.as_view(), name='merchant_stats'),
+    path('api/v1/webhooks/replay/', WebhookReplayView.as_view(), name='webhook_replay'),
+    path('api/v1/webhooks/replay/<str:job_id>/', WebhookReplayStatusView.as_view(), name='webhook_replay_status'),
 ]
\ No newline at end of file
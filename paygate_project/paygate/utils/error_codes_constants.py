@@ -13,6 +13,7 @@ class ErrorCodes:
     3xxx = Payment Processing (3000-3099)
     4xxx = Refund Processing (4000-4099)
     5xxx = Statistics & Reporting (5000-5099)
+    6xxx = Webhooks (6000-6099)
     9xxx = System/Server Errors (9000-9099)
     """
     
@@ -49,6 +50,9 @@ class ErrorCodes:
     UNAUTHORIZED_NOT_ADMIN = 1051
     FORBIDDEN_INSUFFICIENT_PERMISSIONS = 1052
     
+    # Load Shedding (1060-1069)
+    AUTH_SERVICE_BUSY = 1060
+    
     # ========================================
     # 2xxx - Order Management
     # ========================================
@@ -123,6 +127,15 @@ class ErrorCodes:
     STATS_INVALID_MERCHANT_ID = 5011
     STATS_INVALID_DATE_RANGE = 5012
     
+    # ========================================
+    # 6xxx - Webhooks
+    # ========================================
+    
+    # Webhook Replay (6000-6009)
+    WEBHOOK_REPLAY_INVALID_RANGE = 6001
+    WEBHOOK_REPLAY_INVALID_STATUS = 6002
+    WEBHOOK_REPLAY_NOT_FOUND = 6003
+    
     # ========================================
     # 9xxx - System/Server Errors
     # ========================================
@@ -130,6 +143,7 @@ class ErrorCodes:
     INTERNAL_SERVER_ERROR = 9000
     DATABASE_CONNECTION_ERROR = 9001
     EXTERNAL_SERVICE_UNAVAILABLE = 9002
+    RATE_LIMIT_EXCEEDED = 9010
     UNKNOWN_ERROR = 9099
 
 
@@ -159,6 +173,8 @@ ERROR_MESSAGES = {
     ErrorCodes.UNAUTHORIZED_NOT_ADMIN: "User is not an admin",
     ErrorCodes.FORBIDDEN_INSUFFICIENT_PERMISSIONS: "Insufficient permissions",
     
+    ErrorCodes.AUTH_SERVICE_BUSY: "Authentication service busy, please retry",
+    
     # Order Management
     ErrorCodes.ORDER_MISSING_AMOUNT: "Amount is required",
     ErrorCodes.ORDER_INVALID_AMOUNT_FORMAT: "Invalid amount format",
@@ -209,10 +225,16 @@ ERROR_MESSAGES = {
     ErrorCodes.STATS_INVALID_MERCHANT_ID: "Invalid merchant ID",
     ErrorCodes.STATS_INVALID_DATE_RANGE: "Invalid date range",
     
+    # Webhooks
+    ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE: "Invalid replay time range",
+    ErrorCodes.WEBHOOK_REPLAY_INVALID_STATUS: "Invalid webhook status filter",
+    ErrorCodes.WEBHOOK_REPLAY_NOT_FOUND: "Replay job not found",
+    
     # System Errors
     ErrorCodes.INTERNAL_SERVER_ERROR: "Internal server error",
     ErrorCodes.DATABASE_CONNECTION_ERROR: "Database connection error",
     ErrorCodes.EXTERNAL_SERVICE_UNAVAILABLE: "External service unavailable",
+    ErrorCodes.RATE_LIMIT_EXCEEDED: "Too many requests",
     ErrorCodes.UNKNOWN_ERROR: "Unknown error occurred",
 }
 
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when no hashing slot frees up within PASSWORD_HASH_QUEUE_TIMEOUT."""
+
+
+class PasswordHashPool:
+    """
+    Runs password hashing on a small per-process thread pool with a hard
+    concurrency cap, so a burst of logins or registrations cannot occupy
+    every CPU the worker shares with the payment endpoints. Callers that
+    cannot get a slot within the queue timeout are shed with
+    PasswordHashingBusy instead of piling up behind the burst.
+
+    The PBKDF2 and Argon2 implementations release the GIL, so the request
+    threads of a gthread worker keep running while a hash is computed.
+    """
+
+    def __init__(self, max_workers, queue_timeout):
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._local = threading.local()
+
+    def run(self, func, *args):
+        """
+        Call func(*args) on the pool and return its result.
+        Raises:
+            PasswordHashingBusy: if every slot stayed taken for queue_timeout seconds
+        """
+        if getattr(self._local, 'active', False):
+            # Already on a pool thread (e.g. a hasher calling back into the model)
+            return func(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHashingBusy('Password hashing capacity exhausted')
+        try:
+            return self._executor.submit(self._call, func, args).result()
+        finally:
+            self._slots.release()
+
+    def _call(self, func, args):
+        self._local.active = True
+        try:
+            return func(*args)
+        finally:
+            self._local.active = False
+
+
+password_hashing = PasswordHashPool(settings.PASSWORD_HASH_CONCURRENCY, settings.PASSWORD_HASH_QUEUE_TIMEOUT)
@@ -1,8 +1,38 @@
 # utils/helpers.py
+from django.db import router
 from ..models import Merchant
 from ..jsonResponse.response import JSONResponseSender
 
-def get_merchant_from_user(user):
+def get_user_role(user):
+    """Role embedded in a user's tokens: merchant, admin or user."""
+    if get_user_merchant(user):
+        return 'merchant'
+    return 'admin' if user.is_staff else 'user'
+
+def get_user_merchant(user):
+    """Merchant profile of a user through the reverse relation, so select_related results are reused."""
+    try:
+        return user.merchant
+    except Merchant.DoesNotExist:
+        return None
+
+def get_merchant_from_user(user, token=None):
+    """
+    Merchant profile of the requesting user.
+    Tokens minted at login carry role and merchant_id claims; when the
+    validated token has them no query is made and the returned Merchant only
+    has its id and user loaded (other fields load on first access).
+    Args:
+        user: The authenticated user
+        token: The validated access token (request.auth), if any
+    """
+    if token is not None and 'role' in token:
+        merchant_id = token.get('merchant_id')
+        if merchant_id is None:
+            return None
+        merchant = Merchant.from_db(router.db_for_read(Merchant), ['id', 'user_id'], [merchant_id, user.pk])
+        merchant.user = user
+        return merchant
     try:
         return Merchant.objects.get(user=user)
     except Merchant.DoesNotExist:
@@ -1,13 +1,71 @@
-from django.utils.decorators import method_decorator
-from ratelimit.decorators import ratelimit
+from django.conf import settings
+from rest_framework import exceptions
+
+from ..db_router import read_database, replica_reads, route_reads
+from ..jsonResponse.response import JSONResponseSender
+from .error_codes_constants import ErrorCodes, get_error_message
+from .ratelimit import client_identities, get_rate_limiter, request_identities
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, result):
+        super().__init__('Rate limit exceeded')
+        self.result = result
+
 
 class RateLimitedMixin:
     """
-    Apply rate limiting to any CBV by decorating its dispatch method.
+    Rate limit a DRF view per merchant and API key, or per client IP when
+    the request is anonymous or fails authentication, shared across every
+    process through Redis, and report the caller's quota in RateLimit-*
+    headers. One limiter call per request.
     """
-    @classmethod
-    def as_view(cls, **initkwargs):
-        # Call the original as_view to get the view function
-        view = super().as_view(**initkwargs)
-        # Wrap the view function directly with ratelimit
-        return ratelimit(key='ip', rate='500/m', block=True)(view)
+    rate_limit = None
+
+    def initial(self, request, *args, **kwargs):
+        if getattr(settings, 'RATELIMIT_ENABLE', True):
+            failure = None
+            try:
+                # Authenticates, as DRF's initial() would first thing
+                identities = request_identities(request)
+            except exceptions.APIException as exc:
+                failure, identities = exc, []
+            self.rate_limit = get_rate_limiter().hit(identities or client_identities(request))
+            if not self.rate_limit.allowed:
+                raise RateLimitExceeded(self.rate_limit)
+            if failure is not None:
+                raise failure
+        super().initial(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, RateLimitExceeded):
+            return JSONResponseSender.send_error(
+                code=ErrorCodes.RATE_LIMIT_EXCEEDED,
+                message=get_error_message(ErrorCodes.RATE_LIMIT_EXCEEDED),
+                description=f'Retry after {exc.result.retry_after} seconds',
+                status=429,
+            )
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.rate_limit is not None:
+            for header, value in self.rate_limit.headers().items():
+                response[header] = value
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    Serve a read-only DRF view from the read replica unless the user wrote
+    recently or the replica lags (see db_router.read_database).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(None):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        # Runs after authentication, which reads the user from the primary
+        super().initial(request, *args, **kwargs)
+        route_reads(read_database(request.user))
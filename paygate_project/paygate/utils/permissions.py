@@ -7,5 +7,10 @@ class IsMerchantUser(BasePermission):
 
     def has_permission(self, request, view):
         user = request.user
-        # Check if user is authenticated and linked to a Merchant
-        return bool(user and user.is_authenticated and hasattr(user, 'merchant'))
+        if not (user and user.is_authenticated):
+            return False
+        # Tokens minted at login carry the role claim; older tokens fall back to the DB
+        token = request.auth
+        if token is not None and 'role' in token:
+            return token['role'] == 'merchant'
+        return hasattr(user, 'merchant')
@@ -0,0 +1,263 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Token bucket plus sliding window for each key, in one atomic call.
+# KEYS: one hash per identity. ARGV: per key, burst, refill tokens per ms,
+# window limit and window length in ms. A request is counted against every
+# key only when all of them allow it. The sliding window is the usual
+# two-window approximation: previous window weighted by how much of it still
+# overlaps, plus the current window.
+# Returns {allowed, then per key remaining, quota of the binding policy (burst
+# or window limit) and wait in ms, then now in ms}.
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local allowed = 1
+local state = {}
+for i, key in ipairs(KEYS) do
+  local o = (i - 1) * 4
+  local burst = tonumber(ARGV[o + 1])
+  local rate = tonumber(ARGV[o + 2])
+  local limit = tonumber(ARGV[o + 3])
+  local window = tonumber(ARGV[o + 4])
+  local h = redis.call('HMGET', key, 'tokens', 'ts', 'win', 'cur', 'prev')
+  local tokens = tonumber(h[1]) or burst
+  local ts = tonumber(h[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+  local win = math.floor(now / window)
+  local last = tonumber(h[3]) or win
+  local cur = tonumber(h[4]) or 0
+  local prev = tonumber(h[5]) or 0
+  if last ~= win then
+    if last == win - 1 then prev = cur else prev = 0 end
+    cur = 0
+  end
+  local count = prev * (1 - (now % window) / window) + cur
+  local wait = 0
+  if tokens < 1 then wait = (1 - tokens) / rate end
+  if count + 1 > limit then wait = math.max(wait, window - (now % window)) end
+  if wait > 0 then allowed = 0 end
+  state[i] = {tokens, win, cur, prev, count, limit, window, burst, rate, wait}
+end
+local result = {allowed}
+for i, key in ipairs(KEYS) do
+  local s = state[i]
+  local tokens, cur, count = s[1], s[3], s[5]
+  if allowed == 1 then
+    tokens = tokens - 1
+    cur = cur + 1
+    count = count + 1
+  end
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now, 'win', s[2], 'cur', cur, 'prev', s[4])
+  redis.call('PEXPIRE', key, math.ceil(math.max(2 * s[7], s[8] / s[9])))
+  local quota = s[6]
+  if tokens < s[6] - count then quota = s[8] end
+  table.insert(result, math.max(0, math.floor(math.min(tokens, s[6] - count))))
+  table.insert(result, quota)
+  table.insert(result, math.ceil(s[10]))
+end
+table.insert(result, now)
+return result
+"""
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    burst: int
+    rate: float  # Tokens per second
+    limit: int  # Requests per window
+    window: int  # Seconds
+
+    @classmethod
+    def from_settings(cls, name):
+        return cls(**settings.RATE_LIMITS[name])
+
+    def script_args(self):
+        return [self.burst, self.rate / 1000, self.limit, self.window * 1000]
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int  # Quota of the binding policy (bucket burst or window limit)
+    remaining: int
+    reset: int  # Seconds until that rule's window rolls over
+    retry_after: int  # Seconds to wait when not allowed
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+class LocalRateLimitBackend:
+    """Same algorithm as TOKEN_BUCKET_SCRIPT, in process memory (per-process limits)."""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def hit(self, keys, rules):
+        with self._lock:
+            now = int(time.time() * 1000)
+            allowed, states = True, []
+            for key, rule in zip(keys, rules):
+                burst, rate, limit, window = rule.script_args()
+                h = self._state.get(key, {})
+                tokens = min(burst, h.get('tokens', burst) + max(0, now - h.get('ts', now)) * rate)
+                win = now // window
+                last, cur, prev = h.get('win', win), h.get('cur', 0), h.get('prev', 0)
+                if last != win:
+                    prev = cur if last == win - 1 else 0
+                    cur = 0
+                count = prev * (1 - (now % window) / window) + cur
+                wait = 0
+                if tokens < 1:
+                    wait = (1 - tokens) / rate
+                if count + 1 > limit:
+                    wait = max(wait, window - now % window)
+                if wait > 0:
+                    allowed = False
+                states.append((key, tokens, win, cur, prev, count, burst, limit, wait))
+
+            result = [int(allowed)]
+            for key, tokens, win, cur, prev, count, burst, limit, wait in states:
+                if allowed:
+                    tokens, cur, count = tokens - 1, cur + 1, count + 1
+                self._state[key] = {'tokens': tokens, 'ts': now, 'win': win, 'cur': cur, 'prev': prev}
+                quota = burst if tokens < limit - count else limit
+                result += [max(0, math.floor(min(tokens, limit - count))), quota, math.ceil(wait)]
+            return result + [now]
+
+
+class RedisRateLimitBackend:
+    """Shared limits for every process; one EVALSHA round trip per request."""
+
+    def __init__(self, url, timeout):
+        import redis
+
+        # Bounded, so a hung Redis falls back to in-process limits instead of
+        # holding the request
+        client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def hit(self, keys, rules):
+        args = [arg for rule in rules for arg in rule.script_args()]
+        return self._script(keys=keys, args=args)
+
+
+class RateLimiter:
+    """
+    Checks a request's identities against their rules.
+
+    Identities that were recently refused are remembered in process until
+    their retry time, so a client hammering past its limit is turned away
+    without a round trip to Redis.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._fallback = LocalRateLimitBackend()
+        self._blocked = {}
+
+    def hit(self, identities):
+        """
+        Args:
+            identities: List of (key, RateLimitRule) that must all allow the request
+        Returns:
+            RateLimitResult
+        """
+        now = time.time()
+        for key, rule in identities:
+            blocked_until = self._blocked.get(key)
+            if blocked_until is not None:
+                if blocked_until > now:
+                    wait = math.ceil(blocked_until - now)
+                    return RateLimitResult(False, rule.limit, 0, wait, wait)
+                self._blocked.pop(key, None)
+
+        keys = [key for key, _ in identities]
+        rules = [rule for _, rule in identities]
+        try:
+            result = self.backend.hit(keys, rules)
+        except Exception:
+            # Limits degrade to per-process rather than failing requests
+            logger.warning('Rate limit backend unavailable, using in-process limits', exc_info=True)
+            result = self._fallback.hit(keys, rules)
+
+        allowed, now_ms = bool(result[0]), int(result[-1])
+        tightest, max_wait_ms = None, 0
+        for i, (key, rule) in enumerate(identities):
+            remaining, quota, wait_ms = (int(v) for v in result[1 + 3 * i:4 + 3 * i])
+            if wait_ms > 0:
+                if len(self._blocked) > 10000:
+                    self._blocked.clear()
+                self._blocked[key] = now + wait_ms / 1000
+            max_wait_ms = max(max_wait_ms, wait_ms)
+            if tightest is None or remaining < tightest[2]:
+                tightest = (rule, quota, remaining)
+
+        rule, quota, remaining = tightest
+        window_ms = rule.window * 1000
+        reset = math.ceil((window_ms - now_ms % window_ms) / 1000)
+        retry_after = max(1, math.ceil(max_wait_ms / 1000))
+        return RateLimitResult(allowed, quota, remaining, reset, retry_after)
+
+
+def client_identities(request):
+    """
+    Rate limit identity of the client IP, for anonymous requests and those
+    whose authentication failed. Authenticated requests are limited by
+    merchant alone, so merchants behind one NAT do not share a bucket.
+    """
+    return [(f"ratelimit:{{ip:{request.META.get('REMOTE_ADDR', '')}}}", RateLimitRule.from_settings('ip'))]
+
+
+def request_identities(request):
+    """
+    Rate limit identities of an authenticated DRF request: the merchant (from
+    the token's merchant_id claim where present) and the X-API-Key header.
+    Keys of one request share a Redis Cluster hash tag so the script can touch
+    them together. Empty for anonymous requests.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return []
+    token = request.auth
+    merchant_id = token.get('merchant_id') if token is not None else None
+    tag = f'm:{merchant_id}' if merchant_id is not None else f'u:{user.pk}'
+    identities = [(f'ratelimit:{{{tag}}}', RateLimitRule.from_settings('merchant'))]
+    api_key = request.META.get('HTTP_X_API_KEY')
+    if api_key:
+        digest = hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        identities.append((f'ratelimit:{{{tag}}}:k:{digest}', RateLimitRule.from_settings('api_key')))
+    return identities
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Process-wide limiter, on Redis when RATELIMIT_REDIS_URL is set."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                url = settings.RATELIMIT_REDIS_URL
+                backend = RedisRateLimitBackend(url, settings.RATELIMIT_REDIS_TIMEOUT) if url else LocalRateLimitBackend()
+                _limiter = RateLimiter(backend)
+    return _limiter
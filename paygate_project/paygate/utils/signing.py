@@ -0,0 +1,32 @@
+import hashlib
+import hmac
+import json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def _get_signer(merchant_id, secret):
+    """
+    Keyed HMAC per merchant, built once per process. Keying on the secret as
+    well as the merchant id means a rotated secret simply misses the cache.
+    """
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+
+def serialize_payload(payload):
+    """Canonical JSON body used both for signing and for delivery."""
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+
+def sign_payload(payload, merchant):
+    """
+    Return the hex HMAC-SHA256 signature of a webhook payload.
+    Args:
+        payload: Dict that will be delivered to the merchant
+        merchant: Merchant instance from models.Merchant
+    Returns:
+        str: Signature sent alongside the payload
+    """
+    signer = _get_signer(merchant.pk, merchant.webhook_secret).copy()
+    signer.update(serialize_payload(payload))
+    return signer.hexdigest()
@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+BLACKLIST_KEY_PREFIX = 'jwt:blacklist:'
+BLACKLIST_SEQ_KEY = 'jwt:blacklist:seq'
+BLACKLIST_EVENT_PREFIX = 'jwt:blacklist:event:'
+# Events older than this are not replayed; a process that far behind rebuilds from the DB
+BLACKLIST_EVENT_TTL = 24 * 60 * 60
+BLACKLIST_MAX_REPLAY = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. Answers "definitely absent" or
+    "possibly present"; false positives occur at roughly error_rate once
+    capacity items have been added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class TokenBlacklist:
+    """
+    Refresh token blacklist lookups in three tiers:
+
+    1. An in-process Bloom filter answers the common "not blacklisted" case
+       without any I/O.
+    2. The cache (Redis in production) holds one key per blacklisted jti that
+       expires with the token.
+    3. simplejwt's BlacklistedToken table stays the durable record and is only
+       read when the cache has no answer.
+
+    Blacklisting bumps a sequence counter in the cache and records the jti
+    under it, so every process replays new entries into its filter at most
+    JWT_BLACKLIST_SYNC_INTERVAL seconds later. A token blacklisted in another
+    process can therefore refresh for up to that long; the access tokens it
+    already issued stay valid far longer regardless.
+
+    The filter is built from the DB when a worker starts (see warm() and
+    gunicorn.conf.py), never on a request thread: a process without a
+    usable filter, before its first build or after the cache was flushed,
+    rebuilds it on a background thread and answers from the cache and the
+    DB meanwhile.
+    """
+    _lock = threading.Lock()
+    _bloom = None
+    _seq = 0
+    _synced_at = 0.0
+    _rebuilding = False
+
+    @staticmethod
+    def cache_key(jti):
+        return f'{BLACKLIST_KEY_PREFIX}{jti}'
+
+    @staticmethod
+    def _ttl(exp):
+        return max(1, int(exp - time.time()))
+
+    @classmethod
+    def _rebuild(cls):
+        """Rebuild the filter from every unexpired blacklisted token in the DB, without holding the lock."""
+        # Read first: tokens blacklisted during the build are replayed from later events
+        seq = cache.get(BLACKLIST_SEQ_KEY, 0)
+        bloom = BloomFilter(settings.JWT_BLACKLIST_BLOOM_CAPACITY, settings.JWT_BLACKLIST_BLOOM_ERROR_RATE)
+        jtis = BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()
+        ).values_list('token__jti', flat=True)
+        for jti in jtis.iterator(chunk_size=10000):
+            bloom.add(jti)
+        with cls._lock:
+            cls._bloom, cls._seq, cls._synced_at = bloom, seq, time.monotonic()
+
+    @classmethod
+    def _rebuild_in_background(cls):
+        """Start a rebuild on its own thread unless one is running. Called with the lock held."""
+        cls._bloom = None
+        if cls._rebuilding:
+            return
+        cls._rebuilding = True
+
+        def run():
+            try:
+                cls._rebuild()
+            except Exception:
+                logger.exception('Refresh token blacklist filter rebuild failed')
+            finally:
+                with cls._lock:
+                    cls._rebuilding = False
+                connections.close_all()
+
+        threading.Thread(target=run, name='token-blacklist-rebuild', daemon=True).start()
+
+    @classmethod
+    def _sync(cls):
+        """
+        Replay blacklist events published since the last sync into the filter.
+        Returns:
+            BloomFilter: The filter, or None while it is being rebuilt
+        """
+        now = time.monotonic()
+        if cls._bloom is not None and now - cls._synced_at < settings.JWT_BLACKLIST_SYNC_INTERVAL:
+            return cls._bloom
+        with cls._lock:
+            if cls._bloom is None:
+                cls._rebuild_in_background()
+            else:
+                seq = cache.get(BLACKLIST_SEQ_KEY, 0)
+                if seq < cls._seq or seq - cls._seq > BLACKLIST_MAX_REPLAY:
+                    # The cache was flushed (its sequence restarted) or we are too far behind
+                    cls._rebuild_in_background()
+                elif seq > cls._seq:
+                    keys = [f'{BLACKLIST_EVENT_PREFIX}{n}' for n in range(cls._seq + 1, seq + 1)]
+                    events = cache.get_many(keys)
+                    if len(events) < len(keys):
+                        cls._rebuild_in_background()
+                    else:
+                        for jti in events.values():
+                            cls._bloom.add(jti)
+                        cls._seq = seq
+                        cls._synced_at = now
+                else:
+                    cls._synced_at = now
+            return cls._bloom
+
+    @classmethod
+    def warm(cls):
+        """Build the filter on the calling thread, e.g. as a worker starts, before it serves requests."""
+        cls._rebuild()
+
+    @classmethod
+    def reset(cls):
+        """Drop the in-process filter; it is rebuilt in the background on the next lookup."""
+        with cls._lock:
+            cls._bloom, cls._seq, cls._synced_at = None, 0, 0.0
+
+    @classmethod
+    def is_blacklisted(cls, jti):
+        """
+        Check whether a refresh token has been blacklisted.
+        Args:
+            jti: The token's JTI claim
+        Returns:
+            bool: True if the token must be rejected
+        """
+        bloom = cls._sync()
+        if bloom is not None and jti not in bloom:
+            return False
+
+        cached = cache.get(cls.cache_key(jti))
+        if cached is not None:
+            return cached
+
+        # Filter false positive, evicted cache entry or no filter yet: ask the durable record
+        token = BlacklistedToken.objects.filter(token__jti=jti).values_list('token__expires_at', flat=True).first()
+        if token is None:
+            # add() rather than set(): a token blacklisted since the read above
+            # must not be overwritten with this stale answer
+            cache.add(cls.cache_key(jti), False, BLACKLIST_EVENT_TTL)
+            return False
+        cache.set(cls.cache_key(jti), True, cls._ttl(token.timestamp()))
+        return True
+
+    @classmethod
+    def add(cls, jti, exp):
+        """
+        Publish a newly blacklisted token to the cache and every process' filter.
+        Args:
+            jti: The token's JTI claim
+            exp: The token's expiry as a unix timestamp
+        """
+        cache.set(cls.cache_key(jti), True, cls._ttl(exp))
+        cache.add(BLACKLIST_SEQ_KEY, 0, None)
+        seq = cache.incr(BLACKLIST_SEQ_KEY)
+        cache.set(f'{BLACKLIST_EVENT_PREFIX}{seq}', jti, BLACKLIST_EVENT_TTL)
+        with cls._lock:
+            if cls._bloom is not None:
+                cls._bloom.add(jti)
+
+
+class CachedBlacklistRefreshToken(RefreshToken):
+    """RefreshToken whose blacklist checks go through TokenBlacklist."""
+
+    def check_blacklist(self):
+        if TokenBlacklist.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        result = super().blacklist()
+        TokenBlacklist.add(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+        return result
@@ -1,27 +1,55 @@
 from rest_framework.views import APIView
-from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.exceptions import TokenError
-from .models import Merchant,User , Order, Payment
-from ratelimit.decorators import ratelimit
-from .serializers import MerchantSerializer, UserSerializer , CustomTokenObtainPairSerializer , OrderSerializer, PaymentSerializer
+from .models import Merchant,User , Order, Payment, WebhookReplayJob, LedgerEntry
+from .serializers import MerchantSerializer, UserSerializer , CustomTokenObtainPairSerializer , CachedTokenRefreshSerializer, OrderSerializer, PaymentSerializer, WebhookReplayJobSerializer
 from .jsonResponse.response import JSONResponseSender
 from django.utils.decorators import method_decorator
-from .services import WebhookHandler, PaymentProcessor
-from rest_framework.decorators import action
+from .services import WebhookHandler, PaymentProcessor, WebhookReplayer
+from .ledger import Ledger, REVENUE_ENTRY_TYPES
 from django.db.models import Count, Q, Sum
 from .utils.permissions import IsMerchantUser
 from django.views.decorators.csrf import csrf_exempt
-from .utils.mixins import RateLimitedMixin
+from .utils.mixins import RateLimitedMixin, ReplicaReadMixin
 from .utils.helpers import get_merchant_from_user
+from .utils.token_blacklist import CachedBlacklistRefreshToken
+from .authentication import revoke_access_token
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.conf import settings
 from django.db.models.functions import TruncDate
-import  requests
 from datetime import timedelta
-import uuid
+from decimal import Decimal, InvalidOperation
 from .utils.error_codes_constants import ErrorCodes, get_error_message
+from .utils.hashing import PasswordHashingBusy
+from .metrics import render_metrics
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def auth_busy_response():
+    """503 for a login or registration shed by the password hashing pool"""
+    response = JSONResponseSender.send_error(
+        code=ErrorCodes.AUTH_SERVICE_BUSY,
+        message=get_error_message(ErrorCodes.AUTH_SERVICE_BUSY),
+        description='Too many concurrent logins, retry shortly',
+        status=503,
+    )
+    response['Retry-After'] = '1'
+    return response
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; plain Django view so scrapes skip DRF auth and rate limits"""
+    token = settings.METRICS_AUTH_TOKEN
+    if token and not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -54,6 +82,8 @@ class CustomTokenObtainPairView(TokenObtainPairView):
                 max_age=7*24*60*60  # 7 days
             )
             return response
+        except PasswordHashingBusy:
+            return auth_busy_response()
         except Exception as e:
             return JSONResponseSender.send_error(
                 code=ErrorCodes.LOGIN_FAILED,
@@ -68,7 +98,10 @@ class RegisterView(RateLimitedMixin,APIView):
     def post(self, request):
         serializer = MerchantSerializer(data=request.data)
         if serializer.is_valid():
-            merchant = serializer.save()
+            try:
+                merchant = serializer.save()
+            except PasswordHashingBusy:
+                return auth_busy_response()
             refresh = CustomTokenObtainPairSerializer.get_token(merchant.user)
             access_token = str(refresh.access_token)
             response = JSONResponseSender.send_success(
@@ -109,13 +142,16 @@ class RegisterAdminView(APIView):
             )
         user_serializer = UserSerializer(data=user_data)
         if user_serializer.is_valid():
-            user = User.objects.create_user(
-                email=user_data['email'],
-                name=user_data['name'],
-                password=user_data['password'],
-                is_staff=True,
-                is_superuser=True
-            )
+            try:
+                user = User.objects.create_user(
+                    email=user_data['email'],
+                    name=user_data['name'],
+                    password=user_data['password'],
+                    is_staff=True,
+                    is_superuser=True
+                )
+            except PasswordHashingBusy:
+                return auth_busy_response()
             refresh = CustomTokenObtainPairSerializer.get_token(user)
             access_token = str(refresh.access_token)
             response = JSONResponseSender.send_success(
@@ -140,7 +176,7 @@ class RegisterAdminView(APIView):
         )
 
 class CustomTokenRefreshView(RateLimitedMixin,TokenRefreshView):
-
+    serializer_class = CachedTokenRefreshSerializer
 
     def post(self, request, *args, **kwargs):
         refresh_token = request.COOKIES.get('refresh_token')
@@ -183,9 +219,11 @@ class LogoutView(RateLimitedMixin,APIView):
             )
 
         try:
-            token = RefreshToken(refresh_token)
+            token = CachedBlacklistRefreshToken(refresh_token)
             token.verify()      # Ensure it’s valid
             token.blacklist()   # Blacklist the refresh token
+            if request.auth is not None:
+                revoke_access_token(request.auth)  # Stop accepting the access token too
 
             response = JSONResponseSender.send_success(
                 data={},
@@ -218,7 +256,7 @@ class OrderCreateView(RateLimitedMixin,APIView):
 
     def post(self, request):
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
 
@@ -252,13 +290,13 @@ class OrderCreateView(RateLimitedMixin,APIView):
             )
 
 
-class InProgressOrdersView(RateLimitedMixin,APIView):
+class InProgressOrdersView(RateLimitedMixin,ReplicaReadMixin,APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         """Return list of only order_id for orders with status='created'"""
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
             order_ids = (
@@ -275,20 +313,22 @@ class InProgressOrdersView(RateLimitedMixin,APIView):
         except Exception as e:
             return JSONResponseSender.send_error(ErrorCodes.INTERNAL_SERVER_ERROR, get_error_message(ErrorCodes.INTERNAL_SERVER_ERROR), str(e))
 
-class CompletedPaymentView(APIView):
+class CompletedPaymentView(ReplicaReadMixin,APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
 
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
             # payment_id = (
             #     Payment.objects.filter(order__merchant=merchant, status='captured').order_by('-created_at').values_list('payment_id', flat=True)
             # )
             payments = (
-                Payment.objects.filter(order__merchant=merchant, status='captured').order_by('-created_at')
+                Payment.objects.filter(order__merchant=merchant, status='captured')
+                .select_related('order')
+                .order_by('-created_at')
             )
             serializer = PaymentSerializer(payments, many=True)
             return JSONResponseSender.send_success(serializer.data, message='Payment completed successfully')
@@ -305,11 +345,12 @@ class PaymentProcessView(APIView):
         card_details = request.data.get('card_details', {})
 
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
 
-            order = Order.objects.get(order_id=order_id, merchant=merchant)
+            # The merchant is joined in for the webhook sent by process_payment
+            order = Order.objects.select_related('merchant').get(order_id=order_id, merchant=merchant)
             payment, success = PaymentProcessor.process_payment(order, card_details)
 
             if not payment:
@@ -343,7 +384,7 @@ class PaymentProcessView(APIView):
                 description='Order not found',
             )
         except Exception as e:
-            print(str(e))
+            logger.exception('Payment processing failed')
             return JSONResponseSender.send_error(ErrorCodes.INTERNAL_SERVER_ERROR,get_error_message(ErrorCodes.INTERNAL_SERVER_ERROR),str(e))
 
 
@@ -354,18 +395,35 @@ class RefundProcessView(RateLimitedMixin,APIView):
     def post(self, request):
 
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
 
             payment_id = request.data.get('payment_id')
 
-            payment = Payment.objects.get(payment_id=payment_id, order__merchant=merchant)
-            success = PaymentProcessor.process_refund(payment)
+            # The merchant from the token claims only has its id loaded; the webhook needs the rest
+            payment = Payment.objects.select_related('order__merchant').get(payment_id=payment_id, order__merchant=merchant)
+
+            # Partial refund when an amount is given, otherwise everything not yet refunded
+            amount = request.data.get('amount')
+            if amount is not None:
+                try:
+                    amount = Decimal(str(amount))
+                except InvalidOperation:
+                    amount = None
+                if amount is None or not amount.is_finite() or amount <= 0 or amount > payment.amount - payment.refunded_amount:
+                    return JSONResponseSender.send_error(ErrorCodes.REFUND_INVALID_AMOUNT, get_error_message(ErrorCodes.REFUND_INVALID_AMOUNT), "amount must be positive and at most the amount left to refund")
+                success = PaymentProcessor.process_refund(payment, amount)
+            else:
+                success = PaymentProcessor.process_refund(payment)
             if success:
-                WebhookHandler.send_webhook(payment, merchant)
+                WebhookHandler.send_webhook(payment, payment.order.merchant)
                 return JSONResponseSender.send_success(
-                    data={'status': 'refunded'},
+                    data={
+                        'status': 'refunded',
+                        'payment_status': payment.status,
+                        'refunded_amount': str(payment.refunded_amount),
+                    },
                     message='Refund processed successfully',
                 )
             return JSONResponseSender.send_error(
@@ -382,6 +440,62 @@ class RefundProcessView(RateLimitedMixin,APIView):
 
 
 
+class WebhookReplayView(RateLimitedMixin,APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """Queue redelivery of the merchant's webhooks logged between start and end"""
+        try:
+            merchant = get_merchant_from_user(request.user, request.auth)
+            if not merchant:
+                return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
+
+            start = parse_datetime(request.data.get('start') or '')
+            end = parse_datetime(request.data.get('end') or '')
+            log_status = request.data.get('status', '')
+            if not start or not end or start > end:
+                return JSONResponseSender.send_error(ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE, get_error_message(ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE), "start and end must be ISO 8601 datetimes with start before end")
+            if timezone.is_naive(start):
+                start = timezone.make_aware(start)
+            if timezone.is_naive(end):
+                end = timezone.make_aware(end)
+            if end - start > timedelta(days=settings.WEBHOOK_REPLAY_MAX_DAYS):
+                return JSONResponseSender.send_error(ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE, get_error_message(ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE), f"Range cannot exceed {settings.WEBHOOK_REPLAY_MAX_DAYS} days")
+            if log_status not in ('', 'sent', 'failed'):
+                return JSONResponseSender.send_error(ErrorCodes.WEBHOOK_REPLAY_INVALID_STATUS, get_error_message(ErrorCodes.WEBHOOK_REPLAY_INVALID_STATUS), "status must be 'sent' or 'failed'")
+
+            job = WebhookReplayer.start(merchant, start, end, log_status)
+            job.refresh_from_db()
+            return JSONResponseSender.send_success(
+                data=WebhookReplayJobSerializer(job).data,
+                message='Webhook replay queued',
+            )
+        except Exception as e:
+            return JSONResponseSender.send_error(ErrorCodes.INTERNAL_SERVER_ERROR, get_error_message(ErrorCodes.INTERNAL_SERVER_ERROR), str(e))
+
+
+class WebhookReplayStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        """Return progress of one of the merchant's replay jobs"""
+        try:
+            merchant = get_merchant_from_user(request.user, request.auth)
+            if not merchant:
+                return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT, get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT), "User is not a merchant")
+
+            job = WebhookReplayJob.objects.get(job_id=job_id, merchant=merchant)
+            return JSONResponseSender.send_success(
+                data=WebhookReplayJobSerializer(job).data,
+                message='Webhook replay progress retrieved successfully',
+            )
+        except WebhookReplayJob.DoesNotExist:
+            return JSONResponseSender.send_error(ErrorCodes.WEBHOOK_REPLAY_NOT_FOUND, get_error_message(ErrorCodes.WEBHOOK_REPLAY_NOT_FOUND), "Replay job not found")
+        except Exception as e:
+            return JSONResponseSender.send_error(ErrorCodes.INTERNAL_SERVER_ERROR, get_error_message(ErrorCodes.INTERNAL_SERVER_ERROR), str(e))
+
+
+
 
 # class AdminStatsView(APIView):
 #     permission_classes = [IsAdminUser]
@@ -481,7 +595,7 @@ class RefundProcessView(RateLimitedMixin,APIView):
 #
 #     def get(self, request):
 #         try:
-#             merchant = get_merchant_from_user(request.user)
+#             merchant = get_merchant_from_user(request.user, request.auth)
 #             if not merchant:
 #                 return JSONResponseSender.send_error(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT,get_error_message(ErrorCodes.UNAUTHORIZED_NOT_MERCHANT),'User is not a merchant')
 #
@@ -514,12 +628,12 @@ class RefundProcessView(RateLimitedMixin,APIView):
 #             return JSONResponseSender.send_error(ErrorCodes.STATS_RETRIEVAL_FAILED,get_error_message(ErrorCodes.STATS_RETRIEVAL_FAILED),str(e))
 
 
-class MerchantStatsView(APIView):
+class MerchantStatsView(ReplicaReadMixin,APIView):
     permission_classes = [IsAuthenticated, IsMerchantUser]
 
     def get(self, request):
         try:
-            merchant = get_merchant_from_user(request.user)
+            merchant = get_merchant_from_user(request.user, request.auth)
             if not merchant:
                 return JSONResponseSender.send_error(
                     ErrorCodes.UNAUTHORIZED_NOT_MERCHANT,
@@ -545,11 +659,17 @@ class MerchantStatsView(APIView):
                 created_at__gte=current_period_start
             ).count()
 
-            total_revenue = Payment.objects.filter(
-                order__merchant=merchant,
-                status__in=['captured', 'refunded'],
-                created_at__gte=current_period_start
-            ).aggregate(total=Sum('merchant_payout'))['total'] or 0
+            # Revenue is read from the ledger: captures less commission and refunds
+            revenue_entries = Ledger.merchant_entries(merchant).filter(entry_type__in=REVENUE_ENTRY_TYPES)
+            revenue = revenue_entries.aggregate(
+                current=Sum('amount', filter=Q(created_at__gte=current_period_start)),
+                previous=Sum('amount', filter=Q(
+                    created_at__gte=previous_period_start,
+                    created_at__lt=previous_period_end
+                )),
+            )
+            total_revenue = revenue['current'] or 0
+            balance = Ledger.balance(merchant)
 
             total_successful_refunds = Payment.objects.filter(
                 order__merchant=merchant,
@@ -576,12 +696,7 @@ class MerchantStatsView(APIView):
                 created_at__lt=previous_period_end
             ).count()
 
-            prev_total_revenue = Payment.objects.filter(
-                order__merchant=merchant,
-                status__in=['captured', 'refunded'],
-                created_at__gte=previous_period_start,
-                created_at__lt=previous_period_end
-            ).aggregate(total=Sum('merchant_payout'))['total'] or 0
+            prev_total_revenue = revenue['previous'] or 0
 
             prev_total_successful_payments = Payment.objects.filter(
                 order__merchant=merchant,
@@ -607,15 +722,13 @@ class MerchantStatsView(APIView):
             )
 
             # Time-series data for charts
-            daily_revenue = Payment.objects.filter(
-                order__merchant=merchant,
-                status='captured',
+            daily_revenue = revenue_entries.filter(
                 created_at__gte=current_period_start
             ).annotate(
                 date=TruncDate('created_at')
             ).values('date').annotate(
-                revenue=Sum('merchant_payout'),
-                count=Count('id')
+                revenue=Sum('amount'),
+                count=Count('id', filter=Q(entry_type='capture'))
             ).order_by('date')
 
             daily_orders = Order.objects.filter(
@@ -656,6 +769,7 @@ class MerchantStatsView(APIView):
                     # Summary stats
                     'total_orders': total_orders,
                     'total_revenue': str(total_revenue),
+                    'balance': str(balance),
                     'successful_payments': total_successful_payments,
                     'successful_refunds': total_successful_refunds,
                     'canceled_payments': total_canceled_payments,
@@ -706,7 +820,7 @@ class MerchantStatsView(APIView):
             )
 
 
-class AdminStatsView(APIView):
+class AdminStatsView(ReplicaReadMixin,APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
@@ -737,10 +851,15 @@ class AdminStatsView(APIView):
                     created_at__gte=current_period_start
                 ).count()
                 total_admins = User.objects.filter(is_staff=True).count()
-                total_commission = Payment.objects.filter(
-                    status__in=['captured', 'refunded'],
-                    created_at__gte=current_period_start
-                ).aggregate(total=Sum('commission_amount'))['total'] or 0
+                # Commission is read from the platform's ledger account
+                commission = Ledger.commission_entries().aggregate(
+                    current=Sum('amount', filter=Q(created_at__gte=current_period_start)),
+                    previous=Sum('amount', filter=Q(
+                        created_at__gte=previous_period_start,
+                        created_at__lt=previous_period_end
+                    )),
+                )
+                total_commission = commission['current'] or 0
 
                 total_orders = Order.objects.filter(
                     created_at__gte=current_period_start
@@ -791,11 +910,7 @@ class AdminStatsView(APIView):
                     created_at__lt=previous_period_end
                 ).count()
 
-                prev_total_commission = Payment.objects.filter(
-                    status__in=['captured', 'refunded'],
-                    created_at__gte=previous_period_start,
-                    created_at__lt=previous_period_end
-                ).aggregate(total=Sum('commission_amount'))['total'] or 0
+                prev_total_commission = commission['previous'] or 0
 
                 prev_total_orders = Order.objects.filter(
                     created_at__gte=previous_period_start,
@@ -823,13 +938,12 @@ class AdminStatsView(APIView):
                 )
 
                 # DAILY DATA
-                daily_commission = Payment.objects.filter(
-                    status='captured',
+                daily_commission = Ledger.commission_entries().filter(
                     created_at__gte=current_period_start
                 ).annotate(
                     date=TruncDate('created_at')
                 ).values('date').annotate(
-                    commission=Sum('commission_amount'),
+                    commission=Sum('amount'),
                     count=Count('id')
                 ).order_by('date')
 
@@ -850,15 +964,16 @@ class AdminStatsView(APIView):
                     created_at__gte=current_period_start
                 ).values('status').annotate(count=Count('id'))
 
-                # TOP MERCHANTS BY COMMISSION
-                top_merchants = Payment.objects.filter(
-                    status__in=['captured', 'refunded'],
+                # TOP MERCHANTS BY COMMISSION (the merchant side of each commission posting is a debit)
+                top_merchants = LedgerEntry.objects.filter(
+                    account__kind='merchant',
+                    entry_type='commission',
                     created_at__gte=current_period_start
                 ).values(
-                    'order__merchant__user__email',
-                    'order__merchant__user__name'
+                    'account__merchant__user__email',
+                    'account__merchant__user__name'
                 ).annotate(
-                    total_commission=Sum('commission_amount'),
+                    total_commission=-Sum('amount'),
                     order_count=Count('id')
                 ).order_by('-total_commission')[:10]
 
@@ -911,8 +1026,8 @@ class AdminStatsView(APIView):
 
                         'top_merchants': [
                             {
-                                'email': item['order__merchant__user__email'],
-                                'business_name': item['order__merchant__user__name'],
+                                'email': item['account__merchant__user__email'],
+                                'business_name': item['account__merchant__user__name'],
                                 'total_commission': str(item['total_commission']),
                                 'order_count': item['order_count']
                             }
@@ -1,3 +1,10 @@
-from .celery import app as celery_app
+__all__ = ('celery_app',)
 
-__all__ = ('celery_app',)
\ No newline at end of file
+
+def __getattr__(name):
+    # Created on first use (paygate.tasks imports it) rather than with Django,
+    # so web processes only load Celery once they publish a task
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,6 +1,9 @@
 # paygate_project /celery.py
+import gc
 import os
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import task_postrun, task_prerun, worker_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'paygate_project.settings')
@@ -12,4 +15,48 @@ app = Celery('paygate_project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+app.conf.beat_schedule = {
+    'archive-webhook-logs': {
+        'task': 'paygate.tasks.archive_webhook_logs_task',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'flush-expired-tokens': {
+        'task': 'paygate.tasks.flush_expired_tokens_task',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Last month's volumes for the pricing tiers, right after a month closes;
+    # daily so a missed run catches up (TIME_ZONE)
+    'record-pricing-volumes': {
+        'task': 'paygate.tasks.record_pricing_volumes_task',
+        'schedule': crontab(hour=0, minute=0),
+    },
+    # Pays out balances as of midnight (TIME_ZONE)
+    'settle-merchants': {
+        'task': 'paygate.tasks.settle_merchants_task',
+        'schedule': crontab(hour=0, minute=30),
+    },
+}
+
+# Task runtime metrics and the worker's metrics server (paygate.metrics does
+# not import Celery itself, so web processes can load it without Celery)
+from paygate import metrics  # noqa: E402
+
+task_prerun.connect(metrics.task_started)
+task_postrun.connect(metrics.task_finished)
+worker_init.connect(metrics.start_worker_metrics_server)
+
+from paygate.routing import check_lane_workers  # noqa: E402
+
+worker_init.connect(check_lane_workers)
+
+
+@worker_init.connect
+def freeze_before_fork(**kwargs):
+    """
+    Move everything loaded so far out of the collector's reach before the
+    prefork pool forks, so children do not copy the parent's pages just by
+    running a GC pass over them.
+    """
+    gc.freeze()
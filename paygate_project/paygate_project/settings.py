@@ -14,7 +14,9 @@ from pathlib import Path
 import os
 import environ
 from datetime import timedelta
+from decimal import Decimal
 from dotenv import load_dotenv
+from paygate.routing import webhook_lane_queues
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,7 +56,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'paygate.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -69,13 +71,28 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Refresh token blacklist: in-process Bloom filter sizing and how often each
+# process picks up tokens blacklisted elsewhere (seconds)
+JWT_BLACKLIST_BLOOM_CAPACITY = int(os.getenv('JWT_BLACKLIST_BLOOM_CAPACITY', 1_000_000))
+JWT_BLACKLIST_BLOOM_ERROR_RATE = float(os.getenv('JWT_BLACKLIST_BLOOM_ERROR_RATE', 0.001))
+JWT_BLACKLIST_SYNC_INTERVAL = float(os.getenv('JWT_BLACKLIST_SYNC_INTERVAL', 1.0))
+
+# Verified access tokens kept per process, and how long (seconds) one is
+# trusted before its signature and revocation status are checked again
+JWT_ACCESS_CACHE_SIZE = int(os.getenv('JWT_ACCESS_CACHE_SIZE', 10000))
+JWT_ACCESS_CACHE_TTL = int(os.getenv('JWT_ACCESS_CACHE_TTL', 60))
+
 MIDDLEWARE = [
+    'paygate.middleware.CorrelationIdMiddleware',
+    'paygate.middleware.RequestMetricsMiddleware',
+    'paygate.middleware.QueryInstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'paygate.middleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -106,16 +123,172 @@ WSGI_APPLICATION = 'paygate_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# PostgreSQL through psycopg 3 with Django's connection pool. Each process
+# holds DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections and a request waits up
+# to DB_POOL_TIMEOUT seconds for a free one. Connections are checked before
+# being handed out (CONN_HEALTH_CHECKS) and replaced after
+# DB_POOL_MAX_LIFETIME seconds. Keep DB_POOL_MAX_SIZE x processes (gunicorn
+# workers, Celery pool processes) below PostgreSQL's max_connections.
+# DB_POOL_ENABLED=False opens a connection per request instead.
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', 'True') == 'True'
+
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv("DB_NAME"),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Pooled connections are checked before being handed out
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
+if DB_POOL_ENABLED:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    }
+
+# Read replica for stats and list endpoints (views using ReplicaReadMixin),
+# enabled by DB_REPLICA_HOST. A user's reads stay on the primary for
+# DATABASE_REPLICA_STICKY_SECONDS after they write (tracked in the cache, so
+# shared across processes only with REDIS_URL), and everyone's do while the
+# replica is more than DATABASE_REPLICA_MAX_LAG seconds behind. Keep the
+# sticky window above the max lag so users always read their own writes.
+DATABASE_READ_REPLICA = None
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASE_READ_REPLICA = 'replica'
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['paygate.db_router.ReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', 10))
+DATABASE_REPLICA_MAX_LAG = float(os.getenv('DATABASE_REPLICA_MAX_LAG', 5))
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DATABASE_REPLICA_LAG_CHECK_INTERVAL', 1))
+
+
+# Cache
+# Shared by every web and worker process when REDIS_URL is set (needed for
+# cross-process webhook deduplication); falls back to a per-process cache.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Per-request DB instrumentation: requests above either threshold are logged
+# with query stacks when sampled at REQUEST_TRACE_SAMPLE_RATE
+REQUEST_QUERY_COUNT_THRESHOLD = int(os.getenv('REQUEST_QUERY_COUNT_THRESHOLD', 30))
+REQUEST_DURATION_THRESHOLD_MS = float(os.getenv('REQUEST_DURATION_THRESHOLD_MS', 500))
+REQUEST_TRACE_SAMPLE_RATE = float(os.getenv('REQUEST_TRACE_SAMPLE_RATE', 0.1))
+
+# Prometheus exposition at /metrics (multiprocess when PROMETHEUS_MULTIPROC_DIR
+# is set). When METRICS_AUTH_TOKEN is set scrapes must send it as a bearer
+# token. Celery workers serve their own metrics on CELERY_METRICS_PORT.
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN', '')
+CELERY_METRICS_PORT = int(os.getenv('CELERY_METRICS_PORT', 0))
+
+# JSON lines on stdout. Records are formatted in the calling thread and
+# written by a background listener (paygate.log.NonBlockingHandler), so
+# request threads never block on stdout. Every record carries the request_id
+# (X-Request-ID, also propagated to Celery tasks) and payment_id it was
+# logged under. LOG_SAMPLE_RATES keeps only that share of the INFO/DEBUG
+# records of high-frequency loggers (and their children); warnings and
+# errors are always kept.
+LOG_SAMPLE_RATES = {
+    'paygate.request': float(os.getenv('LOG_SAMPLE_RATE_REQUESTS', 1.0)),
+    'paygate.payments': float(os.getenv('LOG_SAMPLE_RATE_PAYMENTS', 1.0)),
+    'paygate.webhooks': float(os.getenv('LOG_SAMPLE_RATE_WEBHOOKS', 0.1)),
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'paygate.log.JSONFormatter',
+        },
+    },
+    'filters': {
+        'correlation': {
+            '()': 'paygate.log.CorrelationFilter',
+        },
+        'sampling': {
+            '()': 'paygate.log.SamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
+    },
+    'handlers': {
+        'console': {
+            '()': 'paygate.log.NonBlockingHandler',
+            'stream': 'ext://sys.stdout',
+            'capacity': int(os.getenv('LOG_QUEUE_CAPACITY', 10000)),
+            'formatter': 'json',
+            'filters': ['correlation', 'sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'paygate': {
+            'handlers': ['console'],
+            'level': os.getenv('PAYGATE_LOG_LEVEL', 'INFO'),
+            # Celery also attaches its own handler to the root logger
+            'propagate': False,
+        },
+    },
+}
+
+# Rate limits per identity: a token bucket (burst, refilled at rate per second)
+# and a sliding window (limit requests per window seconds). Shared by every
+# process through Redis when RATELIMIT_REDIS_URL is set, per process otherwise.
+RATELIMIT_ENABLE = os.getenv('RATELIMIT_ENABLE', 'True') == 'True'
+RATELIMIT_REDIS_URL = os.getenv('RATELIMIT_REDIS_URL', REDIS_URL)
+# Seconds to connect to or wait on Redis before falling back to per-process limits
+RATELIMIT_REDIS_TIMEOUT = float(os.getenv('RATELIMIT_REDIS_TIMEOUT', 0.1))
+RATE_LIMITS = {
+    'merchant': {'burst': 100, 'rate': 500 / 60, 'limit': 500, 'window': 60},
+    'api_key': {'burst': 50, 'rate': 250 / 60, 'limit': 250, 'window': 60},
+    'ip': {'burst': 50, 'rate': 500 / 60, 'limit': 500, 'window': 60},
+}
+
+# Password hashing. PASSWORD_HASHER=argon2 makes Argon2 the default (needs
+# argon2-cffi); existing PBKDF2 hashes keep working and are upgraded on login.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if os.getenv('PASSWORD_HASHER', 'pbkdf2') == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+
+# Concurrent password hashes per process, and how long (seconds) a login or
+# registration waits for a slot before it is turned away
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', 2))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0))
 
 
 # Password validation
@@ -210,4 +383,74 @@ CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:63
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'UTC'
\ No newline at end of file
+CELERY_TIMEZONE = 'UTC'
+
+# Celery queues. Each queue is served by its own worker so a backlog on one
+# cannot delay the others (see docker-compose.yml):
+#   webhooks.lane.N  first delivery attempts, partitioned by payment onto
+#                    WEBHOOK_DELIVERY_LANES lanes. Each lane has one solo-pool
+#                    worker with prefetch 1 and lanes deliver in parallel.
+#                    Scale lanes with the number of lane workers.
+#   webhook_retries  retried deliveries (countdown/ETA). Threads pool, lower
+#                    concurrency, prefetch 4 since ETA messages sit reserved.
+#                    Retries leave their lane, so a retried event can arrive
+#                    after later events for its payment: delivery is not
+#                    ordered, and payloads carry a `sequence` receivers use
+#                    to drop stale events.
+#   batch            archival, analytics, settlement. Prefork pool with low
+#                    concurrency and prefetch 1: long CPU/DB-heavy tasks.
+# Tasks on these queues set acks_late so a worker crash redelivers the message.
+WEBHOOK_DELIVERY_LANES = int(os.getenv('WEBHOOK_DELIVERY_LANES', 4))
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# Explicit routing keys: queues left on the default key would all be bound to
+# the same key and receive each other's messages.
+# Declared as options rather than kombu Queue objects so the settings load
+# without importing kombu.
+CELERY_TASK_QUEUES = {
+    name: {'routing_key': name}
+    for name in (
+        'default',
+        *webhook_lane_queues(WEBHOOK_DELIVERY_LANES),
+        'webhook_retries',
+        'batch',
+    )
+}
+CELERY_TASK_ROUTES = (
+    'paygate.routing.route_task',
+    {
+        'paygate.tasks.archive_webhook_logs_task': {'queue': 'batch'},
+        'paygate.tasks.replay_webhooks_task': {'queue': 'batch'},
+        'paygate.tasks.flush_expired_tokens_task': {'queue': 'batch'},
+        'paygate.tasks.settle_merchants_task': {'queue': 'batch'},
+        'paygate.tasks.settle_merchant_chunk_task': {'queue': 'batch'},
+    },
+)
+CELERY_WEBHOOK_RETRY_QUEUE = 'webhook_retries'
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# The beat schedule (crontab entries) is defined in paygate_project/celery.py
+
+# Webhook event deduplication window (seconds)
+WEBHOOK_DEDUP_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', 24 * 60 * 60))
+
+# Merchant webhook replay: logs per batch and deliveries enqueued per second
+WEBHOOK_REPLAY_BATCH_SIZE = int(os.getenv('WEBHOOK_REPLAY_BATCH_SIZE', 100))
+WEBHOOK_REPLAY_RATE = float(os.getenv('WEBHOOK_REPLAY_RATE', 20))
+WEBHOOK_REPLAY_MAX_DAYS = int(os.getenv('WEBHOOK_REPLAY_MAX_DAYS', 30))
+
+# Rows each merchant's balance is spread over; more slots, fewer lock waits between concurrent captures
+MERCHANT_BALANCE_SLOTS = int(os.getenv('MERCHANT_BALANCE_SLOTS', 8))
+
+# Daily settlement: merchants paid out per task
+SETTLEMENT_CHUNK_SIZE = int(os.getenv('SETTLEMENT_CHUNK_SIZE', 500))
+
+# Commission charged when no pricing plan applies, and how often each process
+# checks the cache for pricing plan changes
+PRICING_DEFAULT_PERCENTAGE = Decimal(os.getenv('PRICING_DEFAULT_PERCENTAGE', '2.00'))
+PRICING_DEFAULT_FIXED_FEE = Decimal(os.getenv('PRICING_DEFAULT_FIXED_FEE', '0.00'))
+PRICING_SYNC_INTERVAL = float(os.getenv('PRICING_SYNC_INTERVAL', 1.0))
+
+# WebhookLog archival
+WEBHOOK_LOG_RETENTION_DAYS = int(os.getenv('WEBHOOK_LOG_RETENTION_DAYS', 30))
+WEBHOOK_LOG_ARCHIVE_DIR = os.getenv('WEBHOOK_LOG_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archives', 'webhook_logs'))
+WEBHOOK_LOG_ARCHIVE_BATCH_SIZE = int(os.getenv('WEBHOOK_LOG_ARCHIVE_BATCH_SIZE', 500))
@@ -16,6 +16,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': ':memory:',
+    },
+    # Separate database standing in for the read replica in tests/test_db_router.py,
+    # which turns on DATABASE_READ_REPLICA; other tests read the primary
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+DATABASE_READ_REPLICA = None
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -57,4 +70,8 @@ LOGGING = {
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 
 # Set test secret key
-SECRET_KEY = 'test-secret-key-only-for-testing'
\ No newline at end of file
+SECRET_KEY = 'test-secret-key-only-for-testing'
+# Run Celery tasks inline during tests
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
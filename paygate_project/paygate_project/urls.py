@@ -15,8 +15,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path , include
+from paygate.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('paygate/',include('paygate.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -85,6 +85,7 @@ class WebhookLogFactory(DjangoModelFactory):
         model = WebhookLog
     
     payment = factory.SubFactory(PaymentFactory)
+    merchant = factory.LazyAttribute(lambda obj: obj.payment.order.merchant)
     payload = factory.LazyAttribute(lambda obj: {
         'event': f'payment.{obj.payment.status}',
         'payment_id': str(obj.payment.payment_id),
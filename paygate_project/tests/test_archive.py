@@ -0,0 +1,82 @@
+"""
+Tests for WebhookLog archival and archive search.
+"""
+import gzip
+import json
+import pytest
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+
+from paygate.archive import WebhookLogArchiver
+from paygate.models import WebhookLog
+from .factories import PaymentFactory, WebhookLogFactory
+
+
+@pytest.mark.django_db
+class TestWebhookLogArchiver:
+    """Test archiving and pruning of old webhook logs."""
+
+    def setup_method(self):
+        """Set up logs on either side of a 30 day retention window."""
+        self.now = timezone.now()
+        self.payment = PaymentFactory(status='captured')
+        self.old_logs = []
+        for days_ago in (40, 40, 35):
+            log = WebhookLogFactory(payment=self.payment)
+            WebhookLog.objects.filter(pk=log.pk).update(created_at=self.now - timedelta(days=days_ago))
+            self.old_logs.append(log)
+        self.recent_log = WebhookLogFactory(payment=self.payment)
+
+    def test_archive_moves_old_logs_to_daily_files(self, tmp_path):
+        """Test old logs are written to one gzip file per day and deleted."""
+        result = WebhookLogArchiver.archive(retention_days=30, batch_size=2, archive_dir=tmp_path)
+
+        assert result['archived'] == 3
+        assert len(result['days']) == 2
+        assert list(WebhookLog.objects.values_list('pk', flat=True)) == [self.recent_log.pk]
+
+        day = timezone.localtime(self.now - timedelta(days=40)).date()
+        with gzip.open(WebhookLogArchiver.archive_path(day, tmp_path), 'rt') as fh:
+            records = [json.loads(line) for line in fh]
+        assert [r['id'] for r in records] == [self.old_logs[0].pk, self.old_logs[1].pk]
+        assert records[0]['payment_id'] == str(self.payment.payment_id)
+        assert records[0]['payload']['event'] == 'payment.captured'
+
+    def test_archive_is_noop_without_old_logs(self, tmp_path):
+        """Test nothing is written when every log is inside the retention window."""
+        result = WebhookLogArchiver.archive(retention_days=60, archive_dir=tmp_path)
+
+        assert result == {'archived': 0, 'days': []}
+        assert WebhookLog.objects.count() == 4
+
+    def test_search_filters_archived_days(self, tmp_path):
+        """Test archived logs can still be found by payment and status."""
+        other = WebhookLogFactory(status='failed')
+        WebhookLog.objects.filter(pk=other.pk).update(created_at=self.now - timedelta(days=35))
+        WebhookLogArchiver.archive(retention_days=30, archive_dir=tmp_path)
+
+        start = timezone.localtime(self.now - timedelta(days=45)).date()
+        end = timezone.localtime(self.now).date()
+        by_payment = list(WebhookLogArchiver.search(
+            start, end, payment_id=str(self.payment.payment_id), archive_dir=tmp_path
+        ))
+        failed = list(WebhookLogArchiver.search(start, end, status='failed', archive_dir=tmp_path))
+
+        assert sorted(r['id'] for r in by_payment) == sorted(log.pk for log in self.old_logs)
+        assert [r['id'] for r in failed] == [other.pk]
+
+    def test_search_command_prints_matches(self, tmp_path):
+        """Test the management command streams matching records as JSON lines."""
+        WebhookLogArchiver.archive(retention_days=30, archive_dir=tmp_path)
+        day = timezone.localtime(self.now - timedelta(days=35)).date()
+        out = StringIO()
+
+        call_command(
+            'search_webhook_archive', '--from', day.isoformat(),
+            '--archive-dir', str(tmp_path), stdout=out, stderr=StringIO()
+        )
+
+        lines = out.getvalue().splitlines()
+        assert [json.loads(line)['id'] for line in lines] == [self.old_logs[2].pk]
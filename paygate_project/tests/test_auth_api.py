@@ -9,9 +9,20 @@ from django.test import Client
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.core.cache import cache
+from django.test import override_settings
+from unittest.mock import patch
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from paygate.authentication import VerifiedTokenCache, verified_tokens
 from paygate.models import Merchant
+from paygate.serializers import CustomTokenObtainPairSerializer
+from paygate.utils.hashing import PasswordHashingBusy
+from paygate.utils.helpers import get_merchant_from_user
+from paygate.utils.token_blacklist import BloomFilter, TokenBlacklist, CachedBlacklistRefreshToken
 from .factories import UserFactory, AdminUserFactory, MerchantFactory
 
 User = get_user_model()
@@ -244,6 +255,54 @@ class TestLoginAPI:
         assert cookie['httponly'] is True
         assert cookie['samesite'] == 'None'
 
+    def test_login_shed_when_hashing_busy(self):
+        """Test login is answered 503 when no hashing slot is free."""
+        data = {
+            'email': 'merchant@example.com',
+            'password': 'testpass123'
+        }
+
+        with patch('paygate.models.password_hashing.run', side_effect=PasswordHashingBusy):
+            response = self.client.post(self.url, data, format='json')
+
+        assert response.status_code == 503
+        assert response['Retry-After'] == '1'
+        assert parse_response(response)['exception']['code'] == 1060
+
+    def test_login_mints_one_token_with_claims(self):
+        """Test login mints a single pair carrying role and merchant claims."""
+        data = {
+            'email': 'merchant@example.com',
+            'password': 'testpass123'
+        }
+
+        with patch.object(
+            CustomTokenObtainPairSerializer, 'get_token', wraps=CustomTokenObtainPairSerializer.get_token
+        ) as mock_get_token:
+            response = self.client.post(self.url, data, format='json')
+
+        assert mock_get_token.call_count == 1
+        access = AccessToken(parse_response(response)['data']['access'])
+        assert access['role'] == 'merchant'
+        assert access['merchant_id'] == self.merchant.pk
+
+    def test_merchant_from_claims_skips_db(self, django_assert_num_queries):
+        """Test a token's merchant claim is trusted without a query."""
+        access = CustomTokenObtainPairSerializer.get_token(self.merchant_user).access_token
+
+        with django_assert_num_queries(0):
+            merchant = get_merchant_from_user(self.merchant_user, access)
+
+        assert merchant.pk == self.merchant.pk
+        assert merchant.api_key == self.merchant.api_key
+
+    def test_admin_claims_have_no_merchant(self):
+        """Test admin tokens carry no merchant."""
+        access = CustomTokenObtainPairSerializer.get_token(self.admin_user).access_token
+
+        assert access['role'] == 'admin'
+        assert get_merchant_from_user(self.admin_user, access) is None
+
 
 @pytest.mark.django_db
 class TestTokenRefreshAPI:
@@ -334,6 +393,157 @@ class TestLogoutAPI:
         assert response_data['success'] is False
         assert response_data['exception']['code'] == 1040
 
+    def test_refresh_after_logout_rejected(self):
+        """Test a logged out refresh token can no longer be refreshed."""
+        self.client.force_authenticate(user=self.user)
+        self.client.cookies['refresh_token'] = str(self.refresh_token)
+        self.client.post(self.url)
+
+        self.client.cookies['refresh_token'] = str(self.refresh_token)
+        response = self.client.post('/paygate/api/v1/auth/refresh/')
+
+        response_data = parse_response(response)
+        assert response_data['success'] is False
+        assert response_data['exception']['code'] == 1031
+
+
+@pytest.mark.django_db
+class TestCachedJWTAuthentication:
+    """Test the verified access token cache."""
+
+    def setup_method(self):
+        """Set up a merchant holding a login token pair."""
+        verified_tokens.clear()
+        self.client = APIClient()
+        self.user = UserFactory()
+        MerchantFactory(user=self.user)
+        self.refresh = CustomTokenObtainPairSerializer.get_token(self.user)
+        self.access = str(self.refresh.access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def test_repeated_token_verified_once(self):
+        """Test a token is only verified on its first request."""
+        with patch.object(
+            JWTAuthentication, 'get_validated_token', autospec=True,
+            side_effect=JWTAuthentication.get_validated_token
+        ) as mock_verify:
+            for _ in range(3):
+                response = self.client.get('/paygate/api/v1/payment-process/')
+                assert response.status_code == 200
+
+        assert mock_verify.call_count == 1
+        assert len(verified_tokens) == 1
+
+    def test_cache_is_bounded_lru(self):
+        """Test the least recently used token is evicted first."""
+        tokens = VerifiedTokenCache(2)
+        access = [AccessToken(str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)) for _ in range(3)]
+        tokens.set(access[0].token, access[0], 60)
+        tokens.set(access[1].token, access[1], 60)
+        tokens.get(access[0].token)
+        tokens.set(access[2].token, access[2], 60)
+
+        assert tokens.get(access[1].token) is None
+        assert tokens.get(access[0].token) is access[0]
+        assert tokens.get(access[2].token) is access[2]
+
+    def test_entry_dropped_after_ttl(self):
+        """Test cached tokens are re-verified once their TTL has passed."""
+        tokens = VerifiedTokenCache(10)
+        access = AccessToken(self.access)
+        tokens.set(access.token, access, 0)
+
+        assert tokens.get(access.token) is None
+
+    def test_logout_revokes_access_token(self):
+        """Test the access token stops working after logout."""
+        self.client.get('/paygate/api/v1/payment-process/')
+        self.client.cookies['refresh_token'] = str(self.refresh)
+
+        logout_response = self.client.post('/paygate/api/v1/auth/logout/')
+        response = self.client.get('/paygate/api/v1/payment-process/')
+
+        assert parse_response(logout_response)['success'] is True
+        assert response.status_code == 401
+
+
+@pytest.mark.django_db
+class TestTokenBlacklist:
+    """Test the cached refresh token blacklist."""
+
+    def setup_method(self):
+        """Start each test with a freshly built filter."""
+        TokenBlacklist.reset()
+        TokenBlacklist.warm()
+        self.token = CachedBlacklistRefreshToken.for_user(UserFactory())
+        self.jti = self.token['jti']
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Test every added item is reported present."""
+        bloom = BloomFilter(1000, 0.01)
+        items = [f'jti-{i}' for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+
+        assert all(item in bloom for item in items)
+        assert sum(f'other-{i}' in bloom for i in range(1000)) < 50
+
+    def test_blacklisted_token_rejected(self):
+        """Test a blacklisted token is reported from the cache."""
+        assert TokenBlacklist.is_blacklisted(self.jti) is False
+        self.token.blacklist()
+
+        assert TokenBlacklist.is_blacklisted(self.jti) is True
+        assert cache.get(TokenBlacklist.cache_key(self.jti)) is True
+
+    @override_settings(JWT_BLACKLIST_SYNC_INTERVAL=0)
+    def test_filter_picks_up_tokens_blacklisted_elsewhere(self):
+        """Test a process syncs tokens blacklisted by another process."""
+        TokenBlacklist.is_blacklisted(self.jti)
+        stale_bits, stale_seq = bytearray(TokenBlacklist._bloom.bits), TokenBlacklist._seq
+        self.token.blacklist()
+        # Roll the filter back as if the token had been blacklisted in another process
+        TokenBlacklist._bloom.bits, TokenBlacklist._seq = stale_bits, stale_seq
+        assert self.jti not in TokenBlacklist._bloom
+
+        assert TokenBlacklist.is_blacklisted(self.jti) is True
+        assert self.jti in TokenBlacklist._bloom
+
+    def test_db_fallback_when_cache_evicted(self):
+        """Test the durable record is consulted when the cache lost the key."""
+        self.token.blacklist()
+        cache.delete(TokenBlacklist.cache_key(self.jti))
+        TokenBlacklist.reset()
+        TokenBlacklist.warm()
+
+        assert TokenBlacklist.is_blacklisted(self.jti) is True
+
+    def test_no_filter_answers_from_db_and_rebuilds_in_background(self):
+        """Test a process without a filter does not build it on the request thread."""
+        self.token.blacklist()
+        cache.delete(TokenBlacklist.cache_key(self.jti))
+        TokenBlacklist.reset()
+
+        with patch('paygate.utils.token_blacklist.threading.Thread') as thread:
+            assert TokenBlacklist.is_blacklisted(self.jti) is True
+            assert TokenBlacklist.is_blacklisted('never-blacklisted') is False
+
+        thread.return_value.start.assert_called_once_with()
+        assert TokenBlacklist._bloom is None
+
+    def test_stale_negative_answer_does_not_overwrite_blacklisting(self):
+        """Test a token blacklisted while its DB lookup runs stays blacklisted in the cache."""
+        def blacklisted_during_lookup(*args, **kwargs):
+            # The lookup reads "not blacklisted" as another request blacklists the token
+            TokenBlacklist.add(self.jti, self.token['exp'])
+            return BlacklistedToken.objects.none()
+
+        with patch.object(TokenBlacklist, '_sync', return_value=None), \
+                patch('paygate.utils.token_blacklist.BlacklistedToken.objects.filter', side_effect=blacklisted_during_lookup):
+            assert TokenBlacklist.is_blacklisted(self.jti) is False
+
+        assert cache.get(TokenBlacklist.cache_key(self.jti)) is True
+
 
 @pytest.mark.django_db
 class TestAuthenticationFlow:
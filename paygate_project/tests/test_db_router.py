@@ -0,0 +1,102 @@
+"""
+Tests for read-replica routing, with a second SQLite database as the replica.
+"""
+import pytest
+from unittest.mock import patch
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from paygate.db_router import ReplicaRouter, replica_lag, replica_reads, reset_replica_lag
+from paygate.models import Merchant, Order, Payment, User
+from .factories import UserFactory, MerchantFactory, OrderFactory, PaymentFactory
+
+COMPLETED_URL = '/paygate/api/v1/payment-complete/'
+
+
+def replicate():
+    """Copy the primary's rows to the replica, as replication would."""
+    for model in (User, Merchant, Order, Payment):
+        model.objects.using('replica').all().delete()
+        model.objects.using('replica').bulk_create(list(model.objects.using('default').all()))
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+class TestReplicaRouting:
+    """Test which database the replica-read views are served from."""
+
+    @pytest.fixture(autouse=True)
+    def replica_enabled(self, settings):
+        settings.DATABASE_READ_REPLICA = 'replica'
+        cache.clear()
+        reset_replica_lag()
+        yield
+        reset_replica_lag()
+
+    def setup_method(self):
+        """Set up a merchant whose replica is one captured payment behind."""
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.merchant = MerchantFactory(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+        replicate()
+        PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+
+    def completed_payments(self):
+        response = self.client.get(COMPLETED_URL)
+        assert response.json()['success'] is True
+        return response.json()['data']
+
+    def test_reads_served_from_replica(self):
+        """Test list and stats views read the replica's rows."""
+        stats = self.client.get('/paygate/api/v1/merchants/stats/').json()['data']
+
+        assert len(self.completed_payments()) == 1
+        assert stats['total_orders'] == 1
+
+    def test_recent_write_sticks_to_primary(self):
+        """Test a user who just wrote reads the primary, and others keep the replica."""
+        other = APIClient()
+        other.force_authenticate(user=MerchantFactory().user)
+        replicate()
+        PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+
+        created = self.client.post('/paygate/api/v1/orders/', {'amount': '10.00', 'currency': 'INR'}, format='json')
+
+        assert created.json()['success'] is True
+        assert len(self.completed_payments()) == 3
+        assert other.get(COMPLETED_URL).json()['data'] == []
+
+    def test_reads_without_writes_do_not_stick(self):
+        """Test read-only requests leave the user on the replica."""
+        self.completed_payments()
+
+        assert len(self.completed_payments()) == 1
+
+    def test_lagging_replica_falls_back_to_primary(self, settings):
+        """Test reads go to the primary while the replica lags beyond the threshold."""
+        settings.DATABASE_REPLICA_MAX_LAG = 5
+        with patch('paygate.db_router.measure_replica_lag', return_value=60.0) as measure:
+            first = self.completed_payments()
+            second = self.completed_payments()
+
+        assert len(first) == len(second) == 2
+        measure.assert_called_once_with('replica')
+
+    def test_lag_rechecked_after_interval(self, settings):
+        """Test the lag measurement is cached for the check interval only."""
+        settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL = 0
+        with patch('paygate.db_router.measure_replica_lag', side_effect=[60.0, 0.0]):
+            assert replica_lag('replica') == 60.0
+            assert replica_lag('replica') == 0.0
+
+    def test_writes_go_to_primary_inside_replica_reads(self):
+        """Test the router never sends a write to the replica."""
+        router = ReplicaRouter()
+        with replica_reads('replica'):
+            order = Order.objects.create(order_id='replica-write', merchant=self.merchant, amount='5.00')
+            assert router.db_for_read(Order) == 'replica'
+
+        assert router.db_for_read(Order) is None
+        assert Order.objects.using('default').filter(pk=order.pk).exists()
+        assert not Order.objects.using('replica').filter(pk=order.pk).exists()
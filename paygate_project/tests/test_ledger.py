@@ -0,0 +1,179 @@
+"""
+Tests for the double-entry ledger and the stats read from it.
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+from django.db import transaction
+from rest_framework.test import APIClient
+
+from paygate.ledger import Ledger
+from paygate.models import LedgerEntry, MerchantBalance, Payment
+from .factories import AdminUserFactory, MerchantFactory, OrderFactory, PaymentFactory
+
+
+def balances(merchant):
+    return {'merchant': Ledger.balance(merchant), **Ledger.platform_balances()}
+
+
+@pytest.mark.django_db
+class TestLedger:
+    """Test ledger postings for payment status changes."""
+
+    def setup_method(self):
+        """Set up a merchant with an authorized payment of 100.00 at 2% commission."""
+        self.merchant = MerchantFactory()
+        self.payment = PaymentFactory(
+            order=OrderFactory(merchant=self.merchant, amount=Decimal('100.00')), status='authorized',
+        )
+
+    def test_capture_posts_balanced_entries(self):
+        """Test a capture credits the merchant net of commission and the platform with the commission."""
+        self.payment.status = 'captured'
+        self.payment.save()
+
+        entries = LedgerEntry.objects.filter(payment=self.payment)
+        assert sorted((e.entry_type, e.account.kind, e.amount) for e in entries) == [
+            ('capture', 'clearing', Decimal('-100.00')),
+            ('capture', 'merchant', Decimal('100.00')),
+            ('commission', 'commission', Decimal('2.00')),
+            ('commission', 'merchant', Decimal('-2.00')),
+        ]
+        assert len({e.posting_id for e in entries}) == 1
+        assert balances(self.merchant) == {
+            'merchant': Decimal('98.00'), 'commission': Decimal('2.00'), 'clearing': Decimal('-100.00'),
+        }
+        assert Ledger.balance(self.merchant) == Decimal('98.00')
+
+    def test_saving_again_posts_nothing(self):
+        """Test only the status change is posted, not every save of a captured payment."""
+        self.payment.status = 'captured'
+        self.payment.save()
+        self.payment.card_hash = 'updated'
+        self.payment.save()
+
+        assert LedgerEntry.objects.filter(payment=self.payment).count() == 4
+
+    def test_refund_keeps_capture_history(self):
+        """Test a refund is a new posting and the capture entries are kept."""
+        self.payment.status = 'captured'
+        self.payment.save()
+        self.payment.full_refund()
+
+        entry_types = LedgerEntry.objects.filter(payment=self.payment).values_list('entry_type', flat=True)
+        assert sorted(entry_types) == ['capture', 'capture', 'commission', 'commission', 'refund', 'refund']
+        # The commission is not returned on refund
+        assert Ledger.balance(self.merchant) == Decimal('-2.00')
+        assert Ledger.balance(self.merchant) == Payment.objects.get(pk=self.payment.pk).merchant_payout
+
+    def test_partial_refunds_posted_per_refund(self):
+        """Test each partial refund is its own posting and the balance follows the payment's payout."""
+        self.payment.status = 'captured'
+        self.payment.save()
+        self.payment.refund(Decimal('25.00'))
+        self.payment.refund(Decimal('15.00'))
+
+        refunds = LedgerEntry.objects.filter(payment=self.payment, entry_type='refund', account__kind='merchant')
+        assert sorted(refunds.values_list('amount', flat=True)) == [Decimal('-25.00'), Decimal('-15.00')]
+        assert Ledger.balance(self.merchant) == Decimal('58.00')
+        assert Ledger.balance(self.merchant) == Payment.objects.get(pk=self.payment.pk).merchant_payout
+
+    def test_failed_posting_rolls_back_status_change(self):
+        """Test the status change and its postings commit together."""
+        self.payment.status = 'captured'
+        with patch('paygate.ledger.Ledger.post', side_effect=RuntimeError('ledger down')):
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    self.payment.save()
+
+        assert Payment.objects.get(pk=self.payment.pk).status == 'authorized'
+
+    def test_unbalanced_posting_rejected(self):
+        """Test a posting whose legs do not sum to zero is refused."""
+        accounts = Ledger.accounts(self.merchant.pk)
+
+        with pytest.raises(ValueError):
+            Ledger.post([('payout', accounts['merchant'], Decimal('-5.00')), ('payout', accounts['clearing'], Decimal('4.00'))])
+        assert not LedgerEntry.objects.exists()
+
+    def test_entries_are_append_only(self):
+        """Test entries cannot be edited or deleted."""
+        entry = Ledger.record_payout(self.merchant, Decimal('10.00'))[0]
+        entry.amount = Decimal('0.00')
+
+        with pytest.raises(ValueError):
+            entry.save()
+        with pytest.raises(ValueError):
+            entry.delete()
+
+
+@pytest.mark.django_db
+class TestLedgerStats:
+    """Test the stats endpoints read revenue and commission from the ledger."""
+
+    def setup_method(self):
+        """Set up a merchant with a captured payment, a refunded payment and a payout."""
+        self.client = APIClient()
+        self.merchant = MerchantFactory()
+        PaymentFactory(order=OrderFactory(merchant=self.merchant, amount=Decimal('100.00')), status='captured')
+        refunded = PaymentFactory(order=OrderFactory(merchant=self.merchant, amount=Decimal('50.00')), status='captured')
+        refunded.full_refund()
+        Ledger.record_payout(self.merchant, Decimal('20.00'))
+
+    def test_merchant_stats(self):
+        """Test revenue excludes payouts and the balance includes them."""
+        self.client.force_authenticate(user=self.merchant.user)
+
+        data = self.client.get('/paygate/api/v1/merchants/stats/').json()['data']
+
+        assert Decimal(data['total_revenue']) == Decimal('97.00')
+        assert Decimal(data['balance']) == Decimal('77.00')
+        assert [(Decimal(day['revenue']), day['count']) for day in data['daily_revenue']] == [(Decimal('97.00'), 2)]
+
+    def test_admin_stats(self):
+        """Test platform commission and top merchants come from commission postings."""
+        self.client.force_authenticate(user=AdminUserFactory())
+
+        data = self.client.get('/paygate/api/v1/admin/stats/').json()['data']
+
+        assert Decimal(data['total_commission']) == Decimal('3.00')
+        assert data['top_merchants'][0]['email'] == self.merchant.user.email
+        assert Decimal(data['top_merchants'][0]['total_commission']) == Decimal('3.00')
+        assert data['top_merchants'][0]['order_count'] == 2
+
+
+@pytest.mark.django_db
+class TestMerchantBalance:
+    """Test merchant balances kept in counter slots."""
+
+    def setup_method(self):
+        """Set up a merchant."""
+        self.merchant = MerchantFactory()
+
+    def capture(self, amount):
+        return PaymentFactory(order=OrderFactory(merchant=self.merchant, amount=Decimal(amount)), status='captured')
+
+    def test_postings_spread_over_slots(self, settings):
+        """Test each posting increments one slot and reads sum them."""
+        settings.MERCHANT_BALANCE_SLOTS = 4
+        with patch('paygate.ledger.random.randrange', side_effect=[0, 3, 3]) as randrange:
+            for amount in ('100.00', '50.00', '10.00'):
+                self.capture(amount)
+
+        randrange.assert_called_with(4)
+        slots = dict(MerchantBalance.objects.filter(merchant=self.merchant).values_list('slot', 'available'))
+        # Every slot is created with the merchant's account
+        assert slots == {0: Decimal('98.00'), 1: Decimal('0.00'), 2: Decimal('0.00'), 3: Decimal('58.80')}
+        assert Ledger.balance(self.merchant) == Decimal('156.80')
+        assert Ledger.platform_balances() == {'commission': Decimal('3.20'), 'clearing': Decimal('-160.00')}
+
+    def test_balance_of_merchant_without_postings(self):
+        """Test a merchant with no slots has a zero balance."""
+        assert Ledger.balance(self.merchant) == Decimal('0.00')
+
+    def test_posting_without_merchant_rejected(self):
+        """Test a posting between platform accounts alone is refused."""
+        accounts = Ledger.accounts(self.merchant.pk)
+
+        with pytest.raises(ValueError):
+            Ledger.post([('payout', accounts['commission'], Decimal('-5.00')), ('payout', accounts['clearing'], Decimal('5.00'))])
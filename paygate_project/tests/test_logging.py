@@ -0,0 +1,129 @@
+"""
+Tests for the structured logging pipeline.
+"""
+import io
+import json
+import logging
+import pytest
+from rest_framework.test import APIClient
+
+from paygate import log
+from paygate.tasks import _propagate_request_id
+from .factories import UserFactory, MerchantFactory
+
+
+def make_record(name='paygate.webhooks', level=logging.INFO, **extra):
+    record = logging.LogRecord(name, level, __file__, 1, 'Webhook %s', ('enqueued',), None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestJSONFormatter:
+    """Test the JSON lines written for each record."""
+
+    def test_record_carries_correlation_ids_and_extras(self):
+        """Test bound IDs and `extra` fields end up in the JSON object."""
+        with log.bind(request_id='req-1', payment_id='pay-1'):
+            record = make_record(merchant_id=7)
+            log.CorrelationFilter().filter(record)
+
+        entry = json.loads(log.JSONFormatter().format(record))
+
+        assert entry['message'] == 'Webhook enqueued'
+        assert entry['level'] == 'INFO' and entry['logger'] == 'paygate.webhooks'
+        assert entry['request_id'] == 'req-1' and entry['payment_id'] == 'pay-1'
+        assert entry['merchant_id'] == 7
+        assert log.request_id.get() is None
+
+    def test_record_payment_id_overrides_bound_one(self):
+        """Test an explicit payment_id in `extra` wins over the bound one."""
+        with log.bind(payment_id='bound'):
+            record = make_record(payment_id='explicit')
+            log.CorrelationFilter().filter(record)
+
+        assert record.payment_id == 'explicit'
+
+
+class TestSamplingFilter:
+    """Test per-logger sampling of high-frequency records."""
+
+    def test_rates_apply_to_logger_and_children_below_warning(self):
+        """Test sampled loggers drop INFO records but never warnings."""
+        sampler = log.SamplingFilter({'paygate.webhooks': 0.0})
+
+        assert not sampler.filter(make_record('paygate.webhooks'))
+        assert not sampler.filter(make_record('paygate.webhooks.lane'))
+        assert sampler.filter(make_record('paygate.webhooks', logging.WARNING))
+        assert sampler.filter(make_record('paygate.payments'))
+
+    def test_request_keeps_or_drops_all_its_records(self):
+        """Test the decision is the same for every record of one request."""
+        sampler = log.SamplingFilter({'paygate': 0.5})
+
+        for request_id in (f'req-{n}' for n in range(20)):
+            decisions = {sampler.filter(make_record(request_id=request_id)) for _ in range(5)}
+            assert len(decisions) == 1
+
+
+class TestNonBlockingHandler:
+    """Test records are written by the listener thread and never block."""
+
+    def test_records_written_by_listener(self):
+        """Test queued records reach the stream as JSON lines."""
+        stream = io.StringIO()
+        handler = log.NonBlockingHandler(stream=stream)
+        handler.setFormatter(log.JSONFormatter())
+
+        handler.handle(make_record())
+        handler.flush_and_stop()
+
+        assert json.loads(stream.getvalue())['message'] == 'Webhook enqueued'
+
+    def test_full_queue_drops_records(self):
+        """Test a full queue drops and counts records instead of waiting."""
+        handler = log.NonBlockingHandler(stream=io.StringIO(), capacity=1)
+        handler.flush_and_stop()
+
+        for _ in range(3):
+            handler.handle(make_record())
+
+        assert handler.dropped == 2
+
+
+@pytest.mark.django_db
+class TestCorrelationIdMiddleware:
+    """Test request IDs on responses, request logs and published tasks."""
+
+    def setup_method(self):
+        """Set up an authenticated merchant."""
+        self.client = APIClient()
+        self.user = UserFactory()
+        MerchantFactory(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = '/paygate/api/v1/payment-complete/'
+
+    def test_request_id_returned_and_logged(self, caplog):
+        """Test the request log carries the ID returned in X-Request-ID."""
+        caplog.handler.addFilter(log.CorrelationFilter())
+        with caplog.at_level(logging.INFO, logger='paygate.request'):
+            response = self.client.get(self.url)
+
+        record, = [r for r in caplog.records if r.name == 'paygate.request']
+        assert len(response['X-Request-ID']) == 32
+        assert record.request_id == response['X-Request-ID']
+
+    def test_incoming_request_id_reused_when_valid(self):
+        """Test a caller's request ID is kept and a malformed one replaced."""
+        kept = self.client.get(self.url, HTTP_X_REQUEST_ID='lb-1234')
+        replaced = self.client.get(self.url, HTTP_X_REQUEST_ID='bad id\n')
+
+        assert kept['X-Request-ID'] == 'lb-1234'
+        assert replaced['X-Request-ID'] != 'bad id\n'
+
+    def test_request_id_published_with_tasks(self):
+        """Test tasks enqueued in a request carry its ID in their headers."""
+        headers = {}
+        with log.bind(request_id='req-9'):
+            _propagate_request_id(headers=headers)
+
+        assert headers == {'request_id': 'req-9'}
@@ -0,0 +1,133 @@
+"""
+Tests for the Prometheus metrics.
+"""
+import pytest
+from unittest.mock import Mock, patch
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from paygate.metrics import CeleryQueueDepthCollector, observe_db_pools
+from paygate.services import PaymentProcessor
+from .factories import UserFactory, MerchantFactory, OrderFactory, PaymentFactory
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    """Test the metrics recorded on the request, payment and task paths."""
+
+    def setup_method(self):
+        """Set up an authenticated merchant."""
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.merchant = MerchantFactory(user=self.user, webhook_url='https://merchant.example.com/hook')
+        self.client.force_authenticate(user=self.user)
+
+    def test_request_latency_labelled_by_route(self):
+        """Test request latency is observed per route pattern, not per path."""
+        name = 'paygate_http_request_duration_seconds_count'
+        labels = {'method': 'GET', 'route': 'paygate/api/v1/webhooks/replay/<str:job_id>/', 'status': '200'}
+        before = sample(name, **labels)
+
+        self.client.get('/paygate/api/v1/webhooks/replay/job-a/')
+        self.client.get('/paygate/api/v1/webhooks/replay/job-b/')
+
+        assert sample(name, **labels) == before + 2
+
+    def test_payment_outcomes_and_durations(self):
+        """Test PaymentProcessor operations count outcomes by status and are timed."""
+        order = OrderFactory(merchant=self.merchant)
+        captured = sample('paygate_payments_total', operation='authorize', status='captured')
+        timed = sample('paygate_payment_operation_duration_seconds_count', operation='refund')
+        declined = sample('paygate_payments_total', operation='refund', status='declined')
+
+        with patch('paygate.services.random.random', return_value=0.1):
+            payment, _ = PaymentProcessor.process_payment(order, {'card_number': '4111111111111111'})
+        PaymentProcessor.process_refund(PaymentFactory(status='authorized'))
+
+        assert payment.status == 'captured'
+        assert sample('paygate_payments_total', operation='authorize', status='captured') == captured + 1
+        assert sample('paygate_payment_operation_duration_seconds_count', operation='refund') == timed + 1
+        assert sample('paygate_payments_total', operation='refund', status='declined') == declined + 1
+
+    def test_webhook_delivery_and_task_runtime(self, django_capture_on_commit_callbacks):
+        """Test webhook attempts are timed by outcome and task runtimes by state."""
+        delivered = sample('paygate_webhook_delivery_duration_seconds_count', outcome='sent')
+        task = 'paygate.tasks.send_webhook_task'
+        succeeded = sample('paygate_celery_task_duration_seconds_count', task=task, state='SUCCESS')
+
+        # The webhook is enqueued when the payment's transaction commits
+        with patch('paygate.tasks.random.random', return_value=0.1), \
+                patch('paygate.services.random.random', return_value=0.1), \
+                django_capture_on_commit_callbacks(execute=True):
+            PaymentProcessor.process_payment(OrderFactory(merchant=self.merchant), {'card_number': '4111111111111111'})
+
+        assert sample('paygate_webhook_delivery_duration_seconds_count', outcome='sent') == delivered + 1
+        assert sample('paygate_celery_task_duration_seconds_count', task=task, state='SUCCESS') == succeeded + 1
+
+    def test_metrics_endpoint(self, settings):
+        """Test /metrics serves the exposition, with queue depths, behind the optional token."""
+        settings.METRICS_AUTH_TOKEN = 'scrape-secret'
+        client = APIClient()
+
+        with patch('paygate.metrics.queue_depths', return_value={'batch': 7}):
+            denied = client.get('/metrics')
+            response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+        assert denied.status_code == 401
+        assert response.status_code == 200
+        body = response.content.decode()
+        assert 'paygate_http_request_duration_seconds_bucket' in body
+        assert 'paygate_celery_queue_depth{queue="batch"} 7.0' in body
+
+
+class TestDbPoolMetrics:
+    """Test the connection pool statistics are exported."""
+
+    def test_pool_stats_copied_from_open_connections(self):
+        """Test gauges take the pool state and counters add the popped deltas."""
+        pool = Mock()
+        pool.pop_stats.return_value = {
+            'pool_size': 6, 'pool_available': 2, 'requests_waiting': 3,
+            'requests_queued': 4, 'requests_wait_ms': 1500, 'requests_errors': 1,
+        }
+        pooled = Mock(alias='pooled', pool=pool)
+        idle = Mock(alias='idle', connection=None)
+        unpooled = Mock(alias='direct', spec=['alias', 'connection'])
+        queued = sample('paygate_db_pool_queued_requests_total', alias='pooled')
+        waited = sample('paygate_db_pool_wait_seconds_total', alias='pooled')
+
+        with patch('paygate.metrics.connections.all', return_value=[pooled, unpooled, idle]):
+            observe_db_pools()
+
+        assert sample('paygate_db_pool_connections', alias='pooled') == 6
+        assert sample('paygate_db_pool_available_connections', alias='pooled') == 2
+        assert sample('paygate_db_pool_waiting_requests', alias='pooled') == 3
+        assert sample('paygate_db_pool_queued_requests_total', alias='pooled') == queued + 4
+        assert sample('paygate_db_pool_wait_seconds_total', alias='pooled') == waited + 1.5
+        assert sample('paygate_db_pool_timeouts_total', alias='pooled') >= 1
+        assert sample('paygate_db_pool_connections', alias='direct') == 0
+        assert not idle.pool.pop_stats.called
+
+
+class TestCeleryQueueDepthCollector:
+    """Test queue depth collection against the broker."""
+
+    def test_broker_error_yields_empty_family(self):
+        """Test an unreachable broker does not fail the scrape."""
+        with patch('paygate.metrics.queue_depths', side_effect=ConnectionError):
+            family, = CeleryQueueDepthCollector().collect()
+
+        assert family.name == 'paygate_celery_queue_depth'
+        assert family.samples == []
+
+    def test_reads_configured_queues(self):
+        """Test every configured queue is reported from the in-memory broker."""
+        family, = CeleryQueueDepthCollector().collect()
+
+        queues = {s.labels['queue']: s.value for s in family.samples}
+        assert {'default', 'batch', 'webhook_retries', 'webhooks.lane.0'} <= set(queues)
+        assert all(depth >= 0 for depth in queues.values())
@@ -0,0 +1,58 @@
+"""
+Tests for per-request query instrumentation.
+"""
+import logging
+import re
+import pytest
+from rest_framework.test import APIClient
+
+from .factories import UserFactory, MerchantFactory, OrderFactory, PaymentFactory
+
+
+@pytest.mark.django_db
+class TestQueryInstrumentationMiddleware:
+    """Test Server-Timing headers and slow request sampling."""
+
+    def setup_method(self):
+        """Set up a merchant with a few captured payments."""
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.merchant = MerchantFactory(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        for _ in range(3):
+            PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+        self.url = '/paygate/api/v1/payment-complete/'
+
+    def test_server_timing_reports_queries(self):
+        """Test the header carries the request's query count and DB time."""
+        response = self.client.get(self.url)
+
+        timing = response['Server-Timing']
+        match = re.search(r'db;dur=([\d.]+);desc="(\d+) queries", total;dur=([\d.]+)', timing)
+        assert match
+        assert int(match.group(2)) > 0
+        assert float(match.group(1)) <= float(match.group(3))
+
+    def test_slow_sampled_request_logs_query_stacks(self, settings, caplog):
+        """Test a sampled request over the query threshold is logged with stacks."""
+        settings.REQUEST_TRACE_SAMPLE_RATE = 1.0
+        settings.REQUEST_QUERY_COUNT_THRESHOLD = 0
+
+        with caplog.at_level(logging.INFO, logger='paygate.request'):
+            self.client.get(self.url)
+
+        info, warning = [r for r in caplog.records if r.name == 'paygate.request']
+        assert info.db_queries > 0 and info.path == self.url
+        traces = warning.query_traces
+        assert traces['slowest']
+        assert any('views.py' in frame for frame in traces['slowest'][0]['stack'])
+
+    def test_unsampled_request_logs_no_stacks(self, settings, caplog):
+        """Test requests outside the sample are only counted."""
+        settings.REQUEST_TRACE_SAMPLE_RATE = 0.0
+        settings.REQUEST_QUERY_COUNT_THRESHOLD = 0
+
+        with caplog.at_level(logging.INFO, logger='paygate.request'):
+            self.client.get(self.url)
+
+        assert [r.levelno for r in caplog.records if r.name == 'paygate.request'] == [logging.INFO]
@@ -7,9 +7,13 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
+import threading
+from django.test import override_settings
 from django.utils import timezone
 
+from paygate.ledger import Ledger
 from paygate.models import Merchant, Order, Payment, WebhookLog
+from paygate.utils.hashing import PasswordHashPool, PasswordHashingBusy
 from .factories import UserFactory, AdminUserFactory, MerchantFactory, OrderFactory, PaymentFactory, WebhookLogFactory
 
 User = get_user_model()
@@ -75,6 +79,56 @@ class TestUserModel:
         assert not User.objects.all_with_deleted().filter(id=user_id).exists()
 
 
+@pytest.mark.django_db
+class TestUserPasswordHashing:
+    """Test password hashing through the bounded pool."""
+
+    def test_check_password_upgrades_old_hash(self):
+        """Test a hash from a non-default hasher is replaced on successful login."""
+        user = UserFactory()
+        user.set_password('secret123')
+        user.save()
+        assert user.password.startswith('md5$')
+
+        with override_settings(PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.ScryptPasswordHasher',
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]):
+            assert user.check_password('secret123') is True
+            user.refresh_from_db()
+            assert user.password.startswith('scrypt$')
+            assert user.check_password('secret123') is True
+
+    def test_wrong_password_keeps_hash(self):
+        """Test a failed check neither passes nor rewrites the hash."""
+        user = UserFactory()
+        original = user.password
+
+        assert user.check_password('not-the-password') is False
+        user.refresh_from_db()
+        assert user.password == original
+
+    def test_pool_sheds_when_saturated(self):
+        """Test callers are turned away once every slot stays busy past the timeout."""
+        pool = PasswordHashPool(max_workers=1, queue_timeout=0.05)
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait(5)
+
+        holder = threading.Thread(target=pool.run, args=(hold,))
+        holder.start()
+        started.wait(5)
+        try:
+            with pytest.raises(PasswordHashingBusy):
+                pool.run(lambda: None)
+        finally:
+            release.set()
+            holder.join()
+        assert pool.run(lambda: 'ok') == 'ok'
+
+
 @pytest.mark.django_db
 class TestMerchantModel:
     """Test cases for Merchant model."""
@@ -233,6 +287,60 @@ class TestPaymentModel:
         with pytest.raises(ValueError, match="Only captured payments can be refunded"):
             payment.full_refund()
 
+    def test_partial_refunds(self):
+        """Test partial refunds add up and the payment is refunded once nothing is left."""
+        payment = PaymentFactory(order=OrderFactory(amount=Decimal('100.00')), status='captured')
+
+        payment.refund(Decimal('30.00'))
+        assert (payment.status, payment.refunded_amount, payment.merchant_payout) == (
+            'captured', Decimal('30.00'), Decimal('68.00'),
+        )
+
+        payment.refund()
+        assert (payment.status, payment.refunded_amount, payment.merchant_payout) == (
+            'refunded', Decimal('100.00'), Decimal('-2.00'),
+        )
+        assert sorted(payment.refunds.values_list('amount', flat=True)) == [Decimal('30.00'), Decimal('70.00')]
+
+    def test_save_after_partial_refund_keeps_payout(self):
+        """Test saving a partially refunded payment does not recompute its payout from the commission."""
+        payment = PaymentFactory(order=OrderFactory(amount=Decimal('100.00')), status='captured')
+        payment.refund(Decimal('30.00'))
+
+        payment.card_hash = 'updated'
+        payment.save()
+        Payment.objects.get(pk=payment.pk).save()
+
+        payment.refresh_from_db()
+        assert (payment.commission_amount, payment.merchant_payout) == (Decimal('2.00'), Decimal('68.00'))
+
+    def test_capture_with_update_fields_writes_pricing(self):
+        """Test save(update_fields=['status']) stores the commission the ledger posts."""
+        payment = PaymentFactory(order=OrderFactory(amount=Decimal('100.00')), status='authorized')
+        payment.status = 'captured'
+        payment.save(update_fields=['status'])
+
+        payment.refresh_from_db()
+        assert (payment.commission_percentage, payment.commission_amount, payment.merchant_payout) == (
+            Decimal('2.00'), Decimal('2.00'), Decimal('98.00'),
+        )
+        assert Ledger.balance(payment.order.merchant) == payment.merchant_payout
+
+    def test_refund_exceeding_remaining_amount_rejected(self):
+        """Test a refund read from a stale copy of the payment cannot take the total over the amount."""
+        payment = PaymentFactory(order=OrderFactory(amount=Decimal('100.00')), status='captured')
+        stale = Payment.objects.get(pk=payment.pk)
+        payment.refund(Decimal('60.00'))
+
+        with pytest.raises(ValueError, match="Refund exceeds the amount left to refund"):
+            stale.refund(Decimal('60.00'))
+        with pytest.raises(ValueError):
+            payment.refund(Decimal('0.00'))
+
+        payment.refresh_from_db()
+        assert payment.refunded_amount == Decimal('60.00')
+        assert payment.refunds.count() == 1
+
     def test_default_field_values(self):
         """Test default commission and refund fields."""
         payment = PaymentFactory()
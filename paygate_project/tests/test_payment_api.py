@@ -333,6 +333,33 @@ class TestRefundProcessAPI:
         assert response.status_code == 200
         assert parse_response(response)['exception']['code'] == 4004
 
+    @patch('paygate.services.random.random', return_value=0.0)
+    @patch('paygate.services.WebhookHandler.send_webhook')
+    def test_process_partial_refund(self, mock_webhook, mock_random):
+        """Test refunding part of a captured payment leaves it captured."""
+        payment = PaymentFactory(order=OrderFactory(merchant=self.merchant, amount=Decimal('100.00')), status='captured')
+
+        response = self.client.post(self.url, {'payment_id': str(payment.payment_id), 'amount': '40.00'}, format='json')
+
+        data = parse_response(response)['data']
+        assert (data['payment_status'], data['refunded_amount']) == ('captured', '40.00')
+        payment.refresh_from_db()
+        assert payment.refunded_amount == Decimal('40.00')
+
+    @patch('paygate.services.PaymentProcessor.process_refund')
+    def test_process_refund_invalid_amount(self, mock_refund):
+        """Test refund amounts that are not positive or exceed what is left are rejected."""
+        payment = PaymentFactory(
+            order=OrderFactory(merchant=self.merchant, amount=Decimal('100.00')), status='captured',
+            refunded_amount=Decimal('90.00'),
+        )
+
+        for amount in ('0', '-5', '10.01', 'ten'):
+            response = self.client.post(self.url, {'payment_id': str(payment.payment_id), 'amount': amount}, format='json')
+            assert parse_response(response)['exception']['code'] == 4003
+
+        mock_refund.assert_not_called()
+
     def test_process_refund_nonexistent_payment(self):
         """Test refund processing with nonexistent payment."""
         data = {
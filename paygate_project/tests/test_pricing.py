@@ -0,0 +1,114 @@
+"""
+Tests for merchant pricing plans and the in-process pricing cache.
+"""
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.utils import timezone
+
+from paygate.models import LedgerEntry, MerchantVolume, PricingPlan, PricingTier
+from paygate.pricing import PRICING_VERSION_KEY, PricingCache
+from .factories import MerchantFactory, OrderFactory, PaymentFactory
+
+
+def capture(merchant, amount):
+    """Capture a payment priced by the merchant's plan."""
+    return PaymentFactory(
+        order=OrderFactory(merchant=merchant, amount=Decimal(amount)), status='captured', commission_percentage=None,
+    )
+
+
+@pytest.mark.django_db
+class TestPricing:
+    """Test commission at capture follows the merchant's pricing plan."""
+
+    def setup_method(self):
+        """Set up a merchant and an empty pricing cache."""
+        PricingCache.reset()
+        self.merchant = MerchantFactory()
+
+    def teardown_method(self):
+        """Drop plans loaded from this test's rolled back rows."""
+        PricingCache.reset()
+
+    def test_default_terms_without_plans(self):
+        """Test merchants are charged PRICING_DEFAULT_PERCENTAGE when no plan exists."""
+        payment = capture(self.merchant, '100.00')
+
+        assert (payment.commission_percentage, payment.commission_fixed_fee) == (Decimal('2.00'), Decimal('0.00'))
+        assert payment.commission_amount == Decimal('2.00')
+        assert payment.merchant_payout == Decimal('98.00')
+
+    def test_merchant_plan_with_fixed_fee(self, django_capture_on_commit_callbacks):
+        """Test a merchant's own plan overrides the default plan and adds its fixed fee."""
+        with django_capture_on_commit_callbacks(execute=True):
+            PricingPlan.objects.create(percentage=Decimal('3.00'))
+            PricingPlan.objects.create(merchant=self.merchant, percentage=Decimal('1.50'), fixed_fee=Decimal('0.30'))
+
+        assert capture(self.merchant, '100.00').commission_amount == Decimal('1.80')
+        assert capture(MerchantFactory(), '100.00').commission_amount == Decimal('3.00')
+
+    def test_fixed_fee_capped_at_amount(self, django_capture_on_commit_callbacks):
+        """Test the commission never exceeds the captured amount."""
+        with django_capture_on_commit_callbacks(execute=True):
+            PricingPlan.objects.create(merchant=self.merchant, percentage=Decimal('2.00'), fixed_fee=Decimal('5.00'))
+
+        payment = capture(self.merchant, '1.00')
+
+        assert (payment.commission_amount, payment.merchant_payout) == (Decimal('1.00'), Decimal('0.00'))
+
+    def test_tier_from_last_month_volume(self, django_capture_on_commit_callbacks):
+        """Test the tier is chosen by the merchant's captures over the previous calendar month."""
+        month = timezone.localdate().replace(day=1)
+        last_month = timezone.make_aware(datetime.combine(month - timedelta(days=3), datetime.min.time()))
+        old = capture(self.merchant, '6000.00')
+        LedgerEntry.objects.filter(payment=old).update(created_at=last_month)
+        capture(self.merchant, '9000.00')  # This month, does not count yet
+        with django_capture_on_commit_callbacks(execute=True):
+            plan = PricingPlan.objects.create(merchant=self.merchant, percentage=Decimal('2.00'))
+            PricingTier.objects.create(plan=plan, min_volume=Decimal('5000.00'), percentage=Decimal('1.50'))
+            PricingTier.objects.create(plan=plan, min_volume=Decimal('10000.00'), percentage=Decimal('1.00'))
+        assert PricingCache.terms(self.merchant.pk) == (Decimal('2.00'), Decimal('0.00'))  # Not recorded yet
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert PricingCache.record_volumes() == 1
+
+        assert MerchantVolume.objects.get(merchant=self.merchant).volume == Decimal('6000.00')
+        assert PricingCache.terms(self.merchant.pk) == (Decimal('1.50'), Decimal('0.00'))
+        assert PricingCache.terms(MerchantFactory().pk) == (Decimal('2.00'), Decimal('0.00'))
+
+    def test_loading_plans_reads_recorded_volumes(self, django_capture_on_commit_callbacks, django_assert_num_queries):
+        """Test loading the plans reads last month's recorded volumes rather than summing the ledger."""
+        month = timezone.localdate().replace(day=1)
+        MerchantVolume.objects.create(
+            merchant=self.merchant, month=(month - timedelta(days=1)).replace(day=1), volume=Decimal('20000.00'),
+        )
+        with django_capture_on_commit_callbacks(execute=True):
+            plan = PricingPlan.objects.create(percentage=Decimal('2.00'))
+            PricingTier.objects.create(plan=plan, min_volume=Decimal('10000.00'), percentage=Decimal('1.00'))
+
+        # Plans, their tiers and the volumes
+        with django_assert_num_queries(3) as queries:
+            assert PricingCache.terms(self.merchant.pk) == (Decimal('1.00'), Decimal('0.00'))
+        assert all('ledgerentry' not in query['sql'] for query in queries.captured_queries)
+
+    def test_capture_runs_no_pricing_query(self, django_assert_num_queries):
+        """Test pricing a capture reads the loaded plans, not the database."""
+        PricingCache.terms(self.merchant.pk)
+
+        with django_assert_num_queries(0):
+            assert PricingCache.terms(self.merchant.pk) == (Decimal('2.00'), Decimal('0.00'))
+
+    def test_change_in_another_process_applies_after_sync(self, settings):
+        """Test a version bumped elsewhere reloads the plans at the next sync."""
+        settings.PRICING_SYNC_INTERVAL = 3600
+        PricingCache.terms(self.merchant.pk)
+        # Saved without running its on-commit invalidation, as if in another process
+        PricingPlan.objects.create(merchant=self.merchant, percentage=Decimal('1.00'))
+        cache.add(PRICING_VERSION_KEY, 0, None)
+        cache.incr(PRICING_VERSION_KEY)
+
+        assert PricingCache.terms(self.merchant.pk) == (Decimal('2.00'), Decimal('0.00'))
+        settings.PRICING_SYNC_INTERVAL = 0
+        assert PricingCache.terms(self.merchant.pk) == (Decimal('1.00'), Decimal('0.00'))
@@ -0,0 +1,202 @@
+"""
+Query budget tests for every API route.
+
+Each endpoint is called against a merchant with few and with many rows. Its
+query count must stay within the endpoint's budget and must not grow with
+the number of rows. On failure the message shows the statements that were
+added and where they were issued from.
+"""
+import difflib
+import re
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.db import connections
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from paygate.middleware import QueryStats
+from paygate.pricing import PricingCache
+from paygate.serializers import CustomTokenObtainPairSerializer
+from paygate.services import WebhookReplayer
+from paygate.utils.token_blacklist import TokenBlacklist
+from .factories import (
+    AdminUserFactory, MerchantFactory, OrderFactory, PaymentFactory, UserFactory, WebhookLogFactory,
+)
+
+PASSWORD = 'budgetpass123'
+SMALL, LARGE = 2, 25
+
+# Queries allowed per request. Tasks are only enqueued (not run eagerly), so
+# these cover the web request alone.
+BUDGETS = {
+    'register': 4,
+    'register-admin': 5,
+    'token_obtain_pair': 2,
+    'token_refresh': 1,
+    'logout': 5,
+    'order_create': 2,
+    'payment_complete': 2,
+    'payment_process': 2,
+    # Captures and refunds also post to the ledger: accounts, entries, balances
+    'payment': 7,
+    # A refund also inserts its Refund row and re-reads the totals it updated
+    'refund_process': 8,
+    'admin_stats': 21,
+    'merchant_stats': 15,
+    'webhook_replay': 5,
+    'webhook_replay_status': 2,
+}
+
+
+class Scenario:
+    """A merchant with `size` orders, payments and webhook logs, and clients for it."""
+
+    def __init__(self, size):
+        self.merchant = MerchantFactory(user=UserFactory(password=PASSWORD))
+        self.admin = AdminUserFactory()
+        for _ in range(size):
+            payment = PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+            WebhookLogFactory(payment=payment, status='failed')
+            OrderFactory(merchant=self.merchant)
+        self.order = OrderFactory(merchant=self.merchant)
+        self.captured = PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+        now = timezone.now()
+        self.job = WebhookReplayer.start(self.merchant, now - timedelta(hours=1), now, 'failed')
+        # Tokens are minted here: minting writes an OutstandingToken row
+        self.anonymous = APIClient()
+        self.merchant_client = self.authenticated(self.merchant.user)
+        self.admin_client = self.authenticated(self.admin)
+        self.cookie_client = APIClient()
+        self.cookie_client.cookies['refresh_token'] = str(CustomTokenObtainPairSerializer.get_token(self.merchant.user))
+        self.logout_client = self.authenticated(self.merchant.user)
+        self.logout_client.cookies['refresh_token'] = str(CustomTokenObtainPairSerializer.get_token(self.merchant.user))
+
+    @staticmethod
+    def authenticated(user):
+        client = APIClient()
+        access = CustomTokenObtainPairSerializer.get_token(user).access_token
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return client
+
+
+def replay_range():
+    now = timezone.now()
+    return {'start': (now - timedelta(hours=1)).isoformat(), 'end': (now + timedelta(minutes=1)).isoformat()}
+
+
+def new_user_body():
+    return {'email': f'budget-{uuid.uuid4().hex[:10]}@example.com', 'name': 'Budget', 'password': PASSWORD}
+
+
+# URL name -> function(scenario) returning the response
+REQUESTS = {
+    'register': lambda s: s.anonymous.post(
+        '/paygate/api/v1/auth/register/', {'user': new_user_body()}, format='json'),
+    'register-admin': lambda s: s.admin_client.post(
+        '/paygate/api/v1/auth/register-admin/', {'user': new_user_body()}, format='json'),
+    'token_obtain_pair': lambda s: s.anonymous.post(
+        '/paygate/api/v1/auth/token/', {'email': s.merchant.user.email, 'password': PASSWORD}, format='json'),
+    'token_refresh': lambda s: s.cookie_client.post('/paygate/api/v1/auth/refresh/'),
+    'logout': lambda s: s.logout_client.post('/paygate/api/v1/auth/logout/'),
+    'order_create': lambda s: s.merchant_client.post(
+        '/paygate/api/v1/orders/', {'amount': '100.00', 'currency': 'INR'}, format='json'),
+    'payment_complete': lambda s: s.merchant_client.get('/paygate/api/v1/payment-complete/'),
+    'payment_process': lambda s: s.merchant_client.get('/paygate/api/v1/payment-process/'),
+    'payment': lambda s: s.merchant_client.post('/paygate/api/v1/payments/', {
+        'order_id': s.order.order_id,
+        'card_details': {'card_number': '4111111111111111', 'expiry': '12/30', 'cvv': '123'},
+    }, format='json'),
+    'refund_process': lambda s: s.merchant_client.post(
+        '/paygate/api/v1/refunds/', {'payment_id': s.captured.payment_id}, format='json'),
+    'admin_stats': lambda s: s.admin_client.get('/paygate/api/v1/admin/stats/'),
+    'merchant_stats': lambda s: s.merchant_client.get('/paygate/api/v1/merchants/stats/'),
+    'webhook_replay': lambda s: s.merchant_client.post(
+        '/paygate/api/v1/webhooks/replay/', {**replay_range(), 'status': 'failed'}, format='json'),
+    'webhook_replay_status': lambda s: s.merchant_client.get(
+        f'/paygate/api/v1/webhooks/replay/{s.job.job_id}/'),
+}
+
+
+def normalize(sql):
+    """SQL with literals replaced, so the same statement on other rows compares equal."""
+    sql = re.sub(r"'[^']*'", '?', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+def record(name, scenario):
+    """
+    Run an endpoint's request and return the QueryStats of the request alone.
+    Savepoints are dropped: they come from the test's wrapping transaction
+    and are not issued in production, where atomic() opens a transaction.
+    """
+    stats = QueryStats(trace=True)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        response = REQUESTS[name](scenario)
+    assert response.status_code == 200, response.content
+    body = response.json()
+    assert body['success'] is True, body
+    stats.queries = [query for query in stats.queries if 'SAVEPOINT' not in query[0]]
+    stats.count = len(stats.queries)
+    return stats
+
+
+def explain(name, small, large):
+    """Readable report of the statements the larger data set added."""
+    before = [normalize(sql) for sql, _, _ in small.queries]
+    after = [normalize(sql) for sql, _, _ in large.queries]
+    lines = [
+        f'{name}: {small.count} queries with {SMALL} rows, {large.count} with {LARGE} rows '
+        f'(budget {BUDGETS[name]})',
+    ]
+    lines += [
+        line for line in difflib.unified_diff(before, after, 'small', 'large', lineterm='', n=0)
+        if not line.startswith('@@')
+    ]
+    grown = Counter(after) - Counter(before)
+    for sql, extra in grown.most_common(3):
+        stack = next(stack for query, _, stack in large.queries if normalize(query) == sql)
+        lines.append(f'\n+{extra} x {sql}\n  issued from:\n    ' + '\n    '.join(stack[-5:]))
+    return '\n'.join(lines)
+
+
+@pytest.mark.django_db
+class TestQueryBudgets:
+    """Test every endpoint stays within its query budget at any data size."""
+
+    @pytest.fixture(autouse=True)
+    def enqueue_only(self, settings):
+        """Publish tasks to the in-memory broker instead of running them in the request."""
+        settings.CELERY_TASK_ALWAYS_EAGER = False
+        # One balance slot, created with the scenario, so no request creates a slot row
+        settings.MERCHANT_BALANCE_SLOTS = 1
+        # Load the refresh token blacklist filter outside the measured requests
+        TokenBlacklist.reset()
+        TokenBlacklist.warm()
+        # Likewise the pricing plans read at capture
+        PricingCache.reset()
+        PricingCache.terms(None)
+        with patch('paygate.services.random.random', return_value=0.1):
+            yield
+
+    def test_every_route_has_a_budget(self):
+        """Test new routes cannot be added without a query budget."""
+        from paygate.urls import urlpatterns
+
+        assert {pattern.name for pattern in urlpatterns} == set(BUDGETS) == set(REQUESTS)
+
+    @pytest.mark.parametrize('name', sorted(BUDGETS))
+    def test_query_count_within_budget_and_constant(self, name):
+        """Test the endpoint's queries do not grow with rows and stay within budget."""
+        small = record(name, Scenario(SMALL))
+        large = record(name, Scenario(LARGE))
+
+        report = explain(name, small, large)
+        assert large.count == small.count, report
+        assert large.count <= BUDGETS[name], report
@@ -0,0 +1,190 @@
+"""
+Tests for the token bucket / sliding window rate limiter.
+"""
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from rest_framework.test import APIClient
+
+from paygate.serializers import CustomTokenObtainPairSerializer
+from paygate.utils.error_codes_constants import ErrorCodes
+from paygate.utils.ratelimit import LocalRateLimitBackend, RateLimiter, RateLimitRule, RedisRateLimitBackend
+from .factories import MerchantFactory
+
+
+def hit(limiter, *identities):
+    return limiter.hit(list(identities))
+
+
+class TestRateLimiter:
+    """Test limiter decisions on the in-process backend."""
+
+    def setup_method(self):
+        self.limiter = RateLimiter(LocalRateLimitBackend())
+
+    def test_bucket_allows_burst_then_refuses(self):
+        """Test a bucket refuses once its burst is spent."""
+        rule = RateLimitRule(burst=3, rate=0.001, limit=100, window=60)
+
+        results = [hit(self.limiter, ('m:1', rule)) for _ in range(4)]
+
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results[:3]] == [2, 1, 0]
+        assert results[0].limit == 3
+        assert results[3].retry_after > 0
+
+    def test_window_limit_refuses_past_limit(self):
+        """Test the sliding window caps requests even with tokens left."""
+        rule = RateLimitRule(burst=100, rate=100, limit=2, window=60)
+
+        results = [hit(self.limiter, ('m:1', rule)) for _ in range(3)]
+
+        assert [r.allowed for r in results] == [True, True, False]
+        assert results[0].limit == 2
+        assert 0 < results[2].reset <= 60
+
+    def test_refused_request_consumes_no_identity(self):
+        """Test a request refused by one identity is not counted against the others."""
+        roomy = RateLimitRule(burst=10, rate=0.001, limit=100, window=60)
+        tight = RateLimitRule(burst=1, rate=0.001, limit=100, window=60)
+        backend = LocalRateLimitBackend()
+
+        backend.hit(['m:1', 'k:1'], [roomy, tight])
+        backend.hit(['m:1', 'k:1'], [roomy, tight])
+        allowed, remaining = backend.hit(['m:1'], [roomy])[:2]
+
+        assert allowed == 1
+        assert remaining == 8
+
+    def test_refused_identity_skips_backend(self):
+        """Test recently refused identities are turned away in process."""
+        backend = MagicMock()
+        backend.hit.return_value = [0, 0, 1, 5000, 1_000_000]
+        limiter = RateLimiter(backend)
+        rule = RateLimitRule(burst=1, rate=1, limit=1, window=60)
+
+        first = hit(limiter, ('m:1', rule))
+        second = hit(limiter, ('m:1', rule))
+
+        assert not first.allowed and not second.allowed
+        assert backend.hit.call_count == 1
+        assert second.retry_after == 5
+
+    def test_backend_failure_falls_back_to_local_limits(self):
+        """Test requests are still limited when Redis is unreachable."""
+        backend = MagicMock()
+        backend.hit.side_effect = ConnectionError
+        limiter = RateLimiter(backend)
+        rule = RateLimitRule(burst=1, rate=0.001, limit=10, window=60)
+
+        assert hit(limiter, ('m:1', rule)).allowed
+        assert not hit(limiter, ('m:1', rule)).allowed
+
+
+class TestRedisBackend:
+    """Test TOKEN_BUCKET_SCRIPT on fakeredis, which runs Lua like Redis does."""
+
+    @pytest.fixture(autouse=True)
+    def redis_backend(self):
+        """Set up the Redis backend on an in-memory server."""
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        with patch('redis.Redis.from_url', return_value=fakeredis.FakeRedis()) as from_url:
+            self.backend = RedisRateLimitBackend('redis://localhost:6379/2', 0.1)
+        from_url.assert_called_once_with('redis://localhost:6379/2', socket_timeout=0.1, socket_connect_timeout=0.1)
+        self.limiter = RateLimiter(self.backend)
+
+    def test_bucket_allows_burst_then_refuses(self):
+        """Test the script refuses once the burst is spent and reports the bucket quota."""
+        rule = RateLimitRule(burst=3, rate=0.001, limit=100, window=60)
+
+        results = [hit(self.limiter, ('m:1', rule)) for _ in range(4)]
+
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results[:3]] == [2, 1, 0]
+        assert results[0].limit == 3
+        assert results[3].retry_after > 0
+
+    def test_window_limit_refuses_past_limit(self):
+        """Test the script's sliding window caps requests even with tokens left."""
+        rule = RateLimitRule(burst=100, rate=100, limit=2, window=60)
+
+        results = [hit(self.limiter, ('m:1', rule)) for _ in range(3)]
+
+        assert [r.allowed for r in results] == [True, True, False]
+        assert results[0].limit == 2
+        assert 0 < results[2].reset <= 60
+
+    def test_refused_request_consumes_no_identity(self):
+        """Test a request refused by one key is not counted against the others."""
+        roomy = RateLimitRule(burst=10, rate=0.001, limit=100, window=60)
+        tight = RateLimitRule(burst=1, rate=0.001, limit=100, window=60)
+
+        self.backend.hit(['m:1', 'k:1'], [roomy, tight])
+        self.backend.hit(['m:1', 'k:1'], [roomy, tight])
+        allowed, remaining = self.backend.hit(['m:1'], [roomy])[:2]
+
+        assert allowed == 1
+        assert remaining == 8
+
+
+@pytest.mark.django_db
+class TestRateLimitedViews:
+    """Test rate limiting on the API views."""
+
+    @pytest.fixture(autouse=True)
+    def small_limits(self, settings):
+        """Enable tight limits on a fresh limiter."""
+        settings.RATELIMIT_ENABLE = True
+        settings.RATE_LIMITS = {
+            'merchant': {'burst': 2, 'rate': 0.001, 'limit': 100, 'window': 60},
+            'api_key': {'burst': 1, 'rate': 0.001, 'limit': 100, 'window': 60},
+            'ip': {'burst': 2, 'rate': 0.001, 'limit': 100, 'window': 60},
+        }
+        with patch('paygate.utils.mixins.get_rate_limiter', return_value=RateLimiter(LocalRateLimitBackend())):
+            yield
+
+    def setup_method(self):
+        """Set up an authenticated merchant client."""
+        self.client = APIClient()
+        self.merchant = MerchantFactory()
+        access = CustomTokenObtainPairSerializer.get_token(self.merchant.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.url = '/paygate/api/v1/payment-process/'
+
+    def test_headers_and_429_per_merchant(self):
+        """Test quota headers are sent and the merchant is refused past its bucket."""
+        responses = [self.client.get(self.url) for _ in range(3)]
+
+        assert [r.status_code for r in responses] == [200, 200, 429]
+        assert responses[0]['RateLimit-Limit'] == '2'
+        assert responses[0]['RateLimit-Remaining'] == '1'
+        assert 'RateLimit-Reset' in responses[0]
+        assert 'Retry-After' in responses[2]
+        assert json.loads(responses[2].content)['exception']['code'] == ErrorCodes.RATE_LIMIT_EXCEEDED
+
+    def test_api_key_bucket_is_separate(self):
+        """Test an API key bucket limits on top of the merchant bucket."""
+        first = self.client.get(self.url, HTTP_X_API_KEY='integration-a')
+        second = self.client.get(self.url, HTTP_X_API_KEY='integration-a')
+
+        assert first.status_code == 200
+        assert second.status_code == 429
+
+    def test_anonymous_requests_limited_per_ip(self):
+        """Test anonymous endpoints are limited by client IP."""
+        client = APIClient()
+        responses = [client.post('/paygate/api/v1/auth/refresh/') for _ in range(3)]
+
+        assert [r.status_code for r in responses] == [200, 200, 429]
+
+    def test_one_bucket_per_request(self):
+        """Test merchant requests leave the IP bucket alone, which then limits failed authentication."""
+        merchant_responses = [self.client.get(self.url) for _ in range(3)]
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        failed_responses = [client.get(self.url) for _ in range(3)]
+
+        assert [r.status_code for r in merchant_responses] == [200, 200, 429]
+        assert [r.status_code for r in failed_responses] == [401, 401, 429]
+        assert failed_responses[0]['RateLimit-Limit'] == '2'
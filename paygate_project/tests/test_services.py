@@ -3,13 +3,22 @@ Tests for paygate service layer (PaymentProcessor and WebhookHandler).
 """
 import pytest
 import json
+import hashlib
+import hmac
 from decimal import Decimal
 from unittest.mock import patch, MagicMock, call
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
 
 from paygate.services import PaymentProcessor, WebhookHandler
-from paygate.models import Payment, WebhookLog
+from paygate.models import LedgerEntry, Payment, WebhookLog
+from paygate.routing import check_lane_workers, webhook_lane
+from paygate.tasks import send_webhook_task
+from paygate_project.celery import app as celery_app
+from paygate.utils.signing import serialize_payload
 from .factories import (
     UserFactory, MerchantFactory, OrderFactory, 
     PaymentFactory, WebhookLogFactory
@@ -269,8 +278,34 @@ class TestPaymentCaptureAndVoid:
             payment.refresh_from_db()
             assert payment.status == original_status  # Status unchanged
 
+    def test_concurrent_capture_posted_once(self):
+        """Test a capture from a stale copy of the payment loses and posts nothing."""
+        payment = PaymentFactory(order=self.order, status='authorized')
+        first = Payment.objects.select_related('order').get(pk=payment.pk)
+        stale = Payment.objects.select_related('order').get(pk=payment.pk)
 
-@pytest.mark.django_db
+        with patch('random.random', return_value=0.5):
+            assert PaymentProcessor.capture_authorized_payment(first) is True
+            assert PaymentProcessor.capture_authorized_payment(stale) is False
+
+        assert stale.status == 'captured'
+        assert LedgerEntry.objects.filter(payment=payment, entry_type='capture').count() == 2
+
+    def test_refreshed_instance_does_not_post_again(self):
+        """Test refresh_from_db() moves the status the next save compares with."""
+        payment = PaymentFactory(order=self.order, status='authorized')
+        other = Payment.objects.get(pk=payment.pk)
+        other.status = 'captured'
+        other.save()
+
+        payment.refresh_from_db()
+        payment.save()
+
+        assert LedgerEntry.objects.filter(payment=payment, entry_type='capture').count() == 2
+
+
+# Webhooks are enqueued when the transaction commits, so run without the wrapping test transaction
+@pytest.mark.django_db(transaction=True)
 class TestWebhookHandler:
     """Test WebhookHandler service."""
 
@@ -435,7 +470,217 @@ class TestWebhookHandler:
         assert 'payment.captured' in events
 
 
+# Webhooks are enqueued when the transaction commits, so run without the wrapping test transaction
+@pytest.mark.django_db(transaction=True)
+class TestWebhookTask:
+    """Test that webhook delivery works from the enqueue-time snapshot."""
+
+    def setup_method(self):
+        """Set up test data for each test."""
+        self.merchant = MerchantFactory(webhook_url='https://example.com/webhook')
+        self.order = OrderFactory(merchant=self.merchant)
+        self.payment = PaymentFactory(order=self.order, status='authorized')
+
+    def test_send_webhook_enqueues_snapshot_and_signature(self):
+        """Test the task receives the payload and its signature, not ids to re-read."""
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            WebhookHandler.send_webhook(self.payment, self.merchant)
+
+        payment_pk, webhook_url, payload, signature = mock_delay.call_args.args
+        assert payment_pk == self.payment.pk
+        assert webhook_url == 'https://example.com/webhook'
+        assert payload == WebhookHandler.build_payload(self.payment)
+        expected = hmac.new(
+            self.merchant.webhook_secret.encode(), serialize_payload(payload), hashlib.sha256
+        ).hexdigest()
+        assert signature == expected
+
+    def test_snapshot_keeps_status_of_triggering_event(self):
+        """Test a later status change does not leak into an already enqueued event."""
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            WebhookHandler.send_webhook(self.payment, self.merchant)
+        self.payment.status = 'captured'
+        self.payment.save()
+
+        payload = mock_delay.call_args.args[2]
+        with patch('random.random', return_value=0.5):
+            send_webhook_task.apply(args=mock_delay.call_args.args)
+
+        webhook_log = WebhookLog.objects.get(payment=self.payment)
+        assert payload['status'] == 'authorized'
+        assert webhook_log.payload['event'] == 'payment.authorized'
+
+    def test_delivery_attempt_does_not_read_database(self, django_assert_num_queries):
+        """Test a delivery attempt only inserts its WebhookLog row."""
+        payload = WebhookHandler.build_payload(self.payment)
+
+        with patch('random.random', return_value=0.5), django_assert_num_queries(1) as captured:
+            send_webhook_task.apply(args=(self.payment.pk, self.merchant.webhook_url, payload, 'sig'))
+
+        assert captured.captured_queries[0]['sql'].startswith('INSERT')
+
+
+# Webhooks are enqueued when the transaction commits, so run without the wrapping test transaction
+@pytest.mark.django_db(transaction=True)
+class TestWebhookDeduplication:
+    """Test that each logical payment event is enqueued exactly once."""
+
+    def setup_method(self):
+        """Set up test data for each test."""
+        self.merchant = MerchantFactory(webhook_url='https://example.com/webhook')
+        self.order = OrderFactory(merchant=self.merchant, amount=Decimal('100.00'))
+
+    @staticmethod
+    def enqueued_events(mock_delay):
+        return [(c.args[2]['payment_id'], c.args[2]['event']) for c in mock_delay.call_args_list]
+
+    def test_repeated_calls_collapse_to_one_task(self):
+        """Test any number of callers for the same event enqueue one task."""
+        payment = PaymentFactory(order=self.order, status='captured')
+
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            results = [WebhookHandler.send_webhook(payment, self.merchant) for _ in range(3)]
+
+        assert results == [True, True, True]
+        assert mock_delay.call_count == 1
+
+    def test_status_change_is_a_new_event(self):
+        """Test a new status version is delivered even for a repeated status."""
+        payment = PaymentFactory(order=self.order, status='authorized')
+
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            WebhookHandler.send_webhook(payment, self.merchant)
+            payment.status = 'captured'
+            payment.save()
+            WebhookHandler.send_webhook(payment, self.merchant)
+            WebhookHandler.send_webhook(payment, self.merchant)
+
+        assert payment.status_version == 2
+        assert [event for _, event in self.enqueued_events(mock_delay)] == [
+            'payment.authorized', 'payment.captured'
+        ]
+
+    def test_missing_webhook_url_logs_once(self):
+        """Test duplicate calls without a webhook URL write a single failure log."""
+        merchant = MerchantFactory(webhook_url='')
+        payment = PaymentFactory(order=OrderFactory(merchant=merchant), status='captured')
+
+        results = [WebhookHandler.send_webhook(payment, merchant) for _ in range(2)]
+
+        assert results == [False, False]
+        assert WebhookLog.objects.filter(payment=payment).count() == 1
+
+    def test_one_task_per_event_across_service_paths(self):
+        """Test authorize, capture and refund (service and API) each enqueue one task."""
+        client = APIClient()
+        client.force_authenticate(user=self.merchant.user)
+        card_details = {'card_number': '4111111111111111', 'expiry': '12/25', 'cvv': '123'}
+
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            # Authorized but not captured, then captured separately
+            with patch('random.random', side_effect=[0.5, 0.96]):
+                payment, _ = PaymentProcessor.process_payment(self.order, card_details)
+            with patch('random.random', return_value=0.5):
+                PaymentProcessor.capture_authorized_payment(payment)
+                # process_refund and RefundProcessView both raise the refund event
+                response = client.post(
+                    '/paygate/api/v1/refunds/', {'payment_id': payment.payment_id}, format='json'
+                )
+
+        assert json.loads(response.content)['success'] is True
+        payment_id = str(payment.payment_id)
+        assert self.enqueued_events(mock_delay) == [
+            (payment_id, 'payment.authorized'),
+            (payment_id, 'payment.captured'),
+            (payment_id, 'payment.refunded'),
+        ]
+
+    def test_rolled_back_event_not_claimed(self):
+        """Test an event raised in a rolled-back transaction is neither sent nor suppressed."""
+        payment = PaymentFactory(order=self.order, status='captured')
+
+        with patch('paygate.services.send_webhook_task.delay') as mock_delay:
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    WebhookHandler.send_webhook(payment, self.merchant)
+                    raise RuntimeError('capture failed')
+            assert mock_delay.call_count == 0
+
+            WebhookHandler.send_webhook(payment, self.merchant)
+
+        assert mock_delay.call_count == 1
+
+    def test_broker_error_releases_event(self):
+        """Test an event whose enqueue failed is sent by the next call."""
+        payment = PaymentFactory(order=self.order, status='captured')
+
+        with patch('paygate.services.send_webhook_task.delay', side_effect=[ConnectionError('broker down'), None]) as mock_delay:
+            with pytest.raises(ConnectionError):
+                WebhookHandler.send_webhook(payment, self.merchant)
+            WebhookHandler.send_webhook(payment, self.merchant)
+
+        assert mock_delay.call_count == 2
+
+
 @pytest.mark.django_db
+class TestWebhookLanes:
+    """Test webhooks are partitioned onto lanes by payment."""
+
+    def setup_method(self):
+        """Set up test data for each test."""
+        self.merchant = MerchantFactory(webhook_url='https://example.com/webhook')
+        self.order = OrderFactory(merchant=self.merchant)
+
+    @staticmethod
+    def route(payment, **options):
+        args = (payment.pk, 'https://example.com/webhook', WebhookHandler.build_payload(payment), 'sig')
+        return celery_app.amqp.router.route(options, 'paygate.tasks.send_webhook_task', args)['queue'].name
+
+    def test_events_of_a_payment_share_a_lane(self):
+        """Test every event of one payment is routed to the same lane queue."""
+        payment = PaymentFactory(order=self.order, status='authorized')
+        authorized_queue = self.route(payment)
+        payment.status = 'captured'
+        payment.save()
+
+        assert authorized_queue == self.route(payment)
+        assert authorized_queue == f'webhooks.lane.{webhook_lane(payment.payment_id)}'
+
+    def test_payments_spread_across_lanes(self, settings):
+        """Test payments are spread over the configured number of lanes."""
+        settings.WEBHOOK_DELIVERY_LANES = 3
+        lanes = {webhook_lane(PaymentFactory(order=self.order).payment_id) for _ in range(30)}
+
+        assert lanes == {0, 1, 2}
+
+    def test_retries_leave_the_lane(self):
+        """Test an explicit queue, as used by retries, overrides the lane route."""
+        payment = PaymentFactory(order=self.order, status='captured')
+
+        assert self.route(payment, queue='webhook_retries') == 'webhook_retries'
+
+    def test_payload_carries_sequence(self):
+        """Test payloads expose the status version so receivers can order events."""
+        payment = PaymentFactory(order=self.order, status='authorized')
+        first = WebhookHandler.build_payload(payment)
+        payment.status = 'captured'
+        payment.save()
+
+        assert WebhookHandler.build_payload(payment)['sequence'] == first['sequence'] + 1
+
+    def test_lane_worker_count_checked_at_startup(self, settings, monkeypatch):
+        """Test lane workers refuse to start when there are more lanes than lane workers."""
+        settings.WEBHOOK_DELIVERY_LANES = 8
+        monkeypatch.setenv('WEBHOOK_LANE_WORKERS', '4')
+
+        with pytest.raises(ImproperlyConfigured):
+            check_lane_workers()
+        monkeypatch.setenv('WEBHOOK_LANE_WORKERS', '8')
+        check_lane_workers()
+
+
+# Webhooks are enqueued when the transaction commits, so run without the wrapping test transaction
+@pytest.mark.django_db(transaction=True)
 class TestServiceIntegration:
     """Test integration between PaymentProcessor and WebhookHandler."""
 
@@ -447,8 +692,8 @@ class TestServiceIntegration:
     @patch('random.random')
     def test_payment_to_webhook_flow(self, mock_random):
         """Test complete flow from payment processing to webhook."""
-        # Mock successful payment
-        mock_random.side_effect = [0.5, 0.5]
+        # Mock successful payment (authorize, capture) and its webhook delivery
+        mock_random.side_effect = [0.5, 0.5, 0.5]
 
         card_details = {
             'card_number': '4111111111111111',
@@ -0,0 +1,105 @@
+"""
+Tests for daily settlement batches and merchant payouts.
+"""
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+
+from paygate.ledger import Ledger
+from paygate.models import LedgerEntry, Payment, Payout, SettlementBatch
+from paygate.settlement import SettlementEngine
+from paygate.tasks import settle_merchants_task
+from .factories import MerchantFactory, OrderFactory, PaymentFactory
+
+
+def capture(merchant, amount, at=None):
+    """Capture a payment, with its ledger entries posted at `at`."""
+    payment = PaymentFactory(order=OrderFactory(merchant=merchant, amount=Decimal(amount)), status='captured')
+    if at is not None:
+        LedgerEntry.objects.filter(payment=payment).update(created_at=at)
+    return payment
+
+
+def run(cutoff):
+    batch, chunks = SettlementEngine.start(cutoff)
+    for chunk in chunks:
+        SettlementEngine.settle_chunk(batch.pk, *chunk)
+    batch.refresh_from_db()
+    return batch
+
+
+@pytest.mark.django_db
+class TestSettlement:
+    """Test settlement batches pay out ledger balances as of the cutoff."""
+
+    def setup_method(self):
+        """Set up a merchant with one capture before the cutoff and one after."""
+        self.cutoff = timezone.now() - timedelta(hours=1)
+        self.merchant = MerchantFactory()
+        self.settled = capture(self.merchant, '100.00', at=self.cutoff - timedelta(hours=2))
+        self.later = capture(self.merchant, '50.00')
+
+    def test_pays_balance_at_cutoff(self):
+        """Test the payout covers entries before the cutoff and marks their payments."""
+        batch = run(self.cutoff)
+
+        payout = Payout.objects.get(batch=batch, merchant=self.merchant)
+        assert payout.amount == Decimal('98.00')
+        assert payout.payment_count == 1
+        assert Payment.objects.get(pk=self.settled.pk).settlement_batch == batch
+        assert Payment.objects.get(pk=self.later.pk).settlement_batch is None
+        assert Ledger.balance(self.merchant) == Decimal('49.00')
+        assert (batch.status, batch.merchant_count, batch.payment_count, batch.total_amount) == (
+            'completed', 1, 1, Decimal('98.00'),
+        )
+
+    def test_rerun_pays_nothing_twice(self):
+        """Test running the same cutoff again, or a redelivered chunk, adds no payouts."""
+        batch = run(self.cutoff)
+
+        again, chunks = SettlementEngine.start(self.cutoff)
+        assert again == batch and chunks == []
+        assert SettlementEngine.settle_chunk(batch.pk, self.merchant.pk, self.merchant.pk) == 0
+        assert Payout.objects.count() == 1
+        assert Ledger.balance(self.merchant) == Decimal('49.00')
+
+    def test_next_batch_pays_only_what_is_new(self):
+        """Test a later batch pays the captures since the previous cutoff, however late the first ran."""
+        first = run(self.cutoff)
+        second = run(timezone.now() + timedelta(minutes=1))
+
+        assert second.window_start == first.cutoff
+        assert Payout.objects.get(batch=second).amount == Decimal('49.00')
+        assert Payment.objects.get(pk=self.later.pk).settlement_batch == second
+        assert Ledger.balance(self.merchant) == Decimal('0.00')
+
+    def test_negative_balance_carried_forward(self):
+        """Test a merchant whose refunds exceed their earnings is paid nothing and owes it next time."""
+        merchant = MerchantFactory()
+        refunded = capture(merchant, '100.00')
+        refunded.full_refund()
+        LedgerEntry.objects.filter(payment=refunded).update(created_at=self.cutoff - timedelta(minutes=5))
+
+        payout = Payout.objects.get(batch=run(self.cutoff), merchant=merchant)
+        assert (payout.balance, payout.amount) == (Decimal('-2.00'), Decimal('0.00'))
+        assert not LedgerEntry.objects.filter(entry_type='payout', account__merchant=merchant).exists()
+
+        capture(merchant, '50.00')
+        payout = Payout.objects.get(batch=run(timezone.now() + timedelta(minutes=1)), merchant=merchant)
+        assert payout.amount == Decimal('47.00')
+
+    def test_chunks_settled_by_tasks(self, settings):
+        """Test the beat task queues a chunk per SETTLEMENT_CHUNK_SIZE merchants and completes the batch."""
+        settings.SETTLEMENT_CHUNK_SIZE = 2
+        midnight = SettlementEngine.cutoff()
+        for _ in range(4):
+            capture(MerchantFactory(), '10.00', at=midnight - timedelta(hours=1))
+        LedgerEntry.objects.filter(payment__in=[self.settled, self.later]).update(created_at=midnight - timedelta(hours=1))
+
+        assert settle_merchants_task.delay().get() == 3
+
+        batch = SettlementBatch.objects.get(cutoff=midnight)
+        assert batch.status == 'completed'
+        assert batch.merchant_count == batch.payouts.count() == 5
+        assert batch.total_amount == Decimal('4') * Decimal('9.80') + Decimal('147.00')
@@ -0,0 +1,169 @@
+"""
+Tests for merchant-triggered webhook replay.
+"""
+import json
+import pytest
+from datetime import timedelta
+from unittest.mock import patch
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from paygate.models import WebhookLog, WebhookReplayJob
+from paygate.services import WebhookReplayer
+from paygate.utils.error_codes_constants import ErrorCodes
+from .factories import UserFactory, MerchantFactory, OrderFactory, PaymentFactory, WebhookLogFactory
+
+
+def parse_response(response):
+    """Helper function to parse Django JsonResponse."""
+    return json.loads(response.content)
+
+
+@pytest.mark.django_db
+class TestWebhookReplayer:
+    """Test batched replay of logged webhooks."""
+
+    def setup_method(self):
+        """Set up a merchant with sent and failed logs inside and outside the range."""
+        self.now = timezone.now()
+        self.merchant = MerchantFactory()
+        # One event per payment
+        self.sent = [
+            WebhookLogFactory(payment=PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured'), status='sent')
+            for _ in range(3)
+        ]
+        payment = PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+        self.failed = WebhookLogFactory(payment=payment, status='failed')
+        old = WebhookLogFactory(payment=PaymentFactory(order=OrderFactory(merchant=self.merchant)), status='failed')
+        WebhookLog.objects.filter(pk=old.pk).update(created_at=self.now - timedelta(days=10))
+        # Another merchant's log in the same window is never replayed
+        WebhookLogFactory(status='sent')
+
+    @override_settings(WEBHOOK_REPLAY_BATCH_SIZE=2)
+    def test_replay_enqueues_matching_logs_in_batches(self):
+        """Test every matching log is redelivered and the job completes."""
+        with patch('paygate.services.send_webhook_task.apply_async') as mock_send:
+            job = WebhookReplayer.start(self.merchant, self.now - timedelta(days=1), self.now + timedelta(minutes=1))
+
+        job.refresh_from_db()
+        assert job.status == 'completed'
+        assert job.total == job.enqueued == 4
+        assert job.last_log_id == self.failed.pk
+        assert job.last_log_created_at == WebhookLog.objects.get(pk=self.failed.pk).created_at
+        assert mock_send.call_count == 4
+        payment_pk, url, payload, signature = mock_send.call_args_list[0].args[0]
+        assert url == self.merchant.webhook_url
+        assert payload == self.sent[0].payload
+
+    def test_replay_reads_logs_without_joins(self):
+        """Test batches filter on the log's own merchant rather than joining through orders."""
+        job = WebhookReplayJob.objects.create(
+            merchant=self.merchant, start=self.now - timedelta(days=1), end=self.now + timedelta(minutes=1),
+            max_log_id=self.failed.pk,
+        )
+        with patch('paygate.services.send_webhook_task.apply_async'), CaptureQueriesContext(connection) as queries:
+            WebhookReplayer.run_batch(job.pk)
+
+        log_reads = [q['sql'] for q in queries.captured_queries if 'FROM "paygate_webhooklog"' in q['sql']]
+        assert len(log_reads) == 1
+        assert 'JOIN' not in log_reads[0]
+
+    def test_log_created_without_merchant_takes_payments(self):
+        """Test a log written with only its payment is stored under that payment's merchant."""
+        payment = PaymentFactory(order=OrderFactory(merchant=self.merchant))
+        log = WebhookLog.objects.create(payment_id=payment.pk, payload={'event': 'payment.captured'}, status='sent')
+
+        log.refresh_from_db()
+        assert log.merchant_id == self.merchant.pk
+
+    def test_replay_filters_by_status(self):
+        """Test only logs with the requested delivery status are replayed."""
+        with patch('paygate.services.send_webhook_task.apply_async') as mock_send:
+            job = WebhookReplayer.start(
+                self.merchant, self.now - timedelta(days=30), self.now + timedelta(minutes=1), 'failed'
+            )
+
+        job.refresh_from_db()
+        assert job.total == job.enqueued == 2
+        assert mock_send.call_count == 2
+
+    def test_replay_skips_logs_without_event(self):
+        """Test logs recorded for a missing webhook URL are not redelivered."""
+        WebhookLog.objects.filter(pk=self.failed.pk).update(payload={'error': 'No webhook URL configured'})
+
+        with patch('paygate.services.send_webhook_task.apply_async') as mock_send:
+            WebhookReplayer.start(self.merchant, self.now - timedelta(days=1), self.now + timedelta(minutes=1))
+
+        assert mock_send.call_count == 3
+
+    def test_retried_event_replayed_once(self):
+        """Test an event logged once per delivery attempt is redelivered once, and only that is counted."""
+        payment = self.failed.payment
+        for status in ('failed', 'sent'):
+            WebhookLogFactory(payment=payment, status=status, payload=self.failed.payload)
+
+        with override_settings(WEBHOOK_REPLAY_BATCH_SIZE=2), \
+                patch('paygate.services.send_webhook_task.apply_async') as mock_send:
+            job = WebhookReplayer.start(self.merchant, self.now - timedelta(days=1), self.now + timedelta(minutes=1))
+
+        job.refresh_from_db()
+        assert (job.total, job.enqueued) == (6, 4)
+        events = [call.args[0][2]['payment_id'] for call in mock_send.call_args_list]
+        assert events.count(str(payment.payment_id)) == 1
+
+
+@pytest.mark.django_db
+class TestWebhookReplayAPI:
+    """Test the replay endpoints."""
+
+    def setup_method(self):
+        """Set up an authenticated merchant with one logged webhook."""
+        self.client = APIClient()
+        self.url = '/paygate/api/v1/webhooks/replay/'
+        self.user = UserFactory()
+        self.merchant = MerchantFactory(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        payment = PaymentFactory(order=OrderFactory(merchant=self.merchant), status='captured')
+        WebhookLogFactory(payment=payment, status='failed')
+        self.now = timezone.now()
+
+    def test_replay_and_poll_progress(self):
+        """Test a replay job can be started and its progress polled."""
+        data = {
+            'start': (self.now - timedelta(hours=1)).isoformat(),
+            'end': (self.now + timedelta(minutes=1)).isoformat(),
+            'status': 'failed',
+        }
+        with patch('random.random', return_value=0.5):
+            response = self.client.post(self.url, data, format='json')
+
+        response_data = parse_response(response)
+        assert response_data['success'] is True
+        job_id = response_data['data']['job_id']
+        assert response_data['data']['total'] == 1
+
+        progress = parse_response(self.client.get(f'{self.url}{job_id}/'))
+        assert progress['data']['status'] == 'completed'
+        assert progress['data']['enqueued'] == 1
+        assert WebhookLog.objects.filter(status='sent').count() == 1
+
+    def test_replay_rejects_invalid_range(self):
+        """Test a missing or reversed range is rejected."""
+        data = {'start': self.now.isoformat(), 'end': (self.now - timedelta(hours=1)).isoformat()}
+
+        response_data = parse_response(self.client.post(self.url, data, format='json'))
+
+        assert response_data['success'] is False
+        assert response_data['exception']['code'] == ErrorCodes.WEBHOOK_REPLAY_INVALID_RANGE
+        assert not WebhookReplayJob.objects.exists()
+
+    def test_progress_of_other_merchants_job_not_found(self):
+        """Test merchants cannot poll each other's jobs."""
+        job = WebhookReplayJob.objects.create(merchant=MerchantFactory(), start=self.now, end=self.now)
+
+        response_data = parse_response(self.client.get(f'{self.url}{job.job_id}/'))
+
+        assert response_data['exception']['code'] == ErrorCodes.WEBHOOK_REPLAY_NOT_FOUND